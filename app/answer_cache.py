@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+import faiss
+import numpy as np
+from app.config import VECTOR_DIM, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_THRESHOLD
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SemanticAnswerCache:
+    """
+    语义回答缓存
+
+    以往问题的嵌入向量保存在一个小的内积索引中。新问题与某个以往问题的余弦相似度不低于 threshold，
+    且问题类型相同、检索到的文本块完全相同时，直接返回当时生成的回答，不再调用 DeepSeek。
+    被引用的文档修改或删除后（文本块不再存在），相关条目在 evict_stale() 中移除。
+    同一集合中 chunk_id 不会重复使用（包括全部重建），内容变化的文本块总是有新的 ID。
+    """
+
+    def __init__(self, dim=VECTOR_DIM, threshold=ANSWER_CACHE_THRESHOLD, maxsize=ANSWER_CACHE_SIZE,
+                 ttl=ANSWER_CACHE_TTL, candidates=8):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.candidates = candidates
+        self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        # 条目ID -> (问题类型, 文本块ID, 回答, 过期时间)，按最近使用排序
+        self._entries = OrderedDict()
+        self._next_id = 0
+        self._generation = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def chunk_key(retrieved_chunks):
+        """检索结果对应的 (集合, 文本块ID) 集合，有结果缺少 chunk_id 时返回 None（不缓存）"""
+        chunk_ids = [(chunk.get("collection"), chunk.get("chunk_id")) if chunk.get("chunk_id") is not None else None
+                     for chunk in retrieved_chunks if isinstance(chunk, Mapping)]
+        if not chunk_ids or len(chunk_ids) != len(retrieved_chunks) or None in chunk_ids:
+            return None
+        return tuple(sorted(chunk_ids))
+
+    def _remove(self, entry_ids):
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+        if entry_ids:
+            self._index.remove_ids(np.asarray(entry_ids, dtype='int64'))
+
+    def lookup(self, embedding, chunk_ids, question_type):
+        """查找可复用的回答，没有时返回 None"""
+        if embedding is None or chunk_ids is None or self.maxsize <= 0:
+            return None
+        with self._lock:
+            if self._index.ntotal > 0:
+                query = np.asarray(embedding, dtype='float32').reshape(1, -1)
+                scores, ids = self._index.search(query, min(self.candidates, self._index.ntotal))
+                now = time.monotonic()
+                expired = []
+                for score, entry_id in zip(scores[0].tolist(), ids[0].tolist()):
+                    if entry_id < 0 or score < self.threshold:
+                        break
+                    cached_type, cached_chunks, answer, expires = self._entries[entry_id]
+                    if expires <= now:
+                        expired.append(entry_id)
+                        continue
+                    if cached_type == question_type and cached_chunks == chunk_ids:
+                        self._entries.move_to_end(entry_id)
+                        self._remove(expired)
+                        self.hits += 1
+                        logger.info(f"语义回答缓存命中，相似度 {score:.3f}")
+                        return answer
+                self._remove(expired)
+            self.misses += 1
+            return None
+
+    def store(self, embedding, chunk_ids, question_type, answer):
+        """保存成功生成的回答"""
+        if embedding is None or chunk_ids is None or self.maxsize <= 0:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(np.asarray(embedding, dtype='float32').reshape(1, -1),
+                                     np.asarray([entry_id], dtype='int64'))
+            self._entries[entry_id] = (question_type, chunk_ids, answer, time.monotonic() + self.ttl)
+            # 超出容量时淘汰最久未使用的条目
+            overflow = len(self._entries) - self.maxsize
+            if overflow > 0:
+                self._remove(list(self._entries)[:overflow])
+
+    def evict_stale(self, store):
+        """
+        集合版本变化后，移除引用了已不存在的文本块的条目
+
+        store 为本次查询涉及的集合（CollectionView 或索引服务的 RemoteCollectionView），
+        其他集合的条目留到查询这些集合时再检查。引用的文本块一次批量检查，检查期间不持有锁。
+        """
+        with self._lock:
+            if store.generation == self._generation:
+                return
+            self._generation = store.generation
+            entries = [(entry_id, chunk_ids) for entry_id, (_, chunk_ids, _, _) in self._entries.items()]
+        pairs = sorted({pair for _, chunk_ids in entries for pair in chunk_ids})
+        if not pairs:
+            return
+        present = dict(zip(pairs, store.contains_many(pairs)))
+        stale = [entry_id for entry_id, chunk_ids in entries if any(present[pair] is False for pair in chunk_ids)]
+        with self._lock:
+            stale = [entry_id for entry_id in stale if entry_id in self._entries]
+            self._remove(stale)
+        if stale:
+            logger.info(f"引用的文档已变化，移除 {len(stale)} 条语义回答缓存")
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+# 全局语义回答缓存
+answer_cache = SemanticAnswerCache()
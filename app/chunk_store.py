@@ -0,0 +1,373 @@
+import itertools
+import json
+import logging
+import os
+import uuid
+
+import numpy as np
+
+from app.wal import fsync_path
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 一个版本的数据文件
+_SUFFIXES = ('.ids.npy', '.doc.npy', '.page.npy', '.text.npy', '.text.bin', '.extra.npy', '.extra.bin')
+
+# 文档级别的元数据，每个文档只存一份，文本块通过文档编号引用
+DOC_FIELDS = ('file_name', 'source_type', 'doc_title', 'doc_author', 'total_pages')
+
+class ChunkStore:
+    """
+    列式存储的文本块集合
+
+    磁盘格式：
+        chunks.json                  文档表、下一个 chunk_id、当前数据文件的版本号
+        chunks-<版本>.ids.npy        chunk_id（升序）
+        chunks-<版本>.doc.npy        所属文档在文档表中的编号
+        chunks-<版本>.page.npy       页码
+        chunks-<版本>.text.npy       文本在 text.bin 中的偏移量（长度为 n+1）
+        chunks-<版本>.text.bin       UTF-8 文本
+        chunks-<版本>.extra.npy      其余元数据在 extra.bin 中的偏移量
+        chunks-<版本>.extra.bin      其余元数据（JSON）
+
+    数据文件以内存映射方式打开，只有被检索命中的文本块才会解码成字典。
+    新增的文本块先保存在内存中，save() 时与已有数据合并写入新版本的文件；
+    内存中的文本块另按文件名建立索引，按文件查找时不必逐个检查。
+    向量存储的快照不使用 chunks.json，而是把 write_version() 返回的头信息写入快照文件。
+    """
+
+    def __init__(self):
+        self.next_id = 0
+        self._version = None
+        self._documents = []
+        self._doc_index = {}
+        self._ids = np.zeros(0, dtype='int64')
+        self._doc = np.zeros(0, dtype='int32')
+        self._page = np.zeros(0, dtype='int32')
+        self._text_offsets = np.zeros(1, dtype='int64')
+        self._text = np.zeros(0, dtype='uint8')
+        self._extra_offsets = np.zeros(1, dtype='int64')
+        self._extra = np.zeros(0, dtype='uint8')
+        # 尚未写入磁盘的新文本块：chunk_id -> 文本块字典
+        self._pending = {}
+        # 内存中文本块按文件名的索引：文件名 -> {chunk_id: 页码}
+        self._pending_docs = {}
+        # 已从磁盘数据中删除的 chunk_id
+        self._deleted = set()
+
+    def __len__(self):
+        return len(self._ids) - len(self._deleted) + len(self._pending)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self._pending or self._base_row(chunk_id) is not None
+
+    def _base_row(self, chunk_id):
+        """返回 chunk_id 在磁盘数据中的行号，不存在时返回 None"""
+        if chunk_id in self._deleted:
+            return None
+        row = int(np.searchsorted(self._ids, chunk_id))
+        if row < len(self._ids) and self._ids[row] == chunk_id:
+            return row
+        return None
+
+    def _materialize_many(self, rows):
+        """
+        把磁盘数据中的一组行解码成文本块字典
+
+        各列按行号一次取出，其余元数据拼成一个 JSON 数组一次解析，逐行只剩切片和解码。
+        """
+        rows = np.asarray(rows, dtype='int64')
+        if len(rows) == 0:
+            return []
+        text = memoryview(self._text)
+        extra = memoryview(self._extra)
+        text_bounds = zip(self._text_offsets[rows].tolist(), self._text_offsets[rows + 1].tolist())
+        extra_bounds = zip(self._extra_offsets[rows].tolist(), self._extra_offsets[rows + 1].tolist())
+        extras = json.loads(b'[' + b','.join(extra[start:end] if end > start else b'{}'
+                                             for start, end in extra_bounds) + b']')
+        chunks = []
+        for (start, end), doc, page_num, fields in zip(text_bounds, self._doc[rows].tolist(),
+                                                      self._page[rows].tolist(), extras):
+            metadata = {**self._documents[doc], **fields}
+            if page_num > 0:
+                metadata['page_num'] = page_num
+            chunks.append({'content': str(text[start:end], 'utf-8'), 'metadata': metadata})
+        return chunks
+
+    def get(self, chunk_id):
+        """按 chunk_id 获取文本块，不存在时返回 None"""
+        chunk = self._pending.get(chunk_id)
+        if chunk is not None:
+            return chunk
+        row = self._base_row(chunk_id)
+        return self._materialize_many([row])[0] if row is not None else None
+
+    def get_many(self, chunk_ids):
+        """批量获取文本块，返回与 chunk_ids 对应的列表（不存在的为 None），磁盘数据中的行一次查出并解码"""
+        chunks = [self._pending.get(chunk_id) for chunk_id in chunk_ids]
+        base = [i for i, chunk in enumerate(chunks) if chunk is None and chunk_ids[i] not in self._deleted]
+        if base and len(self._ids):
+            wanted = np.asarray([chunk_ids[i] for i in base], dtype='int64')
+            rows = np.minimum(np.searchsorted(self._ids, wanted), len(self._ids) - 1)
+            found = self._ids[rows] == wanted
+            for i, chunk in zip(itertools.compress(base, found.tolist()), self._materialize_many(rows[found])):
+                chunks[i] = chunk
+        return chunks
+
+    def add(self, chunk):
+        """添加文本块，返回分配的 chunk_id"""
+        chunk_id = self.next_id
+        self.next_id += 1
+        self._add_pending(chunk_id, chunk)
+        return chunk_id
+
+    def put(self, chunk_id, chunk):
+        """以指定的 chunk_id 添加文本块（重放操作日志时使用）"""
+        if chunk_id in self._pending:
+            self._remove_pending(chunk_id)
+        self._add_pending(chunk_id, chunk)
+        self.next_id = max(self.next_id, chunk_id + 1)
+
+    def remove(self, chunk_ids):
+        """删除一组文本块"""
+        for chunk_id in chunk_ids:
+            if chunk_id in self._pending:
+                self._remove_pending(chunk_id)
+            else:
+                self._deleted.add(chunk_id)
+
+    def _add_pending(self, chunk_id, chunk):
+        metadata = _metadata_of(chunk)
+        self._pending[chunk_id] = chunk
+        self._pending_docs.setdefault(metadata.get('file_name'), {})[chunk_id] = metadata.get('page_num') or 0
+
+    def _remove_pending(self, chunk_id):
+        file_name = _metadata_of(self._pending.pop(chunk_id)).get('file_name')
+        pages = self._pending_docs[file_name]
+        del pages[chunk_id]
+        if not pages:
+            del self._pending_docs[file_name]
+
+    def ids_for_document(self, file_name, min_page=None):
+        """返回指定文件的全部 chunk_id；指定 min_page 时只返回页码不小于 min_page 的文本块"""
+        ids = []
+        doc = self._doc_index.get(file_name)
+        if doc is not None:
+            mask = self._doc == doc
+            if min_page is not None:
+                mask &= self._page >= min_page
+            ids.extend(chunk_id for chunk_id in self._ids[mask].tolist()
+                       if chunk_id not in self._deleted)
+        ids.extend(chunk_id for chunk_id, page_num in self._pending_docs.get(file_name, {}).items()
+                   if min_page is None or page_num >= min_page)
+        return ids
+
+    def select_ids(self, file_names=None, min_page=None, max_page=None):
+        """
+        返回满足条件的 chunk_id（升序数组）
+
+        Args:
+            file_names: 文件名集合，None 表示不限文件
+            min_page / max_page: 页码范围（含两端），None 表示不限
+        """
+        mask = np.ones(len(self._ids), dtype=bool)
+        if file_names is not None:
+            docs = [self._doc_index[name] for name in file_names if name in self._doc_index]
+            mask &= np.isin(self._doc, np.asarray(docs, dtype='int32'))
+        if min_page is not None:
+            mask &= self._page >= min_page
+        if max_page is not None:
+            mask &= self._page <= max_page
+        ids = self._ids[mask]
+        if self._deleted:
+            ids = ids[~np.isin(ids, np.fromiter(self._deleted, dtype='int64'))]
+
+        if file_names is None:
+            docs = self._pending_docs.values()
+        else:
+            docs = [self._pending_docs[name] for name in set(file_names) if name in self._pending_docs]
+        pending = [chunk_id for pages in docs for chunk_id, page_num in pages.items()
+                   if (min_page is None or page_num >= min_page) and (max_page is None or page_num <= max_page)]
+        if pending:
+            ids = np.concatenate([ids, np.asarray(sorted(pending), dtype='int64')])
+        return np.asarray(ids, dtype='int64')
+
+    def document_names(self):
+        """返回仍有文本块的文件名集合"""
+        names = set()
+        if len(self._ids):
+            live = np.ones(len(self._ids), dtype=bool)
+            if self._deleted:
+                live &= ~np.isin(self._ids, np.fromiter(self._deleted, dtype='int64'))
+            names.update(self._documents[doc].get('file_name') for doc in np.unique(self._doc[live]).tolist())
+        names.update(self._pending_docs)
+        names.discard(None)
+        return names
+
+    def items(self):
+        """按 chunk_id 顺序逐个生成 (chunk_id, 文本块)，不会一次性载入全部文本"""
+        for block in range(0, len(self._ids), 1024):
+            ids = self._ids[block:block + 1024].tolist()
+            rows = [block + i for i, chunk_id in enumerate(ids) if chunk_id not in self._deleted]
+            for row, chunk in zip(rows, self._materialize_many(rows)):
+                yield ids[row - block], chunk
+        for chunk_id in sorted(self._pending):
+            yield chunk_id, self._pending[chunk_id]
+
+    def copy(self):
+        """复制出可独立修改的实例，磁盘数据以只读映射方式共享"""
+        new_store = ChunkStore()
+        new_store.__dict__.update(self.__dict__)
+        new_store._pending = dict(self._pending)
+        new_store._pending_docs = {name: dict(pages) for name, pages in self._pending_docs.items()}
+        new_store._deleted = set(self._deleted)
+        return new_store
+
+    @classmethod
+    def from_chunks(cls, chunks, next_id):
+        """从 chunk_id -> 文本块字典 构建（用于迁移旧版本的 meta.pkl）"""
+        store = cls()
+        for chunk_id, chunk in chunks.items():
+            store._add_pending(chunk_id, chunk)
+        store.next_id = next_id
+        return store
+
+    def write_version(self, path):
+        """合并内存中的新数据，写入新版本的数据文件并同步到磁盘，返回该版本的头信息（不改变当前实例）"""
+        documents = []
+        doc_index = {}
+        ids, docs, pages, texts, extras = [], [], [], [], []
+
+        def doc_number(doc_fields):
+            key = doc_fields.get('file_name')
+            if key not in doc_index:
+                doc_index[key] = len(documents)
+                documents.append(doc_fields)
+            return doc_index[key]
+
+        for row, chunk_id in enumerate(self._ids.tolist()):
+            if chunk_id in self._deleted:
+                continue
+            ids.append(chunk_id)
+            docs.append(doc_number(self._documents[self._doc[row]]))
+            pages.append(int(self._page[row]))
+            texts.append(self._text[self._text_offsets[row]:self._text_offsets[row + 1]].tobytes())
+            extras.append(self._extra[self._extra_offsets[row]:self._extra_offsets[row + 1]].tobytes())
+
+        for chunk_id in sorted(self._pending):
+            chunk = self._pending[chunk_id]
+            metadata = dict(_metadata_of(chunk))
+            content = chunk.get('content', '') if isinstance(chunk, dict) else str(chunk)
+            doc_fields = {field: metadata.pop(field) for field in DOC_FIELDS if field in metadata}
+            page_num = metadata.pop('page_num', 0)
+            ids.append(chunk_id)
+            docs.append(doc_number(doc_fields))
+            pages.append(page_num if isinstance(page_num, int) else 0)
+            texts.append(content.encode('utf-8'))
+            extras.append(json.dumps(metadata, ensure_ascii=False).encode('utf-8') if metadata else b'')
+
+        directory = os.path.dirname(path)
+        prefix = os.path.splitext(os.path.basename(path))[0]
+        version = uuid.uuid4().hex[:12]
+        base = os.path.join(directory, f"{prefix}-{version}")
+
+        np.save(base + '.ids.npy', np.asarray(ids, dtype='int64'))
+        np.save(base + '.doc.npy', np.asarray(docs, dtype='int32'))
+        np.save(base + '.page.npy', np.asarray(pages, dtype='int32'))
+        _write_blob(base + '.text', texts)
+        _write_blob(base + '.extra', extras)
+        for suffix in _SUFFIXES:
+            fsync_path(base + suffix)
+
+        return {
+            'version': version,
+            'next_id': self.next_id,
+            'count': len(ids),
+            'documents': documents,
+        }
+
+    def save(self, path):
+        """写入新版本的数据文件，最后替换 chunks.json"""
+        header = self.write_version(path)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(header, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        old_version = self._version
+        self._open(path, header)
+        if old_version and old_version != header['version']:
+            self.remove_version(path, old_version)
+        logger.info(f"文本块存储已保存，包含 {header['count']} 条文本，{len(header['documents'])} 个文档")
+
+    @classmethod
+    def load(cls, path, header=None):
+        """以内存映射方式打开磁盘上的文本块存储；header 为快照中记录的头信息，默认读取 chunks.json"""
+        if header is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                header = json.load(f)
+        store = cls()
+        store._open(path, header)
+        return store
+
+    @staticmethod
+    def remove_version(path, version):
+        """删除旧版本的数据文件；文件仍被其他进程映射而无法删除时忽略"""
+        _remove_version(os.path.dirname(path), os.path.splitext(os.path.basename(path))[0], version)
+
+    def _open(self, path, header):
+        base = os.path.join(os.path.dirname(path),
+                            f"{os.path.splitext(os.path.basename(path))[0]}-{header['version']}")
+        self._version = header['version']
+        self.next_id = header['next_id']
+        self._documents = header['documents']
+        self._doc_index = {doc.get('file_name'): i for i, doc in enumerate(self._documents)}
+        self._pending = {}
+        self._pending_docs = {}
+        self._deleted = set()
+        if header['count'] == 0:
+            self._ids = np.zeros(0, dtype='int64')
+            self._doc = np.zeros(0, dtype='int32')
+            self._page = np.zeros(0, dtype='int32')
+            self._text_offsets = self._extra_offsets = np.zeros(1, dtype='int64')
+            self._text = self._extra = np.zeros(0, dtype='uint8')
+            return
+        self._ids = _load_mmap(base + '.ids.npy')
+        self._doc = _load_mmap(base + '.doc.npy')
+        self._page = _load_mmap(base + '.page.npy')
+        self._text_offsets, self._text = _open_blob(base + '.text')
+        self._extra_offsets, self._extra = _open_blob(base + '.extra')
+
+
+def _metadata_of(chunk):
+    if isinstance(chunk, dict) and isinstance(chunk.get('metadata'), dict):
+        return chunk['metadata']
+    return {}
+
+def _write_blob(base, parts):
+    """写入偏移量数组和拼接后的字节数据"""
+    offsets = np.zeros(len(parts) + 1, dtype='int64')
+    np.cumsum([len(part) for part in parts], out=offsets[1:])
+    np.save(base + '.npy', offsets)
+    with open(base + '.bin', 'wb') as f:
+        for part in parts:
+            f.write(part)
+
+def _load_mmap(path):
+    # 以普通 ndarray 视图访问内存映射（映射由视图的 base 保持），逐条取值时避开 np.memmap 子类的额外开销
+    return np.load(path, mmap_mode='r').view(np.ndarray)
+
+def _open_blob(base):
+    offsets = _load_mmap(base + '.npy')
+    if offsets[-1] == 0:
+        return offsets, np.zeros(0, dtype='uint8')
+    return offsets, np.memmap(base + '.bin', dtype='uint8', mode='r').view(np.ndarray)
+
+def _remove_version(directory, prefix, version):
+    for suffix in _SUFFIXES:
+        try:
+            os.remove(os.path.join(directory, f"{prefix}-{version}{suffix}"))
+        except OSError:
+            pass
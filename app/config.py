@@ -8,8 +8,14 @@ logger = logging.getLogger(__name__)
 # 从环境变量中获取DeepSeek API密钥
 DEEPSEEK_API_KEY = os.environ.get("DEEPSEEK_API_KEY", "")
 
-# DeepSeek API URL
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+# DeepSeek API URL（可指向本地的模拟服务用于测试）
+DEEPSEEK_API_URL = os.environ.get("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
+
+# DeepSeek 客户端：单次请求超时（秒）、最大并发请求数（即连接池大小）、失败重试次数、退避基数（秒）
+DEEPSEEK_TIMEOUT = float(os.environ.get("DEEPSEEK_TIMEOUT", "30"))
+DEEPSEEK_MAX_CONCURRENCY = int(os.environ.get("DEEPSEEK_MAX_CONCURRENCY", "8"))
+DEEPSEEK_MAX_RETRIES = int(os.environ.get("DEEPSEEK_MAX_RETRIES", "3"))
+DEEPSEEK_BACKOFF_BASE = float(os.environ.get("DEEPSEEK_BACKOFF_BASE", "0.5"))
 
 # 存储路径配置
 PDF_STORAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "pdf")
@@ -17,9 +23,127 @@ PDF_STORAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "dat
 # 向量维度
 VECTOR_DIM = 384
 
+# 嵌入模型及其本地存放目录
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models")
+
+# 嵌入模型的推理后端："torch"、"onnx"（需要 onnxruntime）或 "onnx-int8"（动态量化的 int8 模型，CPU 上更快）
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_INT8_FILE = os.environ.get("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+# 是否在应用启动后立即在后台加载并预热模型（否则在首次嵌入时加载）
+EMBEDDING_WARMUP = os.environ.get("EMBEDDING_WARMUP", "1") not in ("0", "false", "False")
+
+# 问题嵌入的合并批处理：单批最多合并的问题数、收到第一个问题后最多等待的毫秒数
+EMBED_MAX_BATCH = int(os.environ.get("EMBED_MAX_BATCH", "32"))
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", "5"))
+
+# 查询缓存：问题嵌入向量和检索结果的最大条目数、有效期（秒）
+QUESTION_CACHE_SIZE = int(os.environ.get("QUESTION_CACHE_SIZE", "4096"))
+QUESTION_CACHE_TTL = float(os.environ.get("QUESTION_CACHE_TTL", "86400"))
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", "1024"))
+RETRIEVAL_CACHE_TTL = float(os.environ.get("RETRIEVAL_CACHE_TTL", "3600"))
+
+# 语义回答缓存：与以往问题的余弦相似度不低于该值、且检索到的文本块相同时直接复用回答
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_SIZE = int(os.environ.get("ANSWER_CACHE_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "86400"))
+
+# 分块：每个文本块的最大 token 数（嵌入模型的最大序列长度，超出部分会被模型截断）、相邻块重叠的 token 数
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "128"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "16"))
+
+# 向量相似度度量："ip"（内积，嵌入已归一化，即余弦相似度）或 "l2"
+VECTOR_METRIC = os.environ.get("VECTOR_METRIC", "ip")
+
+# 检索结果的最低余弦相似度，低于该值的文本块不会进入回答生成
+SIMILARITY_THRESHOLD = float(os.environ.get("SIMILARITY_THRESHOLD", "0.3"))
+
+# FAISS 索引类型（index_factory 字符串），例如 "Flat"、"HNSW32"、"IVF1024,PQ48"
+INDEX_FACTORY = os.environ.get("INDEX_FACTORY", "Flat")
+
+# 需要训练的索引（IVF/PQ）在向量数达到该值后自动训练；0 表示按索引参数自动计算
+INDEX_TRAIN_SIZE = int(os.environ.get("INDEX_TRAIN_SIZE", "0"))
+
+# 训练时最多使用的样本数
+INDEX_TRAIN_SAMPLE = int(os.environ.get("INDEX_TRAIN_SAMPLE", "100000"))
+
+# 默认检索参数：IVF 的 nprobe 和 HNSW 的 efSearch
+INDEX_NPROBE = int(os.environ.get("INDEX_NPROBE", "16"))
+INDEX_EF_SEARCH = int(os.environ.get("INDEX_EF_SEARCH", "64"))
+
+# 发布新版本时不复制整个索引：新增的向量先放在增量索引中，删除的向量只做标记，
+# 增量索引超过 max(INDEX_DELTA_MAX, 基础索引向量数 / 32) 条或删除标记超过基础索引的 10% 时才合并出新的基础索引
+INDEX_DELTA_MAX = int(os.environ.get("INDEX_DELTA_MAX", "8192"))
+
+# 按文件、页码、上传时间过滤检索时，过滤后的文本块不超过该数量则直接计算精确相似度，否则在索引中按ID过滤检索
+SEARCH_FILTER_EXACT_MAX = int(os.environ.get("SEARCH_FILTER_EXACT_MAX", "20000"))
+
+# 严格匹配模式的混合检索：向量检索与关键词检索结果按倒数排名融合（RRF）时的常数 k
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", "60"))
+
+# 混合检索中关键词命中的最低要求：文本块至少匹配一个 IDF 不低于此值的检索词才参与融合
+# （默认 1.5 约相当于出现在不到 22% 的文本块中），只匹配到“什么”之类常见词的文本块不会挤占结果
+HYBRID_KEYWORD_MIN_IDF = float(os.environ.get("HYBRID_KEYWORD_MIN_IDF", "1.5"))
+
+# 批量问答：单次请求的最大问题数，以及同时生成回答的最大并发数
+ASK_BATCH_MAX_QUESTIONS = int(os.environ.get("ASK_BATCH_MAX_QUESTIONS", "1000"))
+ASK_BATCH_CONCURRENCY = int(os.environ.get("ASK_BATCH_CONCURRENCY", "4"))
+
+# 后台入库任务：执行任务的线程数、解析PDF的进程数
+INGEST_THREADS = int(os.environ.get("INGEST_THREADS", "2"))
+INGEST_PROCESSES = int(os.environ.get("INGEST_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2))))
+# 页数超过该值的PDF按页拆分到多个进程并行解析
+PDF_PAGES_PER_SHARD = int(os.environ.get("PDF_PAGES_PER_SHARD", "64"))
+# 流式入库：每批嵌入的文本块数，以及每入库多少个文本块保存一次检查点
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", "256"))
+INGEST_CHECKPOINT_CHUNKS = int(os.environ.get("INGEST_CHECKPOINT_CHUNKS", "2048"))
+
 # 向量存储路径
 INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "vector.faiss")
-META_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "meta.pkl")
+META_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "meta.pkl")  # 旧版本元数据，仅用于迁移
+
+# 文本块存储路径（列式存储，数据文件与其放在同一目录）
+CHUNK_STORE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "chunks.json")
+
+# 关键词（BM25）倒排索引路径，入库时与向量索引一起更新
+KEYWORD_INDEX_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "keywords.json")
+
+# 文档清单路径：记录每个已入库文件的大小、哈希、页数、chunk_id 范围和嵌入模型
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "manifest.json")
+
+# 向量存储快照：原子替换的快照文件记录当前代号以及索引、文本块、关键词索引各自的数据文件版本和文档清单，
+# 之后的增删操作追加到操作日志（WAL），日志超过 WAL_COMPACT_BYTES 字节时在后台写入新快照并压缩日志
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "snapshot.json")
+WAL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "wal.log")
+WAL_COMPACT_BYTES = int(os.environ.get("WAL_COMPACT_BYTES", str(64 * 1024 * 1024)))
+
+# 写锁文件：同一集合同一时间只有一个写入方（包括其他 worker 进程），检索不加锁
+WRITE_LOCK_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "write.lock")
+
+# 嵌入向量缓存路径（与索引文件放在一起）：默认集合使用此路径，其他集合各自保存在集合目录中
+EMBEDDING_CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "embeddings.cache")
+
+# 后台任务状态记录目录（多个 worker 共享）
+JOBS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "jobs")
+# 每个进程内存中最多保留的已结束任务数，更早的只能从任务记录文件中查询
+JOBS_MAX_FINISHED = int(os.environ.get("JOBS_MAX_FINISHED", "1000"))
+
+# 入库检查点，记录未完成的文件已入库到第几页
+INGEST_CHECKPOINT_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "ingest_checkpoints.json")
+
+# 命名集合：默认集合使用上面的路径；其他集合各自一个目录，保存索引、文本块、清单和检查点，PDF 也按集合分目录存放
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "index", "collections")
+COLLECTION_PDF_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "collections")
+
+# 跨集合检索时并行查询各集合的线程数
+SEARCH_THREADS = int(os.environ.get("SEARCH_THREADS", "4"))
+
+# 独立索引服务：设置后本进程是只处理 HTTP 请求和回答生成的薄 worker，嵌入模型、向量索引和文档入库都在索引服务进程中，
+# 多个 worker（uvicorn --workers N 或多台机器）共享一份模型和索引。
+# 取值为 http://主机:端口、unix:/路径（Unix 套接字），或 local（在本进程内运行索引服务，用于测试）；为空时不使用
+INDEX_SERVICE_URL = os.environ.get("INDEX_SERVICE_URL", "")
+INDEX_SERVICE_TIMEOUT = float(os.environ.get("INDEX_SERVICE_TIMEOUT", "60"))
 
 # 检查API密钥是否设置
 if not DEEPSEEK_API_KEY:
@@ -1,36 +1,145 @@
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import logging
 import os
+import threading
+import time
+from app.config import (VECTOR_DIM, EMBEDDING_CACHE_PATH, EMBEDDING_MODEL_NAME, MODEL_DIR,
+                        EMBEDDING_BACKEND, EMBEDDING_ONNX_INT8_FILE)
+from app.embedding_cache import EmbeddingCache
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # 指定模型下载路径
-model_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "models")
+model_dir = MODEL_DIR
 os.makedirs(model_dir, exist_ok=True)
 
 # 使用本地路径加载模型
-model_name = 'paraphrase-multilingual-MiniLM-L12-v2'
+model_name = EMBEDDING_MODEL_NAME
 model_path = os.path.join(model_dir, model_name)
 
-# 检查模型是否已下载
-if os.path.exists(model_path):
-    model = SentenceTransformer(model_path)
-else:
-    # 首次下载时保存到本地路径
-    model = SentenceTransformer(model_name, cache_folder=model_dir)
+# 模型在首次使用时加载（导入本模块不会加载 torch），应用启动时由 warm_up() 在后台提前加载
+_model = None
+_model_backend = None
+_model_lock = threading.Lock()
 
-def embed_texts(texts):
+def _backend_kwargs(backend):
+    if backend == "onnx":
+        return {"backend": "onnx"}
+    if backend == "onnx-int8":
+        return {"backend": "onnx", "model_kwargs": {"file_name": EMBEDDING_ONNX_INT8_FILE}}
+    return {}
+
+def _load_model():
+    """按配置的后端加载模型，ONNX 后端不可用时回退到 torch"""
+    global _model_backend
+    from sentence_transformers import SentenceTransformer
+    
+    # 检查模型是否已下载，首次下载时保存到本地路径
+    if os.path.exists(model_path):
+        source, kwargs = model_path, {}
+    else:
+        source, kwargs = model_name, {"cache_folder": model_dir}
+        
+    start = time.perf_counter()
+    backend = EMBEDDING_BACKEND
+    try:
+        model = SentenceTransformer(source, **kwargs, **_backend_kwargs(backend))
+    except Exception as e:
+        if backend == "torch":
+            raise
+        logger.warning(f"使用 {backend} 后端加载嵌入模型失败，回退到 torch: {str(e)}")
+        backend = "torch"
+        model = SentenceTransformer(source, **kwargs)
+        
+    _model_backend = backend
+    logger.info(f"嵌入模型已加载（后端: {backend}），耗时 {time.perf_counter() - start:.1f} 秒")
+    return model
+
+def get_model():
+    """获取嵌入模型，首次调用时加载；多个线程同时调用时只加载一次"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = _load_model()
+    return _model
+
+def warm_up():
+    """加载模型并编码一条文本，使第一个请求不必等待模型初始化"""
+    try:
+        start = time.perf_counter()
+        get_model().encode(["预热"], show_progress_bar=False)
+        logger.info(f"嵌入模型预热完成，耗时 {time.perf_counter() - start:.1f} 秒")
+    except Exception as e:
+        logger.error(f"嵌入模型预热失败: {str(e)}", exc_info=True)
+
+def model_version():
+    """嵌入向量的版本标识：int8 量化模型的输出与原模型略有差异，缓存和文档清单需要区分"""
+    backend = _model_backend or EMBEDDING_BACKEND
+    return f"{model_name}@int8" if backend == "onnx-int8" else model_name
+
+def model_info():
+    """返回嵌入模型的状态，用于调试"""
+    return {
+        "name": model_name,
+        "backend": _model_backend or EMBEDDING_BACKEND,
+        "loaded": _model is not None,
+    }
+
+# 嵌入向量缓存（缓存文件路径 -> 缓存），首次使用时创建
+_embedding_caches = {}
+_embedding_cache_lock = threading.Lock()
+
+def get_embedding_cache(path=EMBEDDING_CACHE_PATH):
+    """获取与集合索引文件放在一起的嵌入向量缓存，每个集合一个，压缩时不影响其他集合"""
+    cache = _embedding_caches.get(path)
+    if cache is None:
+        with _embedding_cache_lock:
+            cache = _embedding_caches.get(path)
+            if cache is None:
+                cache = _embedding_caches[path] = EmbeddingCache(path, VECTOR_DIM)
+    return cache
+
+def chunk_cache_keys(texts):
+    """计算文本在嵌入缓存中的键"""
+    version = model_version()
+    return [EmbeddingCache.make_key(version, text) for text in texts]
+
+def _encode_with_cache(texts, cache_path):
+    """只对缓存中没有的文本调用模型，其余直接从缓存读取"""
+    model = get_model()
+    cache = get_embedding_cache(cache_path)
+    keys = chunk_cache_keys(texts)
+    vectors, missing = cache.get_many(keys)
+    
+    logger.info(f"嵌入缓存命中 {len(texts) - len(missing)}/{len(texts)} 条文本")
+    if missing:
+        new_embeddings = model.encode([texts[i] for i in missing], show_progress_bar=True)
+        cache.put_many([keys[i] for i in missing], new_embeddings)
+        for i, vector in zip(missing, new_embeddings):
+            vectors[i] = vector
+            
+    return np.asarray(vectors, dtype='float32')
+
+def normalize_embeddings(embeddings):
+    """L2 归一化，使内积等于余弦相似度（缓存中保存的是模型原始输出）"""
+    embeddings = np.asarray(embeddings, dtype='float32')
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+def embed_texts(texts, use_cache=False, cache_path=EMBEDDING_CACHE_PATH):
     """
     将文本列表转换为嵌入向量
     
     Args:
         texts: 文本列表
+        use_cache: 是否使用嵌入缓存（文档入库时使用，用户问题不写入缓存）
+        cache_path: 使用的缓存文件，即文档所属集合的 CollectionPaths.embedding_cache_path
     
     Returns:
-        numpy数组形式的嵌入向量
+        numpy数组形式的嵌入向量（已 L2 归一化）
     """
     try:
         if not texts:
@@ -38,7 +147,11 @@ def embed_texts(texts):
             return np.array([])
             
         logger.info(f"对 {len(texts)} 条文本进行嵌入")
-        embeddings = model.encode(texts, show_progress_bar=True)
+        if use_cache:
+            embeddings = _encode_with_cache(texts, cache_path)
+        else:
+            embeddings = get_model().encode(texts, show_progress_bar=True)
+        embeddings = normalize_embeddings(embeddings)
         
         if len(embeddings) == 0:
             logger.warning("嵌入生成为空")
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.config import EMBED_MAX_BATCH, EMBED_MAX_WAIT_MS
+from app.embedder import embed_texts
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class EmbeddingBatcher:
+    """
+    合并并发请求的嵌入调度器
+
+    并发到达的问题先进入队列，调度协程收到第一条后最多再等待 max_wait_ms 毫秒，
+    把期间到达的（不超过 max_batch 条）合并成一次 encode 调用，结果再分发给各个调用方。
+    编码在单独的线程中依次执行，模型运行期间新到达的请求会自然积累成下一批，
+    避免多个批大小为 1 的前向计算争抢同一组 CPU 线程，也不会阻塞事件循环。
+    """
+
+    def __init__(self, max_batch=EMBED_MAX_BATCH, max_wait_ms=EMBED_MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._worker = None
+        self._executor = None
+
+    def _ensure_worker(self):
+        """在当前事件循环中启动调度协程（首次调用时）"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._executor = self._executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def embed(self, text):
+        """编码一条文本，返回 L2 归一化后的向量"""
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts):
+        """编码多条文本，与其他并发请求一起按批次执行，返回向量列表"""
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            self._queue.put_nowait((text, future))
+            futures.append(future)
+        return await asyncio.gather(*futures)
+
+    async def _next_batch(self):
+        """取出下一批请求：等待第一条，再在 max_wait 内尽量凑满 max_batch 条"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            # 队列中已有的请求直接取出，不必等待
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            # 调用方已取消的请求不再编码
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                embeddings = await loop.run_in_executor(self._executor, embed_texts, [text for text, _ in batch])
+                logger.debug(f"合并编码 {len(batch)} 条文本")
+                for (_, future), embedding in zip(batch, embeddings):
+                    if not future.done():
+                        future.set_result(embedding)
+            except Exception as e:
+                logger.error(f"批量嵌入失败: {str(e)}", exc_info=True)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    async def aclose(self):
+        """停止调度协程并释放编码线程（应用退出时调用）"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+# 全局调度器，所有请求共享
+embedding_batcher = EmbeddingBatcher()
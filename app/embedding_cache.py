@@ -0,0 +1,111 @@
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    基于内容寻址的嵌入向量缓存
+
+    每条记录由 sha256(模型名 + 文本) 和 float32 向量组成，追加写入到索引目录下的同一个文件中，
+    读取时通过内存映射访问，不会把全部向量载入内存。键和向量写在同一条记录里，
+    多个 worker 同时追加也不会错位。
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        self.record_dtype = np.dtype([('key', 'S64'), ('vector', '<f4', (dim,))])
+        self._rows = {}
+        self._records = None
+        self._file_size = 0
+        self._lock = threading.Lock()
+        self._refresh()
+
+    @staticmethod
+    def make_key(model_name, text):
+        """生成缓存键：模型名和文本内容共同决定"""
+        # 使用十六进制摘要，避免定长字节串末尾的 \0 被 numpy 截断
+        return hashlib.sha256(f"{model_name}\0{text}".encode('utf-8')).hexdigest().encode('ascii')
+
+    def __len__(self):
+        return len(self._rows)
+
+    def _refresh(self):
+        """文件大小变化时重新映射（其他进程可能追加了新记录）"""
+        try:
+            file_size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            file_size = 0
+
+        if file_size == self._file_size and self._records is not None:
+            return
+
+        # 忽略写入中断留下的不完整记录
+        count = file_size // self.record_dtype.itemsize
+        if count == 0:
+            self._records = np.zeros(0, dtype=self.record_dtype)
+        else:
+            self._records = np.memmap(self.path, dtype=self.record_dtype, mode='r', shape=(count,))
+        self._rows = {key: row for row, key in enumerate(self._records['key'].tolist())}
+        self._file_size = file_size
+
+    def get_many(self, keys):
+        """
+        批量查询缓存
+
+        Returns:
+            (向量列表, 未命中的下标列表)，未命中位置的向量为 None
+        """
+        with self._lock:
+            if any(key not in self._rows for key in keys):
+                self._refresh()
+            vectors = []
+            missing = []
+            for i, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is None:
+                    vectors.append(None)
+                    missing.append(i)
+                else:
+                    vectors.append(np.array(self._records[row]['vector']))
+            return vectors, missing
+
+    def put_many(self, keys, vectors):
+        """追加新的嵌入向量到缓存文件"""
+        with self._lock:
+            new_rows = [(key, vector) for key, vector in zip(keys, vectors) if key not in self._rows]
+            if not new_rows:
+                return
+
+            records = np.empty(len(new_rows), dtype=self.record_dtype)
+            records['key'] = [key for key, _ in new_rows]
+            records['vector'] = np.asarray([vector for _, vector in new_rows], dtype='float32')
+
+            # 一次写入整批记录
+            with open(self.path, 'ab') as f:
+                f.write(records.tobytes())
+            self._refresh()
+
+    def compact(self, keep_keys):
+        """只保留仍在使用的记录，清理已删除文档留下的向量"""
+        with self._lock:
+            self._refresh()
+            rows = sorted({self._rows[key] for key in keep_keys if key in self._rows})
+            if len(rows) == len(self._rows):
+                return
+
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(np.asarray(self._records[rows]).tobytes())
+            self._records = None
+            os.replace(tmp_path, self.path)
+            self._file_size = 0
+            self._refresh()
+            logger.info(f"嵌入缓存已压缩，保留 {len(self._rows)} 条记录")
@@ -0,0 +1,191 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+import logging
+import httpx
+import numpy as np
+from app.config import INDEX_SERVICE_TIMEOUT
+from app.vector_store import SearchHit, VectorStore
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class IndexServiceClient:
+    """
+    独立索引服务（app/index_service.py）的客户端，薄 worker 通过它嵌入问题、检索和转发文档管理请求
+
+    url 为 http://主机:端口 或 unix:/路径（Unix 套接字）；为 local 时在本进程内运行索引服务应用
+    （包括其生命周期），请求不经过网络，用于测试和单机调试。
+    所有方法都是同步的，在事件循环中应通过线程池调用。
+    """
+
+    def __init__(self, url, timeout=INDEX_SERVICE_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self._http = None
+
+    def start(self):
+        if self.url == "local":
+            from fastapi.testclient import TestClient
+            from app.index_service import app
+            self._http = TestClient(app, base_url="http://index-service")
+            self._http.__enter__()
+        elif self.url.startswith("unix:"):
+            transport = httpx.HTTPTransport(uds=self.url[len("unix:"):])
+            self._http = httpx.Client(transport=transport, base_url="http://index-service", timeout=self.timeout)
+        else:
+            self._http = httpx.Client(base_url=self.url, timeout=self.timeout)
+        logger.info(f"使用索引服务: {self.url}")
+
+    def close(self):
+        if self._http is None:
+            return
+        if self.url == "local":
+            self._http.__exit__(None, None, None)
+        else:
+            self._http.close()
+        self._http = None
+
+    def request(self, method, path, **kwargs):
+        """发送请求并返回响应，不检查状态码；无法连接时抛出 503 的 HTTPException"""
+        try:
+            return self._http.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            logger.error(f"索引服务请求失败: {method} {path}: {str(e)}", exc_info=True)
+            raise HTTPException(status_code=503, detail=f"索引服务不可用: {str(e)}")
+
+    def _call(self, path, payload):
+        """调用内部接口，服务返回错误时以相同的状态码抛出 HTTPException"""
+        response = self.request("POST", f"/internal/{path}", json=payload)
+        if response.status_code >= 400:
+            try:
+                detail = response.json().get("detail")
+            except ValueError:
+                detail = response.text
+            raise HTTPException(status_code=response.status_code, detail=detail)
+        return response.json()
+
+    def embed(self, texts):
+        """编码多条文本，返回向量列表"""
+        embeddings = self._call("embed", {"texts": list(texts)})["embeddings"]
+        return list(np.asarray(embeddings, dtype='float32').reshape(len(texts), -1))
+
+    async def embed_many(self, texts):
+        """与 embedding_batcher.embed_many() 相同的接口，合并编码在索引服务中进行"""
+        return await run_in_threadpool(self.embed, texts)
+
+    def view(self, names=None):
+        """返回一组集合的视图，集合不存在时抛出 404 的 HTTPException"""
+        state = self._call("view", {"collections": names})
+        return RemoteCollectionView(self, state["collections"], state["generation"], state["empty"])
+
+    def search(self, names, query_embeddings, query_texts=None, top_k=5, threshold=None, nprobe=None,
+               ef_search=None, search_filter=None):
+        payload = {
+            "collections": names,
+            "embeddings": np.asarray(query_embeddings, dtype='float32').tolist(),
+            "texts": list(query_texts) if query_texts is not None else None,
+            "top_k": top_k,
+            "threshold": threshold,
+            "nprobe": nprobe,
+            "ef_search": ef_search,
+            "search_filter": search_filter.to_dict() if search_filter is not None else None,
+        }
+        results = self._call("search", payload)["results"]
+        return [[SearchHit(**hit) for hit in hits] for hits in results]
+
+    def contains(self, pairs):
+        return self._call("contains", {"chunks": [list(pair) for pair in pairs]})["contains"]
+
+
+class RemoteCollectionView:
+    """
+    索引服务上一组集合的视图，提供与 CollectionView 相同的接口
+
+    只记录创建时各集合的版本号；检索在服务上各集合的当前版本中进行，
+    其间有写入时结果可能来自更新的版本（下次查询时版本号变化，检索结果缓存随之清空）。
+    """
+
+    def __init__(self, client, collections, generation, empty):
+        self._client = client
+        self.collections = list(collections)
+        self.generation = tuple(tuple(item) for item in generation)
+        self._empty = empty
+
+    def is_empty(self):
+        return self._empty
+
+    def contains(self, collection, chunk_id):
+        return self.contains_many([(collection, chunk_id)])[0]
+
+    def contains_many(self, pairs):
+        """集合不在本次查询范围内时为 None（无法判断），其余一次请求索引服务"""
+        result = [None] * len(pairs)
+        queried = [i for i, (collection, _) in enumerate(pairs) if collection in self.collections]
+        if queried:
+            for i, present in zip(queried, self._client.contains([pairs[i] for i in queried])):
+                result[i] = present
+        return result
+
+    def search_batch(self, query_embeddings, top_k=5, **kwargs):
+        """参数同 VectorStore.search_batch()"""
+        return self._client.search(self.collections, query_embeddings, top_k=top_k, **kwargs)
+
+    def hybrid_search_batch(self, query_embeddings, query_texts, top_k=5, **kwargs):
+        """参数同 VectorStore.hybrid_search_batch()"""
+        return self._client.search(self.collections, query_embeddings, query_texts, top_k=top_k, **kwargs)
+
+    def get_sources_from_texts(self, texts):
+        sources = VectorStore.get_sources_from_texts(texts)
+        if len(self.collections) > 1:
+            for source, text in zip(sources, texts):
+                source['collection'] = text.get('collection')
+        return sources
+
+
+# 当前进程使用的索引服务，由 main.py 在薄 worker 模式下启动时连接；索引服务进程自身不连接
+_client = None
+
+def connect(url):
+    global _client
+    client = IndexServiceClient(url)
+    client.start()
+    _client = client
+
+def disconnect():
+    global _client
+    if _client is not None:
+        _client.close()
+        _client = None
+
+def remote_index():
+    """薄 worker 模式下返回索引服务客户端，否则返回 None（在本进程中加载索引和模型）"""
+    return _client
+
+# 薄 worker 原样转发给索引服务的接口：文档和集合管理、任务查询、预览和调试；问答在本进程中处理
+_FORWARDED_ROUTES = [
+    ("/upload", ["POST"]),
+    ("/list-files", ["GET"]),
+    ("/files/{filename}", ["DELETE"]),
+    ("/rebuild-index", ["POST"]),
+    ("/jobs/{job_id}", ["GET"]),
+    ("/preview/{filename}", ["GET"]),
+    ("/collections", ["GET"]),
+    ("/collections/{name}/load", ["POST"]),
+    ("/collections/{name}/evict", ["POST"]),
+    ("/debug/status", ["GET"]),
+]
+
+async def _forward(request: Request):
+    """把请求（路径、查询参数、请求体）原样转发给索引服务并返回其响应"""
+    path = request.scope.get("raw_path", b"").decode("latin-1") or request.url.path
+    headers = {key: value for key, value in request.headers.items() if key in ("content-type", "accept")}
+    body = await request.body()
+    response = await run_in_threadpool(_client.request, request.method, path, params=request.url.query,
+                                       content=body, headers=headers)
+    return Response(content=response.content, status_code=response.status_code,
+                    media_type=response.headers.get("content-type"))
+
+forward_router = APIRouter()
+for _path, _methods in _FORWARDED_ROUTES:
+    forward_router.add_api_route(_path, _forward, methods=_methods, include_in_schema=False)
@@ -0,0 +1,136 @@
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+import os
+import logging
+import threading
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+from app.routes import router, store_manager, collection_manager, job_manager, _resident_view
+from app.ingest import ingest_file, interrupted_ingests
+from app.embedder import warm_up
+from app.embedding_batcher import embedding_batcher
+from app.vector_store import SearchFilter
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def start_index():
+    """加载默认集合、启动后台任务、预热嵌入模型并继续上次中断的入库（单进程模式和索引服务共用）"""
+    from app.config import EMBEDDING_WARMUP
+
+    # 默认集合的向量存储在启动时加载，之后常驻内存；其他集合在首次访问时加载
+    store_manager.load()
+    job_manager.start()
+
+    # 在后台线程中加载并预热嵌入模型，不推迟服务开始监听；此前到达的请求会等待模型加载完成
+    if EMBEDDING_WARMUP:
+        threading.Thread(target=warm_up, name="embedder-warmup", daemon=True).start()
+
+    # 继续上次中断的入库（各个集合）
+    for name in collection_manager.names():
+        resident = collection_manager.get(name)
+        for file_path in interrupted_ingests(resident):
+            job_manager.submit("upload", ingest_file, resident, file_path, job_manager.process_pool,
+                               detail={"file": os.path.basename(file_path), "operation": "继续入库", "collection": name})
+
+async def stop_index():
+    """停止后台任务和嵌入调度器"""
+    job_manager.shutdown()
+    collection_manager.shutdown()
+    await embedding_batcher.aclose()
+
+# 供薄 worker 调用的内部接口（app/index_client.py），只应在本机套接字或内网中开放
+internal_router = APIRouter(prefix="/internal")
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+class ViewRequest(BaseModel):
+    collections: Optional[List[str]] = None
+
+class SearchRequest(BaseModel):
+    collections: Optional[List[str]] = None
+    embeddings: List[List[float]]
+    # 指定时使用向量与关键词的混合检索
+    texts: Optional[List[str]] = None
+    top_k: int = 5
+    threshold: Optional[float] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    # SearchFilter.to_dict() 的结果
+    search_filter: Optional[Dict[str, Any]] = None
+
+class ContainsRequest(BaseModel):
+    # (集合, 文本块ID) 列表
+    chunks: List[Tuple[str, int]]
+
+def _hit_to_dict(hit):
+    return {"chunk_id": hit.chunk_id, "score": hit.score, "content": hit.content,
+            "metadata": dict(hit.metadata), "collection": hit.collection}
+
+@internal_router.post("/embed")
+async def embed(request: EmbedRequest):
+    """编码一组文本，与其他 worker 同时到达的请求合并编码"""
+    embeddings = await embedding_batcher.embed_many(request.texts)
+    return {"embeddings": np.asarray(embeddings, dtype='float32').tolist()}
+
+@internal_router.post("/view")
+async def view(request: ViewRequest):
+    """一组集合的版本号以及是否为空（首次访问的集合在此时加载）"""
+    collection_view = await run_in_threadpool(_resident_view, request.collections)
+    return {"collections": list(collection_view.stores), "generation": collection_view.generation,
+            "empty": collection_view.is_empty()}
+
+def _search(request):
+    collection_view = _resident_view(request.collections)
+    embeddings = np.asarray(request.embeddings, dtype='float32')
+    search_filter = SearchFilter(**request.search_filter) if request.search_filter else None
+    options = dict(top_k=request.top_k, threshold=request.threshold, nprobe=request.nprobe,
+                   ef_search=request.ef_search, search_filter=search_filter)
+    if request.texts is not None:
+        results = collection_view.hybrid_search_batch(embeddings, request.texts, **options)
+    else:
+        results = collection_view.search_batch(embeddings, **options)
+    return {"generation": collection_view.generation,
+            "results": [[_hit_to_dict(hit) for hit in hits] for hits in results]}
+
+@internal_router.post("/search")
+async def search(request: SearchRequest):
+    """在一组集合的当前版本中检索，参数同 CollectionView.search_batch() / hybrid_search_batch()"""
+    return await run_in_threadpool(_search, request)
+
+def _contains(chunks):
+    existing = set(collection_manager.names())
+    result = []
+    for collection, chunk_id in chunks:
+        if collection not in existing:
+            result.append(None)
+            continue
+        # 未加载的集合不因此加载，无法判断
+        resident = collection_manager.get(collection)
+        result.append(chunk_id in resident.current().text_chunks if resident.loaded else None)
+    return result
+
+@internal_router.post("/contains")
+async def contains(request: ContainsRequest):
+    """各文本块是否仍在所属集合的当前版本中，集合未加载时为 null"""
+    return {"contains": await run_in_threadpool(_contains, request.chunks)}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """索引服务生命周期：与单进程模式相同地加载索引和嵌入模型"""
+    start_index()
+    yield
+    await stop_index()
+
+# 独立的索引/嵌入服务：唯一持有嵌入模型和向量索引的进程，负责嵌入、检索、文档入库和集合管理。
+# 运行方式（只启动一个进程）：
+#   uvicorn app.index_service:app --uds /tmp/rag-index.sock
+#   uvicorn app.index_service:app --host 127.0.0.1 --port 8001
+app = FastAPI(title="RAG index service", lifespan=lifespan)
+app.include_router(internal_router)
+# 文档管理、集合管理、任务查询等接口与单进程模式相同，薄 worker 原样转发
+app.include_router(router)
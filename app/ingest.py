@@ -0,0 +1,382 @@
+import hashlib
+import itertools
+import json
+import os
+import logging
+import numpy as np
+from app.pdf_loader import plan_extraction, iter_extract_shards, get_page_count, token_counting
+from app.embedder import embed_texts, get_embedding_cache, chunk_cache_keys, model_version
+from app.vector_store import VectorStore
+from app.jobs import JobCancelled
+from app.config import EMBED_BATCH_SIZE, INGEST_CHECKPOINT_CHUNKS, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def _iter_chunks(file_paths, executor=None, start_page=0, failed=None):
+    """
+    按顺序逐个生成文件的文本块；解析在进程池中分片并行，同时只保留有限个分片的结果
+
+    某个分片解析失败时，failed 为 None 则抛出 RuntimeError（此后的页面不再入库）；
+    否则把文件名和原因记入 failed（文件名 -> 原因），跳过该文件其余的分片，继续处理其他文件。
+    """
+    tasks = plan_extraction(file_paths, start_page=start_page)
+    for file_path, start, chunks in iter_extract_shards(tasks, executor):
+        file_name = os.path.basename(file_path)
+        if chunks is None:
+            error = f"解析第 {start + 1} 页起的内容失败"
+            if failed is None:
+                raise RuntimeError(f"文件 {file_name} {error}")
+            failed.setdefault(file_name, error)
+        elif failed is None or file_name not in failed:
+            yield from chunks
+
+def _batched(items, size):
+    """把迭代器切成固定大小的批次"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _concat(embeddings):
+    """合并多个批次的嵌入向量"""
+    return np.concatenate(embeddings) if len(embeddings) > 1 else embeddings[0]
+
+def _file_signature(file_path):
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def _check_source(file_path, signature):
+    """入库期间文件被删除或重新上传（大小、修改时间变化）时抛出 JobCancelled，停止入库"""
+    try:
+        current = _file_signature(file_path)
+    except OSError:
+        current = None
+    if current != signature:
+        raise JobCancelled(f"文件 {os.path.basename(file_path)} 已被删除或替换，停止入库")
+
+def _file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _manifest_entry(file_path, sha256):
+    """生成文档清单条目，chunk_id 范围在入库完成后由 _record_manifest 补充"""
+    return {
+        "size": os.path.getsize(file_path),
+        # 上传时保存的文件，修改时间即上传时间（用于按上传时间过滤检索）
+        "uploaded_at": os.path.getmtime(file_path),
+        "sha256": sha256,
+        "pages": get_page_count(file_path),
+        "model": model_version(),
+        "chunking": _chunking_version(),
+    }
+
+def _chunking_version():
+    return f"tokens-{CHUNK_MAX_TOKENS}-{CHUNK_OVERLAP_TOKENS}-{token_counting()}"
+
+def _is_unchanged(entry, sha256):
+    """文件内容、嵌入模型和分块参数都没有变化时，已入库的文本块可以直接复用"""
+    return (entry is not None and entry.get("sha256") == sha256 and entry.get("model") == model_version()
+            and entry.get("chunking") == _chunking_version())
+
+def _record_manifest(store, file_name, entry):
+    """把文件当前的 chunk_id 范围写入清单条目并登记到存储"""
+    chunk_ids = store.text_chunks.ids_for_document(file_name)
+    entry["chunks"] = len(chunk_ids)
+    entry["chunk_id_range"] = [min(chunk_ids), max(chunk_ids)] if chunk_ids else None
+    store.set_manifest_entry(file_name, entry)
+
+def _load_checkpoints(paths):
+    """读取集合的入库检查点：文件名 -> {"signature": [大小, 修改时间], "next_page": 页码}"""
+    try:
+        with open(paths.checkpoint_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"读取入库检查点失败，将重新入库: {str(e)}")
+        return {}
+
+def _save_checkpoint(paths, file_name, checkpoint):
+    """更新单个文件的检查点，checkpoint 为 None 时删除（调用方需持有写锁）"""
+    checkpoints = _load_checkpoints(paths)
+    if checkpoint is None:
+        if checkpoints.pop(file_name, None) is None:
+            return
+    else:
+        checkpoints[file_name] = checkpoint
+    
+    paths.makedirs()
+    tmp_path = paths.checkpoint_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoints, f, ensure_ascii=False)
+    os.replace(tmp_path, paths.checkpoint_path)
+
+def interrupted_ingests(store_manager):
+    """返回集合中上次未完成入库、且文件未被修改的PDF路径"""
+    file_paths = []
+    for file_name, checkpoint in _load_checkpoints(store_manager.paths).items():
+        file_path = os.path.join(store_manager.paths.pdf_dir, file_name)
+        try:
+            if _file_signature(file_path) == checkpoint.get("signature"):
+                file_paths.append(file_path)
+        except OSError:
+            continue
+    return file_paths
+
+def _publish_batch(store_manager, file_path, signature, chunks, embeddings, remove_from_page, checkpoint,
+                   sha256=None):
+    """
+    把一批文本块加入常驻向量存储并保存，同时更新检查点
+    
+    写锁内先确认文件仍是开始入库时的版本：文件已被删除时，删除请求已经（或即将）移除该文件的内容；
+    已被重新上传时，新的入库任务会替换它。两种情况都不能再写入旧的文本块，抛出 JobCancelled。
+    
+    Args:
+        signature: 开始入库时文件的大小和修改时间
+        remove_from_page: 不为 False 时先移除该文件的旧内容（None 表示全部，整数表示从该页开始）
+        checkpoint: 新的检查点，None 表示文件已全部入库
+        sha256: 文件全部入库时的内容哈希，用于登记文档清单
+    """
+    file_name = os.path.basename(file_path)
+    with store_manager.write_lock:
+        _check_source(file_path, signature)
+        store = store_manager.current().copy()
+        if remove_from_page is not False:
+            store.remove_document(file_name, min_page=remove_from_page)
+        if chunks:
+            store.add(embeddings, chunks, file_name=file_name)
+        if sha256 is not None:
+            _record_manifest(store, file_name, _manifest_entry(file_path, sha256))
+        store_manager.publish(store)
+        _save_checkpoint(store_manager.paths, file_name, checkpoint)
+
+def remove_file(store_manager, file_name):
+    """
+    从集合中移除已删除文件的文本块、文档清单条目和入库检查点
+
+    与 _publish_batch() 在同一写锁下执行，之后仍在进行的入库任务不会再写入该文件的内容。
+
+    Returns:
+        移除的文本块数
+    """
+    with store_manager.write_lock:
+        store = store_manager.current().copy()
+        had_entry = file_name in store.manifest
+        removed = store.remove_document(file_name)
+        if removed > 0 or had_entry:
+            store_manager.publish(store)
+        _save_checkpoint(store_manager.paths, file_name, None)
+    return removed
+
+def ingest_file(store_manager, file_path, executor=None):
+    """
+    以流式方式解析、嵌入单个PDF文件，并替换向量存储中该文件的内容
+    
+    文本块按固定大小分批嵌入，每积累 INGEST_CHECKPOINT_CHUNKS 个文本块就写入向量存储并记录检查点，
+    已入库的部分立即可以检索；进程中断后再次入库同一文件时从检查点所在页继续。
+    某个分片解析失败时任务失败，之后的页面不再入库，也不登记文档清单（检查点停在失败的页面之前）。
+    
+    Args:
+        store_manager: 常驻向量存储
+        file_path: PDF文件路径
+        executor: 用于解析PDF的进程池
+    
+    Returns:
+        处理结果
+    """
+    file_name = os.path.basename(file_path)
+    try:
+        signature = _file_signature(file_path)
+    except FileNotFoundError:
+        raise JobCancelled(f"文件 {file_name} 已被删除，停止入库")
+    
+    # 文件未变化且有检查点时，从检查点所在页继续（该页可能只入库了一部分，先删除再重新入库）
+    checkpoint = _load_checkpoints(store_manager.paths).get(file_name)
+    if checkpoint and checkpoint.get("signature") == signature:
+        remove_from_page = checkpoint["next_page"]
+        logger.info(f"从第 {remove_from_page} 页继续入库文件 {file_name}")
+    else:
+        remove_from_page = None
+    start_page = (remove_from_page or 1) - 1
+    
+    # 内容和嵌入模型都没有变化的文件不再重新解析和嵌入
+    sha256 = _file_sha256(file_path)
+    entry = store_manager.current().manifest.get(file_name)
+    if remove_from_page is None and _is_unchanged(entry, sha256):
+        logger.info(f"文件 {file_name} 内容未变化，跳过入库")
+        return {"message": "文件内容未变化，无需重新索引", "file": file_name,
+                "chunks": entry.get("chunks", 0), "skipped": True}
+    
+    total_chunks = 0
+    pending_chunks = []
+    pending_embeddings = []
+    
+    try:
+        for batch in _batched(_iter_chunks([file_path], executor, start_page), EMBED_BATCH_SIZE):
+            # 生成嵌入向量（未变化的文本块直接从缓存读取）
+            pending_embeddings.append(embed_texts([chunk["content"] for chunk in batch], use_cache=True,
+                                                  cache_path=store_manager.paths.embedding_cache_path))
+            pending_chunks.extend(batch)
+            total_chunks += len(batch)
+            
+            if len(pending_chunks) >= INGEST_CHECKPOINT_CHUNKS:
+                # 最后一页可能还有未入库的文本块，续传时从这一页重新开始
+                next_page = pending_chunks[-1]["metadata"].get("page_num") or 1
+                _publish_batch(store_manager, file_path, signature, pending_chunks, _concat(pending_embeddings),
+                               remove_from_page, {"signature": signature, "next_page": next_page})
+                logger.info(f"文件 {file_name} 已入库 {total_chunks} 个文本块")
+                remove_from_page = False
+                pending_chunks = []
+                pending_embeddings = []
+    except JobCancelled:
+        raise
+    except Exception:
+        # 解析过程中文件被删除或替换导致的错误按取消处理
+        _check_source(file_path, signature)
+        raise
+    
+    if total_chunks == 0 and remove_from_page is None:
+        logger.warning(f"从PDF中没有提取到文本内容: {file_name}")
+        return {"message": "未能提取到内容", "file": file_name, "chunks": 0}
+    
+    _publish_batch(store_manager, file_path, signature, pending_chunks,
+                   _concat(pending_embeddings) if pending_embeddings else None, remove_from_page, None, sha256)
+    logger.info(f"从PDF中提取了 {total_chunks} 个文本块")
+    
+    return {"message": "成功索引PDF文件", "file": file_name, "chunks": total_chunks}
+
+def rebuild_index(store_manager, executor=None, force=False):
+    """
+    重新构建集合中所有PDF文件的索引（只涉及 store_manager 对应的集合）
+    
+    根据文档清单只重新入库新增或内容变化的文件，内容未变化的文件直接沿用已有的文本块；
+    force 为 True 时丢弃现有索引，全部重新入库。
+    
+    变化的文件全部入库成功后才移除它的旧文本块并登记文档清单；有页面解析失败或文本块处理失败的文件
+    保留旧的文本块和清单条目，列在结果的 failed_files 中，下次重建时再次处理。全部重新入库时任何文件失败都不替换现有索引，任务失败。
+    
+    Args:
+        store_manager: 集合的常驻向量存储
+        executor: 用于解析PDF的进程池
+        force: 是否全部重新入库
+        
+    Returns:
+        处理结果
+    """
+    pdf_dir = store_manager.paths.pdf_dir
+    pdf_files = [f for f in os.listdir(pdf_dir) if f.endswith('.pdf')] if os.path.exists(pdf_dir) else []
+    
+    # 重建期间持有写锁，避免其间的上传被重建结果覆盖
+    with store_manager.write_lock:
+        # 在副本（或新的空存储）上重建，完成后再替换常驻实例
+        if force:
+            store = VectorStore(dim=store_manager.dim, paths=store_manager.paths)
+            # chunk_id 接着原来的编号，不重复使用：语义回答缓存按 (集合, chunk_id) 判断引用的文本块是否仍然存在，
+            # 从 0 重新编号会让内容已经变化的新文本块沿用旧的 ID
+            store.text_chunks.next_id = store_manager.current().text_chunks.next_id
+        else:
+            store = store_manager.current().copy()
+        
+        # 移除已不存在的文件
+        removed_files = store.text_chunks.document_names() - set(pdf_files)
+        for filename in removed_files:
+            store.remove_document(filename)
+        
+        processed_files = []
+        changed_files = []
+        manifest_entries = {}
+        # 文件名 -> 失败原因
+        failed = {}
+        for filename in pdf_files:
+            file_path = os.path.join(pdf_dir, filename)
+            try:
+                sha256 = _file_sha256(file_path)
+            except OSError as e:
+                logger.error(f"读取文件 {filename} 时出错: {str(e)}", exc_info=True)
+                failed[filename] = f"读取文件失败: {str(e)}"
+                continue
+                
+            entry = store.manifest.get(filename)
+            if _is_unchanged(entry, sha256):
+                processed_files.append({"name": filename, "chunks": entry.get("chunks", 0), "skipped": True})
+                continue
+                
+            changed_files.append(filename)
+            manifest_entries[filename] = _manifest_entry(file_path, sha256)
+        
+        # 变化的文件的旧文本块在新内容全部入库后再移除，失败时保留
+        old_chunk_ids = {filename: store.text_chunks.ids_for_document(filename) for filename in changed_files}
+        new_chunk_ids = {}
+        
+        # 多个进程并行解析，文本块按文件顺序分批嵌入并加入存储，解析与嵌入同时进行
+        file_paths = [os.path.join(pdf_dir, filename) for filename in changed_files]
+        for batch in _batched(_iter_chunks(file_paths, executor, failed=failed), EMBED_BATCH_SIZE):
+            # 跨文件的批次按文件分开处理，一个文件出错不影响相邻的文件
+            for filename, group in itertools.groupby(batch, key=lambda chunk: chunk["metadata"]["file_name"]):
+                group = list(group)
+                if filename in failed:
+                    continue
+                try:
+                    # 生成嵌入（未变化的文本块直接从缓存读取）
+                    embeddings = embed_texts([chunk["content"] for chunk in group], use_cache=True,
+                                             cache_path=store_manager.paths.embedding_cache_path)
+                    
+                    # 添加到索引
+                    new_chunk_ids.setdefault(filename, []).extend(store.add(embeddings, group))
+                except Exception as e:
+                    logger.error(f"处理文件 {filename} 的文本块时出错: {str(e)}", exc_info=True)
+                    failed[filename] = f"处理文本块时出错: {str(e)}"
+        
+        if force and failed:
+            raise RuntimeError("以下文件入库失败，未替换现有索引：" +
+                               "；".join(f"{name}（{error}）" for name, error in failed.items()))
+        
+        # 失败的文件撤销已加入的部分新文本块，保留旧的文本块和清单条目；其余文件移除旧文本块（一次移除，HNSW 只重建一次）
+        store.remove_chunks([chunk_id for filename in changed_files
+                             for chunk_id in (new_chunk_ids.get(filename, []) if filename in failed
+                                              else old_chunk_ids[filename])])
+        total_chunks = 0
+        for filename in changed_files:
+            if filename in failed:
+                continue
+            if filename in new_chunk_ids:
+                _record_manifest(store, filename, manifest_entries[filename])
+                processed_files.append({"name": filename, "chunks": len(new_chunk_ids[filename])})
+                total_chunks += len(new_chunk_ids[filename])
+            else:
+                # 没有提取到内容的文件不登记清单，下次重建时再次尝试
+                store.set_manifest_entry(filename, None)
+        skipped = sum(1 for item in processed_files if item.get("skipped"))
+        
+        # 保存索引（全部重新入库时，没有任何内容则保留原索引）
+        changed = total_chunks > 0 if force else bool(changed_files or removed_files)
+        if changed:
+            # 全部重建时直接保存完整快照，不把整个语料写入操作日志
+            store_manager.publish(store, snapshot=force)
+            
+            # 重建结果已包含全部文件，未完成的入库检查点不再需要
+            for filename in _load_checkpoints(store_manager.paths):
+                _save_checkpoint(store_manager.paths, filename, None)
+            
+            # 清理已不在索引中的缓存向量（只涉及本集合的缓存）
+            get_embedding_cache(store_manager.paths.embedding_cache_path).compact(chunk_cache_keys(
+                [chunk["content"] for _, chunk in store.text_chunks.items()]))
+    
+    message = (f"索引重建完成，处理了 {len(processed_files)} 个PDF文件（其中 {skipped} 个未变化），"
+               f"新入库 {total_chunks} 个文本块")
+    if failed:
+        message += f"；{len(failed)} 个文件入库失败，保留原有内容"
+    return {
+        "message": message,
+        "processed_files": processed_files,
+        "failed_files": [{"name": name, "error": error} for name, error in failed.items()]
+    }
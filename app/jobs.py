@@ -0,0 +1,223 @@
+import copy
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+class JobCancelled(Exception):
+    """任务函数抛出此异常表示任务已无意义（例如入库的文件已被删除），任务状态记为 cancelled 而不是 failed"""
+
+class JobManager:
+    """
+    后台任务管理
+
+    文档入库等耗时操作作为任务提交到线程池执行，请求只返回任务ID；
+    PDF 解析等 CPU 密集的步骤再交给进程池，避免占用 Web 进程的 GIL。
+    任务状态同时写入 jobs 目录，多个 worker 之间可以互相查询。
+    内存中的任务记录只在 self._lock 下修改，对外返回副本；已结束的任务超过 retention_seconds
+    或数量超过 max_finished 时从内存中移除（仍可从任务记录文件中查询），过期的文件定期删除。
+    """
+
+    def __init__(self, jobs_dir, threads, processes, retention_seconds=24 * 3600, max_finished=1000):
+        self.jobs_dir = jobs_dir
+        self.threads = threads
+        self.processes = processes
+        self.retention_seconds = retention_seconds
+        self.max_finished = max_finished
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self._thread_pool = None
+        self._process_pool = None
+
+    def start(self):
+        """创建线程池并清理过期的任务记录（应用启动时调用）"""
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="ingest")
+        self._cleanup()
+
+    def shutdown(self):
+        """停止接收新任务，释放线程池和进程池（应用退出时调用）"""
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    @property
+    def process_pool(self):
+        """CPU 密集任务使用的进程池，首次使用时创建"""
+        with self._lock:
+            if self._process_pool is None:
+                # spawn 启动的子进程不会继承 Web 进程中已加载的模型和线程
+                self._process_pool = ProcessPoolExecutor(max_workers=self.processes,
+                                                         mp_context=multiprocessing.get_context("spawn"))
+            return self._process_pool
+
+    def submit(self, kind, fn, *args, detail=None, **kwargs):
+        """
+        提交后台任务
+
+        Args:
+            kind: 任务类型，例如 "upload"、"rebuild"
+            fn: 在线程池中执行的函数，返回值作为任务结果
+            detail: 附加在任务记录中的信息
+
+        Returns:
+            任务记录
+        """
+        if self._thread_pool is None:
+            self.start()
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": PENDING,
+            "detail": detail or {},
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        # 先写入文件再登记，登记后 cancel() 写入的状态不会被覆盖
+        snapshot = copy.deepcopy(job)
+        self._write(snapshot)
+        with self._lock:
+            self._jobs[job["id"]] = job
+        self._thread_pool.submit(self._run, job, fn, args, kwargs)
+        logger.info(f"已提交后台任务 {job['id']}（{kind}）")
+        return snapshot
+
+    def _run(self, job, fn, args, kwargs):
+        # 与 cancel() 互斥：已取消的任务不再开始
+        with self._lock:
+            if job["status"] == CANCELLED:
+                return
+            job.update(status=RUNNING, started_at=time.time())
+            snapshot = copy.deepcopy(job)
+        self._write(snapshot)
+        try:
+            result = fn(*args, **kwargs)
+            changes = {"status": SUCCEEDED, "result": result}
+        except JobCancelled as e:
+            logger.info(f"后台任务 {job['id']}（{job['kind']}）已取消: {str(e)}")
+            changes = {"status": CANCELLED, "error": str(e)}
+        except Exception as e:
+            logger.error(f"后台任务 {job['id']}（{job['kind']}）失败: {str(e)}", exc_info=True)
+            changes = {"status": FAILED, "error": str(e)}
+        self._update(job, finished_at=time.time(), **changes)
+
+    def get(self, job_id):
+        """查询任务状态，本进程中没有时读取其他 worker 写入的记录"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return copy.deepcopy(job)
+
+        path = self._job_path(job_id)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def unfinished(self, kind, **detail):
+        """本进程中指定类型、detail 中各项都匹配且尚未结束的任务"""
+        with self._lock:
+            return [copy.deepcopy(job) for job in self._jobs.values()
+                    if job["kind"] == kind and job["status"] in (PENDING, RUNNING)
+                    and all(job["detail"].get(key) == value for key, value in detail.items())]
+
+    def cancel(self, job_id, reason):
+        """
+        取消本进程中尚未开始的任务；已开始的任务不能中断，由任务函数自行检查后抛出 JobCancelled
+
+        Returns:
+            任务是否在开始前被取消
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != PENDING:
+                return False
+            job.update(status=CANCELLED, error=reason, finished_at=time.time())
+            snapshot = copy.deepcopy(job)
+            self._prune()
+        self._write(snapshot)
+        logger.info(f"后台任务 {job_id}（{job['kind']}）已取消: {reason}")
+        return True
+
+    def _job_path(self, job_id):
+        # 任务ID由 uuid4().hex 生成，拒绝其他格式，防止路径穿越
+        if len(job_id) != 32 or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _update(self, job, **changes):
+        """在锁内修改任务记录，再把修改后的副本写入任务记录文件"""
+        with self._lock:
+            job.update(changes)
+            snapshot = copy.deepcopy(job)
+            if job["status"] in FINISHED:
+                self._prune()
+        self._write(snapshot)
+
+    def _prune(self):
+        """从内存中移除过期或超出数量的已结束任务（调用方持有 self._lock）"""
+        deadline = time.time() - self.retention_seconds
+        finished = sorted((job["finished_at"], job_id) for job_id, job in self._jobs.items()
+                          if job["status"] in FINISHED)
+        overflow = len(finished) - self.max_finished
+        for i, (finished_at, job_id) in enumerate(finished):
+            if i >= overflow and finished_at >= deadline:
+                break
+            del self._jobs[job_id]
+
+    def _write(self, snapshot):
+        # 同一任务的状态依次由 submit()、cancel() 或 _run() 所在的线程修改，写入不会交错
+        try:
+            path = self._job_path(snapshot["id"])
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"保存任务状态失败: {str(e)}")
+        # 长时间运行时定期删除过期的任务记录文件
+        if time.time() - self._last_cleanup > self.retention_seconds / 24:
+            self._cleanup()
+
+    def _cleanup(self):
+        """删除过期的任务记录"""
+        self._last_cleanup = time.time()
+        deadline = time.time() - self.retention_seconds
+        try:
+            names = os.listdir(self.jobs_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.jobs_dir, name)
+            try:
+                if os.path.getmtime(path) < deadline:
+                    os.remove(path)
+            except OSError:
+                pass
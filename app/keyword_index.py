@@ -0,0 +1,347 @@
+import json
+import logging
+import math
+import os
+import re
+import unicodedata
+import uuid
+from collections import Counter
+
+import numpy as np
+
+from app.chunk_store import _load_mmap
+from app.wal import fsync_path
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 一个版本的数据文件
+_SUFFIXES = ('.terms.json', '.offsets.npy', '.postings.npy', '.tf.npy', '.doc_ids.npy', '.doc_len.npy')
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 连续的中日韩字符，或由字母数字组成、可用 - _ . / 连接的词（型号、编号等）
+_CJK = '\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TERM_RE = re.compile(rf'[{_CJK}]+|[a-z0-9]+(?:[-_./][a-z0-9]+)*')
+_SEPARATOR_RE = re.compile(r"[-_./]")
+
+def tokenize(text):
+    """
+    把文本切分为检索词
+
+    中日韩字符不依赖分词词典，按相邻两字切分（单独的一个字保留为一个词）；
+    字母数字统一全角/半角和大小写后整体作为一个词，带连接符的编号（如 AB-1203）另外拆出各段。
+    """
+    text = unicodedata.normalize("NFKC", text).casefold()
+    terms = []
+    for match in _TERM_RE.finditer(text):
+        word = match.group()
+        if word[0].isascii():
+            terms.append(word)
+            if _SEPARATOR_RE.search(word):
+                terms.extend(_SEPARATOR_RE.split(word))
+        elif len(word) == 1:
+            terms.append(word)
+        else:
+            terms.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return terms
+
+class KeywordIndex:
+    """
+    BM25 倒排索引
+
+    磁盘格式：
+        keywords.json                    版本号、文本块数、总词数
+        keywords-<版本>.terms.json       检索词表（按字典序）
+        keywords-<版本>.offsets.npy      每个检索词的倒排列表在 postings 中的偏移量（长度为词数+1）
+        keywords-<版本>.postings.npy     chunk_id（每个检索词内升序）
+        keywords-<版本>.tf.npy           词频
+        keywords-<版本>.doc_ids.npy      chunk_id（升序）
+        keywords-<版本>.doc_len.npy      文本块的词数
+
+    与 ChunkStore 相同：数据文件以内存映射方式打开，新增的文本块先保存在内存中，
+    删除只记录 chunk_id，save()（或向量存储保存快照时的 write_version()）合并写入新版本的文件。
+    内存中的文本块同样按检索词建立倒排表，检索时只查找问题中的检索词，不遍历全部新增的文本块。
+    """
+
+    def __init__(self):
+        self._version = None
+        self._terms = {}
+        self._offsets = np.zeros(1, dtype='int64')
+        self._postings = np.zeros(0, dtype='int64')
+        self._tf = np.zeros(0, dtype='int32')
+        self._doc_ids = np.zeros(0, dtype='int64')
+        self._doc_len = np.zeros(0, dtype='int32')
+        # 尚未写入磁盘的文本块：chunk_id -> 词频
+        self._pending = {}
+        # 这些文本块的倒排表（检索词 -> {chunk_id: 词频}）和词数
+        self._pending_postings = {}
+        self._pending_len = {}
+        # 本实例已复制过、可以直接修改的倒排表；copy() 得到的副本与原实例共享其余的倒排表，修改前先复制
+        self._owned_terms = set()
+        # 已从磁盘数据中删除的 chunk_id
+        self._deleted = set()
+        self._count = 0
+        self._total_len = 0
+
+    def __len__(self):
+        return self._count
+
+    def _base_len(self, chunk_id):
+        """返回磁盘数据中 chunk_id 的词数，不存在时返回 None"""
+        row = int(np.searchsorted(self._doc_ids, chunk_id))
+        if row < len(self._doc_ids) and self._doc_ids[row] == chunk_id:
+            return int(self._doc_len[row])
+        return None
+
+    def _own_postings(self, term):
+        """返回可以修改的 term 倒排表（与其他实例共享时先复制）"""
+        postings = self._pending_postings.get(term)
+        if term not in self._owned_terms:
+            postings = dict(postings) if postings is not None else {}
+            self._pending_postings[term] = postings
+            self._owned_terms.add(term)
+        return postings
+
+    def add(self, chunk_id, text):
+        """索引一个文本块"""
+        counts = Counter(tokenize(text))
+        self._pending[chunk_id] = counts
+        length = sum(counts.values())
+        self._pending_len[chunk_id] = length
+        for term, tf in counts.items():
+            self._own_postings(term)[chunk_id] = tf
+        self._count += 1
+        self._total_len += length
+
+    def remove(self, chunk_ids):
+        """删除一组文本块"""
+        for chunk_id in chunk_ids:
+            counts = self._pending.pop(chunk_id, None)
+            if counts is not None:
+                for term in counts:
+                    postings = self._own_postings(term)
+                    del postings[chunk_id]
+                    if not postings:
+                        del self._pending_postings[term]
+                        self._owned_terms.discard(term)
+                self._count -= 1
+                self._total_len -= self._pending_len.pop(chunk_id)
+            elif chunk_id not in self._deleted:
+                length = self._base_len(chunk_id)
+                if length is not None:
+                    self._deleted.add(chunk_id)
+                    self._count -= 1
+                    self._total_len -= length
+
+    def copy(self):
+        """复制出可独立修改的实例，磁盘数据以只读映射方式共享"""
+        new_index = KeywordIndex()
+        new_index.__dict__.update(self.__dict__)
+        new_index._pending = dict(self._pending)
+        new_index._pending_postings = dict(self._pending_postings)
+        new_index._pending_len = dict(self._pending_len)
+        new_index._deleted = set(self._deleted)
+        # 倒排表由两个实例共享，双方修改前都要先复制
+        new_index._owned_terms = set()
+        self._owned_terms = set()
+        return new_index
+
+    def search(self, query, top_k=5, ids=None, min_idf=None):
+        """
+        按 BM25 检索
+
+        Args:
+            ids: 只在这些 chunk_id（升序数组）中检索，None 表示不限
+            min_idf: 只返回至少匹配一个 IDF 不低于此值的检索词的文本块（只匹配到常见词的不返回），None 表示不限
+
+        Returns:
+            [(chunk_id, 分数)]，按分数从高到低排列
+        """
+        terms = set(tokenize(query))
+        if not terms or self._count == 0:
+            return []
+        avg_len = self._total_len / self._count
+        deleted = np.fromiter(self._deleted, dtype='int64') if self._deleted else None
+        # 内存中的文本块按集合判断是否在检索范围内，只在用到时转换一次
+        allowed_pending = None
+
+        hit_ids, hit_scores, rare_ids = [], [], []
+        for term in terms:
+            row = self._terms.get(term)
+            if row is not None:
+                start, end = int(self._offsets[row]), int(self._offsets[row + 1])
+                term_ids = self._postings[start:end]
+                tf = self._tf[start:end]
+                if deleted is not None:
+                    live = ~np.isin(term_ids, deleted)
+                    term_ids, tf = term_ids[live], tf[live]
+            else:
+                term_ids = tf = np.zeros(0, dtype='int64')
+
+            pending = self._pending_postings.get(term, {})
+            # 文档频率按全部文本块统计，不受 ids 限制
+            df = len(term_ids) + len(pending)
+            if ids is not None:
+                allowed = np.isin(term_ids, ids)
+                term_ids, tf = term_ids[allowed], tf[allowed]
+                if pending:
+                    if allowed_pending is None:
+                        allowed_pending = set(np.asarray(ids).tolist())
+                    pending = {chunk_id: count for chunk_id, count in pending.items() if chunk_id in allowed_pending}
+            lengths = self._doc_len[np.searchsorted(self._doc_ids, term_ids)]
+            if pending:
+                term_ids = np.concatenate([term_ids, np.fromiter(pending, dtype='int64', count=len(pending))])
+                tf = np.concatenate([tf, np.fromiter(pending.values(), dtype='int64', count=len(pending))])
+                lengths = np.concatenate([lengths, np.fromiter((self._pending_len[chunk_id] for chunk_id in pending),
+                                                               dtype='int64', count=len(pending))])
+            if len(term_ids) == 0:
+                continue
+
+            idf = math.log(1 + (self._count - df + 0.5) / (df + 0.5))
+            tf = tf.astype('float32')
+            hit_ids.append(term_ids)
+            hit_scores.append(idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_len)))
+            if min_idf is None or idf >= min_idf:
+                rare_ids.append(term_ids)
+
+        if not rare_ids:
+            return []
+        unique_ids, inverse = np.unique(np.concatenate(hit_ids), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(hit_scores))
+        if min_idf is not None:
+            rare = np.isin(unique_ids, np.concatenate(rare_ids))
+            unique_ids, totals = unique_ids[rare], totals[rare]
+        if len(totals) > top_k:
+            top = np.argpartition(-totals, top_k - 1)[:top_k]
+        else:
+            top = np.arange(len(totals))
+        top = top[np.argsort(-totals[top], kind='stable')]
+        return list(zip(unique_ids[top].tolist(), totals[top].tolist()))
+
+    def write_version(self, path):
+        """合并内存中的新数据，写入新版本的数据文件并同步到磁盘，返回该版本的头信息（不改变当前实例）"""
+        # 全部倒排项展开为 (检索词, chunk_id, 词频) 三列
+        base_terms = np.asarray(sorted(self._terms, key=self._terms.get), dtype=str)
+        term_col = [base_terms[np.repeat(np.arange(len(base_terms)), np.diff(self._offsets))]]
+        id_col = [np.asarray(self._postings)]
+        tf_col = [np.asarray(self._tf)]
+        doc_ids = np.asarray(self._doc_ids)
+        doc_len = np.asarray(self._doc_len)
+        if self._deleted:
+            deleted = np.fromiter(self._deleted, dtype='int64')
+            live = ~np.isin(id_col[0], deleted)
+            term_col[0], id_col[0], tf_col[0] = term_col[0][live], id_col[0][live], tf_col[0][live]
+            live = ~np.isin(doc_ids, deleted)
+            doc_ids, doc_len = doc_ids[live], doc_len[live]
+        if self._pending:
+            pending = [(term, chunk_id, tf) for chunk_id, counts in self._pending.items()
+                       for term, tf in counts.items()]
+            terms, chunk_ids, tfs = zip(*pending) if pending else ((), (), ())
+            term_col.append(np.asarray(terms, dtype=str))
+            id_col.append(np.asarray(chunk_ids, dtype='int64'))
+            tf_col.append(np.asarray(tfs, dtype='int32'))
+            doc_ids = np.concatenate([doc_ids, np.fromiter(self._pending, dtype='int64')])
+            doc_len = np.concatenate([doc_len, np.fromiter(self._pending_len.values(), dtype='int32')])
+
+        vocabulary, term_rows = np.unique(np.concatenate(term_col), return_inverse=True)
+        postings = np.concatenate(id_col)
+        tf = np.concatenate(tf_col)
+        order = np.lexsort((postings, term_rows))
+        offsets = np.zeros(len(vocabulary) + 1, dtype='int64')
+        np.cumsum(np.bincount(term_rows, minlength=len(vocabulary)), out=offsets[1:])
+        doc_order = np.argsort(doc_ids, kind='stable')
+
+        directory = os.path.dirname(path)
+        prefix = os.path.splitext(os.path.basename(path))[0]
+        version = uuid.uuid4().hex[:12]
+        base = os.path.join(directory, f"{prefix}-{version}")
+
+        with open(base + '.terms.json', 'w', encoding='utf-8') as f:
+            json.dump(vocabulary.tolist(), f, ensure_ascii=False)
+        np.save(base + '.offsets.npy', offsets)
+        np.save(base + '.postings.npy', postings[order].astype('int64'))
+        np.save(base + '.tf.npy', tf[order].astype('int32'))
+        np.save(base + '.doc_ids.npy', doc_ids[doc_order].astype('int64'))
+        np.save(base + '.doc_len.npy', doc_len[doc_order].astype('int32'))
+        for suffix in _SUFFIXES:
+            fsync_path(base + suffix)
+
+        return {
+            'version': version,
+            'count': len(doc_ids),
+            'total_len': int(doc_len.sum()),
+        }
+
+    def save(self, path):
+        """写入新版本的数据文件，最后替换 keywords.json"""
+        header = self.write_version(path)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(header, f)
+        os.replace(tmp_path, path)
+
+        old_version = self._version
+        self._open(path, header)
+        if old_version and old_version != header['version']:
+            self.remove_version(path, old_version)
+        logger.info(f"关键词索引已保存，包含 {header['count']} 条文本，{len(self._terms)} 个检索词")
+
+    @classmethod
+    def load(cls, path, header=None):
+        """以内存映射方式打开磁盘上的关键词索引；header 为快照中记录的头信息，默认读取 keywords.json"""
+        if header is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                header = json.load(f)
+        index = cls()
+        index._open(path, header)
+        return index
+
+    @staticmethod
+    def remove_version(path, version):
+        """删除旧版本的数据文件；文件仍被其他进程映射而无法删除时忽略"""
+        _remove_version(os.path.dirname(path), os.path.splitext(os.path.basename(path))[0], version)
+
+    @classmethod
+    def build(cls, chunks):
+        """从 (chunk_id, 文本块) 序列构建（用于为已有的存储补建关键词索引）"""
+        index = cls()
+        for chunk_id, chunk in chunks:
+            index.add(chunk_id, chunk.get('content', '') if isinstance(chunk, dict) else str(chunk))
+        return index
+
+    def _open(self, path, header):
+        base = os.path.join(os.path.dirname(path),
+                            f"{os.path.splitext(os.path.basename(path))[0]}-{header['version']}")
+        self._version = header['version']
+        self._count = header['count']
+        self._total_len = header['total_len']
+        self._pending = {}
+        self._pending_postings = {}
+        self._pending_len = {}
+        self._owned_terms = set()
+        self._deleted = set()
+        with open(base + '.terms.json', 'r', encoding='utf-8') as f:
+            self._terms = {term: row for row, term in enumerate(json.load(f))}
+        self._offsets = _load_mmap(base + '.offsets.npy')
+        if header['count'] == 0:
+            self._postings = np.zeros(0, dtype='int64')
+            self._tf = np.zeros(0, dtype='int32')
+            self._doc_ids = np.zeros(0, dtype='int64')
+            self._doc_len = np.zeros(0, dtype='int32')
+            return
+        self._postings = _load_mmap(base + '.postings.npy')
+        self._tf = _load_mmap(base + '.tf.npy')
+        self._doc_ids = _load_mmap(base + '.doc_ids.npy')
+        self._doc_len = _load_mmap(base + '.doc_len.npy')
+
+
+def _remove_version(directory, prefix, version):
+    for suffix in _SUFFIXES:
+        try:
+            os.remove(os.path.join(directory, f"{prefix}-{version}{suffix}"))
+        except OSError:
+            pass
@@ -1,10 +1,50 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-import os
-from app.routes import router
+from app.routes import router, store_manager
+from app.index_service import start_index, stop_index
+from app.index_client import connect, disconnect, forward_router
+from app.rag_engine import deepseek_client
+from app.config import INDEX_SERVICE_URL
 
-app = FastAPI(title="RAG PPT QA with Deepseek")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时显示帮助信息并加载常驻向量存储（薄 worker 模式下连接索引服务）"""
+    from app.config import DEEPSEEK_API_KEY
+    
+    print("\n" + "="*60)
+    print("  PDF 智能问答系统 - RAG-PDF-DeepSeek")
+    print("="*60)
+    
+    if not DEEPSEEK_API_KEY:
+        print("\n⚠️  警告: DEEPSEEK_API_KEY 环境变量未设置")
+        print("请在终端使用以下命令设置 API 密钥:")
+        print("  Windows: set DEEPSEEK_API_KEY=your_api_key")
+        print("  Linux/Mac: export DEEPSEEK_API_KEY=your_api_key\n")
+    else:
+        print("\n✓ API 密钥已配置")
+    
+    print("\n访问地址: http://127.0.0.1:8000")
+    print("="*60 + "\n")
+    
+    if INDEX_SERVICE_URL:
+        # 薄 worker：嵌入模型和向量索引只在索引服务进程中，本进程不加载
+        connect(INDEX_SERVICE_URL)
+    else:
+        start_index()
+        app.state.vector_store = store_manager
+    
+    yield
+    
+    # 停止后台任务和嵌入调度器（或断开索引服务），关闭 DeepSeek 连接池
+    if INDEX_SERVICE_URL:
+        disconnect()
+    else:
+        await stop_index()
+    await deepseek_client.aclose()
+
+app = FastAPI(title="RAG PPT QA with Deepseek", lifespan=lifespan)
 
 # 添加CORS支持
 app.add_middleware(
@@ -15,7 +55,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 包含API路由
+# 包含API路由；薄 worker 模式下文档和集合管理等接口转发给索引服务（先注册，优先匹配）
+if INDEX_SERVICE_URL:
+    app.include_router(forward_router)
 app.include_router(router)
 
 # 挂载静态文件目录
@@ -26,23 +68,3 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 async def root():
     from fastapi.responses import FileResponse
     return FileResponse("static/index.html")
-
-# 在服务启动时显示帮助信息
-@app.on_event("startup")
-async def startup_event():
-    from app.config import DEEPSEEK_API_KEY
-    
-    print("\n" + "="*60)
-    print("  PDF 智能问答系统 - RAG-PDF-DeepSeek")
-    print("="*60)
-    
-    if not DEEPSEEK_API_KEY:
-        print("\n⚠️  警告: DEEPSEEK_API_KEY 环境变量未设置")
-        print("请在终端使用以下命令设置 API 密钥:")
-        print("  Windows: set DEEPSEEK_API_KEY=your_api_key")
-        print("  Linux/Mac: export DEEPSEEK_API_KEY=your_api_key\n")
-    else:
-        print("\n✓ API 密钥已配置")
-    
-    print("\n访问地址: http://127.0.0.1:8000")
-    print("="*60 + "\n")
\ No newline at end of file
@@ -1,152 +1,329 @@
 import os
 import fitz  # PyMuPDF
+import glob
 import logging
-from typing import List, Dict, Any, Optional
+from bisect import bisect_left, bisect_right
+from collections import deque
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 import re
+import threading
+from app.config import (PDF_PAGES_PER_SHARD, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS,
+                        EMBEDDING_MODEL_NAME, MODEL_DIR)
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_text_from_pdf(file_path: str) -> List[Dict[str, Any]]:
+def extract_text_from_pdf(file_path: str, page_range: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
     """
     从PDF文件中提取文本内容，按页面分块
     
     Args:
         file_path: PDF文件路径
+        page_range: 只提取 [起始页, 结束页) 范围内的页面（从0开始），默认提取全部
         
     Returns:
-        包含每页文本内容和元数据的字典列表
+        包含每页文本内容和元数据的字典列表，出错时返回空列表
     """
     try:
-        logger.info(f"开始处理PDF文件: {file_path}")
-        text_chunks = []
+        return _extract_pages(file_path, page_range)
+    except Exception as e:
+        logger.error(f"处理PDF文件 {file_path} 时出错: {str(e)}", exc_info=True)
+        return []
+
+def _extract_pages(file_path: str, page_range: Optional[Tuple[int, int]] = None) -> List[Dict[str, Any]]:
+    """extract_text_from_pdf 的实现，出错时抛出异常（入库时不能把解析失败当作没有内容）"""
+    logger.info(f"开始处理PDF文件: {file_path}")
+    text_chunks = []
+    
+    # 打开PDF文件
+    with fitz.open(file_path) as doc:
+        # 获取文件名作为文档标题
+        file_name = os.path.basename(file_path)
         
-        # 打开PDF文件
-        with fitz.open(file_path) as doc:
-            # 获取文件名作为文档标题
-            file_name = os.path.basename(file_path)
+        # 提取文档属性
+        metadata = doc.metadata
+        doc_title = metadata.get("title", "") or file_name
+        doc_author = metadata.get("author", "未知作者")
+        page_count = len(doc)
+        
+        logger.info(f"PDF '{doc_title}' 共 {page_count} 页，作者: {doc_author}")
+        
+        start, end = page_range if page_range else (0, page_count)
+        
+        # 处理每一页
+        for page_num in range(start, min(end, page_count)):
+            page = doc[page_num]
             
-            # 提取文档属性
-            metadata = doc.metadata
-            doc_title = metadata.get("title", "") or file_name
-            doc_author = metadata.get("author", "未知作者")
-            page_count = len(doc)
+            # 提取页面文本
+            text = page.get_text("text")
             
-            logger.info(f"PDF '{doc_title}' 共 {page_count} 页，作者: {doc_author}")
+            # 如果页面内容为空，跳过
+            if not text.strip():
+                continue
             
-            # 处理每一页
-            for page_num, page in enumerate(doc):
-                # 提取页面文本
-                text = page.get_text("text")
-                
-                # 如果页面内容为空，跳过
-                if not text.strip():
-                    continue
-                
-                # 创建页面标题
-                page_title = f"第 {page_num + 1} 页"
-                
-                # 页面元数据
-                page_metadata = {
-                    "source_type": "pdf",
-                    "file_name": file_name,
-                    "doc_title": doc_title,
-                    "doc_author": doc_author,
-                    "page_num": page_num + 1,
-                    "total_pages": page_count,
-                }
-                
-                # 构建内容块
-                content = f"标题: {doc_title}\n页码: {page_num + 1}/{page_count}\n\n{text}"
-                
-                # 添加到结果列表
-                text_chunks.append({
-                    "content": content,
-                    "metadata": page_metadata
-                })
-        
-        logger.info(f"从PDF提取了 {len(text_chunks)} 页内容")
-        return text_chunks
+            # 页面元数据
+            page_metadata = {
+                "source_type": "pdf",
+                "file_name": file_name,
+                "doc_title": doc_title,
+                "doc_author": doc_author,
+                "page_num": page_num + 1,
+                "total_pages": page_count,
+            }
+            
+            # 标题和页码已在元数据中，内容只保留页面文本，避免占用模型的 token 长度
+            text_chunks.append({
+                "content": text,
+                "metadata": page_metadata
+            })
+    
+    logger.info(f"从PDF提取了 {len(text_chunks)} 页内容")
+    return text_chunks
+
+# 断句位置：中英文句末标点、分号之后，以及换行处
+_BOUNDARY_RE = re.compile(r'[。！？；!?;]+|\.(?=\s)|\n+')
+
+# 没有本地分词器时用于估算 token 的规则：CJK 字符、数字、标点和其他非字母字符每个算一个，字母每 3 个算一个。
+# SentencePiece 常把数字串、型号、字母数字混排切得很碎，估算不能保证不低于实际的子词数，
+# 因此估算时每块只用模型长度的 _ESTIMATE_MARGIN，仍然超出的部分会被模型截断
+_CJK = '\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af\uf900-\ufaff'
+_TOKEN_RE = re.compile(rf'[{_CJK}]|[^\W\d_{_CJK}]{{1,3}}|\d|_|[^\w\s]')
+_ESTIMATE_MARGIN = 0.8
+
+# 分词器在每个进程中只加载一次；False 表示尚未加载，None 表示本地没有可用的分词器
+_tokenizer = False
+_tokenizer_lock = threading.Lock()
+
+def _get_tokenizer():
+    """加载嵌入模型自带的分词器（只读取本地文件，不会触发下载）"""
+    global _tokenizer
+    if _tokenizer is False:
+        with _tokenizer_lock:
+            if _tokenizer is False:
+                _tokenizer = _load_tokenizer()
+    return _tokenizer
+
+def _load_tokenizer():
+    pattern = os.path.join(MODEL_DIR, '**', 'tokenizer.json')
+    for path in glob.glob(pattern, recursive=True):
+        if EMBEDDING_MODEL_NAME in path:
+            try:
+                from tokenizers import Tokenizer
+                return Tokenizer.from_file(path)
+            except Exception as e:
+                logger.warning(f"加载分词器 {path} 失败，改为估算 token 数: {str(e)}")
+                return None
+    logger.warning(f"本地没有找到嵌入模型的分词器（{pattern}），按规则保守估算 token 数，"
+                   f"文本块会比模型长度短，个别块仍可能被截断")
+    return None
+
+def token_counting() -> str:
+    """token 的计数方式（分词器，或估算规则的版本），变化后已入库的文件需要重新分块"""
+    return "tokenizer" if _get_tokenizer() is not None else "estimate-2"
+
+def _token_spans(text: str) -> List[Tuple[int, int]]:
+    """返回每个 token 在文本中的 (起始, 结束) 字符位置"""
+    tokenizer = _get_tokenizer()
+    if tokenizer is not None:
+        return [span for span in tokenizer.encode(text, add_special_tokens=False).offsets if span[1] > span[0]]
+    return [match.span() for match in _TOKEN_RE.finditer(text)]
+
+def split_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS,
+               overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Tuple[int, int, int, int]]:
+    """
+    按 token 数把文本分割成块，尽量在句子边界处断开
+    
+    文本只分词一次、断句位置只扫描一次，每个块在预算内选择最靠后的句子边界；
+    找不到合适的边界时按 token 数直接截断。
+    
+    Args:
+        text: 待分割的文本
+        max_tokens: 模型的最大序列长度（包含首尾两个特殊 token）
+        overlap_tokens: 相邻块之间重叠的 token 数
         
-    except Exception as e:
-        logger.error(f"处理PDF文件 {file_path} 时出错: {str(e)}", exc_info=True)
+    Returns:
+        (起始字符, 结束字符, 起始 token, 结束 token) 列表，均为左闭右开
+    """
+    spans = _token_spans(text)
+    if not spans:
         return []
+        
+    # 句子边界对应的 token 下标：边界之后的第一个 token
+    token_starts = [start for start, _ in spans]
+    breaks = sorted({bisect_left(token_starts, match.end()) for match in _BOUNDARY_RE.finditer(text)})
+    
+    budget = max(max_tokens - 2, 1)
+    if _get_tokenizer() is None:
+        # 估算的 token 数可能低于实际的子词数，预留余量
+        budget = max(int(budget * _ESTIMATE_MARGIN), 1)
+    overlap_tokens = min(overlap_tokens, budget // 2)
+    pieces = []
+    start = 0
+    while start < len(spans):
+        end = start + budget
+        if end >= len(spans):
+            end = len(spans)
+        else:
+            # 预算内最靠后的句子边界，太靠前（块不到一半）时直接截断
+            i = bisect_right(breaks, end) - 1
+            if i >= 0 and breaks[i] > start + budget // 2:
+                end = breaks[i]
+        pieces.append((spans[start][0], spans[end - 1][1], start, end))
+        if end >= len(spans):
+            break
+        start = max(end - overlap_tokens, start + 1)
+    return pieces
 
-def extract_text_with_chunking(file_path: str, chunk_size: int = 1000, overlap: int = 200) -> List[Dict[str, Any]]:
+def extract_text_with_chunking(file_path: str, max_tokens: int = CHUNK_MAX_TOKENS,
+                               overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Dict[str, Any]]:
     """
-    从PDF中提取文本，并分割成指定大小的块，便于精确检索
+    从PDF中提取文本，并按嵌入模型的最大序列长度分割成块，便于精确检索
     
     Args:
         file_path: PDF文件路径
-        chunk_size: 每个文本块的最大字符数
-        overlap: 相邻块之间的重叠字符数
+        max_tokens: 每个文本块的最大 token 数
+        overlap_tokens: 相邻块之间重叠的 token 数
         
     Returns:
         文本块列表
     """
     try:
-        # 先提取完整的页面内容
-        page_chunks = extract_text_from_pdf(file_path)
+        detailed_chunks = chunk_pages(extract_text_from_pdf(file_path), max_tokens, overlap_tokens)
+        logger.info(f"PDF细分为 {len(detailed_chunks)} 个文本块")
+        return detailed_chunks
         
-        # 如果内容不多，直接返回页面级别的块
-        if len(page_chunks) <= 5:
-            return page_chunks
+    except Exception as e:
+        logger.error(f"PDF分块处理失败: {str(e)}", exc_info=True)
+        return []
+
+def chunk_pages(page_chunks: List[Dict[str, Any]], max_tokens: int = CHUNK_MAX_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[Dict[str, Any]]:
+    """
+    把页面级别的块分割成不超过模型长度的块
+    
+    每个块的元数据记录它在页面文本中的字符位置（char_start、char_end）和 token 位置（token_start、token_end）。
+    
+    Args:
+        page_chunks: extract_text_from_pdf 返回的页面块
+        max_tokens: 每个文本块的最大 token 数
+        overlap_tokens: 相邻块之间重叠的 token 数
         
-        # 处理较大的PDF，进一步分块
-        detailed_chunks = []
+    Returns:
+        文本块列表
+    """
+    detailed_chunks = []
+    
+    for page_chunk in page_chunks:
+        text = page_chunk["content"]
+        metadata = page_chunk["metadata"]
+        pieces = split_text(text, max_tokens, overlap_tokens)
         
-        for page_chunk in page_chunks:
-            text = page_chunk["content"]
-            metadata = page_chunk["metadata"]
-            
-            # 如果文本长度小于块大小，直接添加
-            if len(text) <= chunk_size:
-                detailed_chunks.append(page_chunk)
-                continue
-            
-            # 分割文本
-            start = 0
-            chunk_num = 1
-            
-            while start < len(text):
-                # 计算当前块的结束位置
-                end = min(start + chunk_size, len(text))
-                
-                # 如果不是文本的结尾，尽量在一个完整的句子结束位置断开
-                if end < len(text):
-                    # 寻找适合的断句点
-                    break_points = ['.', '!', '?', '\n', '。', '！', '？', '；', ';']
-                    best_end = end
-                    
-                    # 在块大小范围内找最后的断句点
-                    for point in break_points:
-                        pos = text.rfind(point, start, end)
-                        if pos > start and (pos + 1) > best_end - 200:  # 确保找到的位置不会使块太小
-                            best_end = pos + 1
-                            break
-                    
-                    end = best_end
-                
-                # 创建新的块
-                new_metadata = metadata.copy()
-                new_metadata["chunk_num"] = chunk_num
+        for chunk_num, (char_start, char_end, token_start, token_end) in enumerate(pieces, 1):
+            new_metadata = metadata.copy()
+            new_metadata.update({
+                "chunk_num": chunk_num,
+                "char_start": char_start,
+                "char_end": char_end,
+                "token_start": token_start,
+                "token_end": token_end,
+            })
+            if len(pieces) > 1:
                 new_metadata["sub_chunk"] = True
                 
-                chunk_content = text[start:end].strip()
-                if chunk_content:
-                    detailed_chunks.append({
-                        "content": chunk_content,
-                        "metadata": new_metadata
-                    })
-                
-                # 更新下一个块的起始位置，考虑重叠
-                start = max(0, end - overlap)
-                chunk_num += 1
-        
-        logger.info(f"PDF细分为 {len(detailed_chunks)} 个文本块")
-        return detailed_chunks
+            detailed_chunks.append({
+                "content": text[char_start:char_end],
+                "metadata": new_metadata
+            })
+    
+    return detailed_chunks
+
+def extract_pdf_shard(file_path: str, start: int, end: int) -> List[Dict[str, Any]]:
+    """
+    解析PDF的一部分页面并分块，供进程池调用
+    
+    Args:
+        file_path: PDF文件路径
+        start, end: 页面范围 [start, end)
         
+    Returns:
+        文本块列表；解析出错时抛出异常
+    """
+    return chunk_pages(_extract_pages(file_path, (start, end)))
+
+def get_page_count(file_path: str) -> int:
+    """返回PDF的页数，无法打开时返回 0"""
+    try:
+        with fitz.open(file_path) as doc:
+            return len(doc)
     except Exception as e:
-        logger.error(f"PDF分块处理失败: {str(e)}", exc_info=True)
-        return []
\ No newline at end of file
+        logger.error(f"打开PDF文件 {file_path} 失败: {str(e)}")
+        return 0
+
+def plan_extraction(file_paths: List[str], pages_per_shard: int = PDF_PAGES_PER_SHARD,
+                    start_page: int = 0) -> List[Tuple[str, int, int]]:
+    """
+    把文件列表拆成解析任务，每个任务最多包含 pages_per_shard 页
+    
+    Args:
+        file_paths: PDF文件路径列表
+        pages_per_shard: 每个任务的页数
+        start_page: 从第几页开始（从0开始，用于断点续传）
+        
+    Returns:
+        (文件路径, 起始页, 结束页) 列表，按文件和页码顺序排列
+    """
+    tasks = []
+    for file_path in file_paths:
+        page_count = get_page_count(file_path)
+        if page_count == 0:
+            # 无法打开的文件也生成一个任务，由解析时的错误报告失败，而不是当作没有内容
+            tasks.append((file_path, 0, 0))
+        for start in range(start_page, page_count, pages_per_shard):
+            tasks.append((file_path, start, min(start + pages_per_shard, page_count)))
+    return tasks
+
+def iter_extract_shards(tasks: List[Tuple[str, int, int]], executor=None,
+                        max_pending: Optional[int] = None) -> Iterator[Tuple[str, int, List[Dict[str, Any]]]]:
+    """
+    按顺序执行解析任务，逐个产出 (文件路径, 起始页, 文本块列表)
+    
+    有进程池时多个任务并行解析，但同时提交的任务数不超过 max_pending（默认为进程数的两倍），
+    消费方处理得慢时不会堆积过多结果；没有进程池时在当前进程中依次解析。
+    解析出错的任务产出的文本块列表为 None（错误已记录日志），调用方不能把该文件当作已完整入库。
+    
+    Args:
+        tasks: plan_extraction 返回的任务列表
+        executor: 进程池
+        max_pending: 同时提交的最大任务数
+    """
+    if executor is None:
+        for file_path, start, end in tasks:
+            try:
+                chunks = extract_pdf_shard(file_path, start, end)
+            except Exception as e:
+                logger.error(f"解析PDF文件 {file_path} 时出错: {str(e)}", exc_info=True)
+                chunks = None
+            yield file_path, start, chunks
+        return
+        
+    if max_pending is None:
+        max_pending = 2 * (getattr(executor, "_max_workers", None) or os.cpu_count() or 1)
+        
+    pending = deque()
+    next_task = 0
+    while next_task < len(tasks) or pending:
+        # 补充任务到窗口上限
+        while next_task < len(tasks) and len(pending) < max_pending:
+            file_path, start, end = tasks[next_task]
+            pending.append((file_path, start, executor.submit(extract_pdf_shard, file_path, start, end)))
+            next_task += 1
+            
+        # 按提交顺序取结果，保证输出顺序确定
+        file_path, start, future = pending.popleft()
+        try:
+            chunks = future.result()
+        except Exception as e:
+            logger.error(f"解析PDF文件 {file_path} 时出错: {str(e)}", exc_info=True)
+            chunks = None
+        yield file_path, start, chunks
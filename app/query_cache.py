@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from app.config import (QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+from app.embedder import model_version
+from app.embedding_batcher import embedding_batcher
+from app.index_client import remote_index
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存，条目超过 ttl 秒后失效
+
+    达到容量上限时淘汰最久未使用的条目，同时统计命中和未命中次数。
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """返回缓存的值，不存在或已过期时返回 None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+# 问题文本 -> 嵌入向量
+question_embeddings = LRUCache(QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL)
+# (嵌入向量哈希, 关键词检索的问题文本, top_k, 问题类型, 检索参数, 检索范围, 存储版本) -> 检索结果
+retrieval_results = LRUCache(RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL)
+# 检索结果缓存对应的各集合版本，任一集合的版本变化时清空
+_retrieval_generations = {}
+_retrieval_generation_lock = threading.Lock()
+
+def normalize_question(question):
+    """统一全角/半角、大小写和空白，使写法略有不同的同一问题共享缓存"""
+    text = unicodedata.normalize("NFKC", question).casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+async def embed_questions(questions):
+    """
+    编码一组问题，缓存中已有的直接返回，其余合并编码后写入缓存
+
+    薄 worker 模式下由索引服务编码（与其他 worker 的请求一起合并）。
+
+    Returns:
+        与 questions 对应的向量列表
+    """
+    version = model_version()
+    keys = [(version, normalize_question(question)) for question in questions]
+    embeddings = [question_embeddings.get(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        new_embeddings = await (remote_index() or embedding_batcher).embed_many([questions[i] for i in missing])
+        for i, embedding in zip(missing, new_embeddings):
+            # 缓存的向量会被多个请求共享，复制出独立的只读数组
+            embedding = np.array(embedding)
+            embedding.flags.writeable = False
+            question_embeddings.put(keys[i], embedding)
+            embeddings[i] = embedding
+    return embeddings
+
+def search_questions(store, embeddings, top_k, question_type=None, nprobe=None, ef_search=None, texts=None,
+                     search_filter=None):
+    """
+    检索一组问题向量，命中缓存的问题不再查询索引
+
+    store 为本次查询涉及的集合（CollectionView）。
+    指定 texts（与 embeddings 对应的问题文本）时使用向量与关键词的混合检索；
+    指定 search_filter 时只在满足条件的文本块中检索。
+    缓存键包含存储的版本号，存储内容变化后旧结果不会再被使用。
+    缓存的结果由多个请求共享，调用方不应修改。
+
+    Returns:
+        与 embeddings 对应的检索结果列表
+    """
+    with _retrieval_generation_lock:
+        changed = False
+        for name, generation in store.generation:
+            changed |= _retrieval_generations.get(name, generation) != generation
+            _retrieval_generations[name] = generation
+        if changed:
+            # 集合已更新（或回到较早的版本），旧版本的结果不会再命中，直接释放
+            retrieval_results.clear()
+
+    keywords = [normalize_question(text) for text in texts] if texts is not None else [None] * len(embeddings)
+    filter_key = search_filter.key() if search_filter is not None else None
+    keys = [(hashlib.sha1(embedding.tobytes()).hexdigest(), keyword, top_k, question_type, nprobe, ef_search,
+             filter_key, store.generation)
+            for embedding, keyword in zip(embeddings, keywords)]
+    results = [retrieval_results.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        query_embeddings = np.asarray([embeddings[i] for i in missing])
+        if texts is not None:
+            new_results = store.hybrid_search_batch(query_embeddings, [texts[i] for i in missing], top_k=top_k,
+                                                    nprobe=nprobe, ef_search=ef_search, search_filter=search_filter)
+        else:
+            new_results = store.search_batch(query_embeddings, top_k=top_k, nprobe=nprobe, ef_search=ef_search,
+                                             search_filter=search_filter)
+        for i, result in zip(missing, new_results):
+            retrieval_results.put(keys[i], result)
+            results[i] = result
+    return results
+
+def cache_stats():
+    """返回各个查询缓存的统计信息"""
+    return {
+        "question_embeddings": question_embeddings.stats(),
+        "retrieval_results": retrieval_results.stats(),
+    }
@@ -1,89 +1,235 @@
 import os
-import requests
 import json
+import random
+import asyncio
 import logging
-from app.config import DEEPSEEK_API_KEY, DEEPSEEK_API_URL
+import httpx
+from collections.abc import Mapping
+from app.config import (DEEPSEEK_API_KEY, DEEPSEEK_API_URL, DEEPSEEK_TIMEOUT, DEEPSEEK_MAX_CONCURRENCY,
+                        DEEPSEEK_MAX_RETRIES, DEEPSEEK_BACKOFF_BASE)
+from app.answer_cache import answer_cache
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def generate_answer(question, retrieved_chunks, question_type=None):
-    try:
-        # 检查API密钥是否已设置
-        if not DEEPSEEK_API_KEY:
-            return "错误: DeepSeek API密钥未设置。请在终端使用以下命令设置密钥:\n\n```\nset DEEPSEEK_API_KEY=your_api_key\n```\n\n然后重启服务。"
-            
-        # 检查检索结果
-        if not retrieved_chunks:
-            logger.warning("未检索到相关内容")
-            return "抱歉，我在上传的文档中没有找到与您问题相关的内容。请尝试换一种方式提问，或上传包含相关信息的文件。"
+API_KEY_MISSING_MESSAGE = "错误: DeepSeek API密钥未设置。请在终端使用以下命令设置密钥:\n\n```\nset DEEPSEEK_API_KEY=your_api_key\n```\n\n然后重启服务。"
+NO_CONTEXT_MESSAGE = "抱歉，我在上传的文档中没有找到与您问题相关的内容。请尝试换一种方式提问，或上传包含相关信息的文件。"
+BAD_CONTEXT_MESSAGE = "抱歉，提取检索内容时出现问题。请稍后再试。"
+
+# 需要重试的状态码：限流和服务端错误
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class DeepSeekStatusError(Exception):
+    """DeepSeek 返回了非 200 状态码"""
+
+    def __init__(self, status_code, body=""):
+        super().__init__(f"DeepSeek返回 {status_code}: {body[:200]}")
+        self.status_code = status_code
+
+class DeepSeekClient:
+    """
+    异步 DeepSeek 客户端
+
+    所有请求共用一个保持连接的连接池，并发请求数受 max_concurrency 限制；
+    遇到 429/5xx 或网络错误时按带随机抖动的指数退避重试。
+    """
+
+    def __init__(self, api_url=DEEPSEEK_API_URL, api_key=DEEPSEEK_API_KEY, timeout=DEEPSEEK_TIMEOUT,
+                 max_concurrency=DEEPSEEK_MAX_CONCURRENCY, max_retries=DEEPSEEK_MAX_RETRIES,
+                 backoff_base=DEEPSEEK_BACKOFF_BASE):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._client = None
+        self._semaphore = None
+
+    def _get_client(self):
+        # 在事件循环中首次使用时创建
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+                headers={
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {self.api_key}"
+                },
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    def _backoff(self, attempt, response=None):
+        """计算第 attempt 次重试前的等待时间，优先遵循 Retry-After"""
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return float(retry_after)
+                except ValueError:
+                    pass
+        return self.backoff_base * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    async def chat(self, payload):
+        """
+        发送聊天补全请求
+
+        Returns:
+            httpx.Response（最后一次尝试的响应）
+
+        Raises:
+            httpx.TimeoutException / httpx.TransportError: 重试后仍然失败
+        """
+        client = self._get_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    response = await client.post(self.api_url, json=payload)
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"请求DeepSeek失败: {type(e).__name__}，{delay:.2f} 秒后重试")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                delay = self._backoff(attempt, response)
+                logger.warning(f"DeepSeek返回 {response.status_code}，{delay:.2f} 秒后重试")
+                await asyncio.sleep(delay)
+                continue
+            return response
+
+    async def stream_chat(self, payload):
+        """
+        流式聊天补全，逐个产出 DeepSeek 返回的文本片段
+
+        只在收到第一个片段之前重试，已经开始输出后出错直接抛出异常。
+
+        Raises:
+            DeepSeekStatusError: 返回了非 200 状态码
+            httpx.TimeoutException / httpx.TransportError: 重试后仍然失败
+        """
+        client = self._get_client()
+        for attempt in range(self.max_retries + 1):
+            started = False
+            retry_response = None
+            try:
+                async with self._semaphore:
+                    async with client.stream("POST", self.api_url, json=payload) as response:
+                        if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                            await response.aread()
+                            retry_response = response
+                        elif response.status_code != 200:
+                            body = (await response.aread()).decode("utf-8", errors="replace")
+                            raise DeepSeekStatusError(response.status_code, body)
+                        else:
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[len("data:"):].strip()
+                                if data == "[DONE]":
+                                    return
+                                delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                                if delta:
+                                    started = True
+                                    yield delta
+                            return
+            except (httpx.TimeoutException, httpx.TransportError) as e:
+                if started or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                logger.warning(f"请求DeepSeek失败: {type(e).__name__}，{delay:.2f} 秒后重试")
+                await asyncio.sleep(delay)
+                continue
+
+            delay = self._backoff(attempt, retry_response)
+            logger.warning(f"DeepSeek返回 {retry_response.status_code}，{delay:.2f} 秒后重试")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        """关闭连接池（应用退出时调用）"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+# 全局共享的客户端
+deepseek_client = DeepSeekClient()
+
+def build_prompt(question, retrieved_chunks, question_type=None):
+    """
+    根据检索结果构造提示词
+    
+    Returns:
+        提示词字符串；检索结果中没有可用内容时返回 None
+    """
+    # 自动判断是否为填空题形式
+    is_fill_blank = "_____" in question or "____" in question or "__" in question
+    
+    # 构造上下文和来源信息
+    contexts = []
+    sources = []
+    
+    for i, chunk in enumerate(retrieved_chunks):
+        # 处理不同格式的检索结果
+        if isinstance(chunk, Mapping) and 'content' in chunk:
+            content = chunk['content']
+            metadata = chunk.get('metadata', {})
+            score = chunk.get('score', None)  # 获取相似度分数
+        elif isinstance(chunk, str):
+            content = chunk
+            metadata = {}
+            score = None
+        else:
+            logger.warning(f"跳过无效格式的检索结果: {type(chunk)}")
+            continue
         
-        logger.info(f"检索到{len(retrieved_chunks)}个文本块")
+        # 提取源文件信息
+        source_type = metadata.get('source_type', '')
+        file_name = metadata.get('file_name', '未知文件')
         
-        # 自动判断是否为填空题形式
-        is_fill_blank = "_____" in question or "____" in question or "__" in question
-        
-        # 构造上下文和来源信息
-        contexts = []
-        sources = []
-        
-        for i, chunk in enumerate(retrieved_chunks):
-            # 处理不同格式的检索结果
-            if isinstance(chunk, dict) and 'content' in chunk:
-                content = chunk['content']
-                metadata = chunk.get('metadata', {})
-                score = chunk.get('score', None)  # 获取相似度分数
-            elif isinstance(chunk, str):
-                content = chunk
-                metadata = {}
-                score = None
-            else:
-                logger.warning(f"跳过无效格式的检索结果: {type(chunk)}")
-                continue
-            
-            # 提取源文件信息
-            source_type = metadata.get('source_type', '')
-            file_name = metadata.get('file_name', '未知文件')
+        if not source_type and file_name:
+            ext = os.path.splitext(file_name)[1].lower()
+            source_type = 'pdf' if ext == '.pdf' else 'ppt'
             
-            if not source_type and file_name:
-                ext = os.path.splitext(file_name)[1].lower()
-                source_type = 'pdf' if ext == '.pdf' else 'ppt'
-                
-            # 获取页码/幻灯片编号
-            if source_type == 'pdf':
-                page_num = metadata.get('page_num', i+1)
-                reference_id = f"[{file_name}第{page_num}页]"
-            else:
-                slide_num = metadata.get('slide_num', i+1)
-                reference_id = f"[{file_name}第{slide_num}页]"
-            
-            # 添加到上下文，包含相似度分数（如果有）
-            if score is not None:
-                score_info = f"(相关度: {score:.2f})"
-                context_entry = f"{reference_id} {score_info}\n{content}"
-            else:
-                context_entry = f"{reference_id}\n{content}"
-                
-            contexts.append(context_entry)
+        # 获取页码/幻灯片编号
+        if source_type == 'pdf':
+            page_num = metadata.get('page_num', i+1)
+            reference_id = f"[{file_name}第{page_num}页]"
+        else:
+            slide_num = metadata.get('slide_num', i+1)
+            reference_id = f"[{file_name}第{slide_num}页]"
+        
+        # 添加到上下文，包含相似度分数（如果有）
+        if score is not None:
+            score_info = f"(相关度: {score:.2f})"
+            context_entry = f"{reference_id} {score_info}\n{content}"
+        else:
+            context_entry = f"{reference_id}\n{content}"
             
-            # 构造来源信息（简化格式：文件名+页码）
-            if source_type == 'pdf':
-                source_info = f"{reference_id}: PDF文件 \"{file_name}\" 第{page_num}页"
-            else:
-                source_info = f"{reference_id}: PPT文件 \"{file_name}\" 第{slide_num}页"
-                
-            sources.append(source_info)
-        
-        if not contexts:
-            return "抱歉，提取检索内容时出现问题。请稍后再试。"
+        contexts.append(context_entry)
+        
+        # 构造来源信息（简化格式：文件名+页码）
+        if source_type == 'pdf':
+            source_info = f"{reference_id}: PDF文件 \"{file_name}\" 第{page_num}页"
+        else:
+            source_info = f"{reference_id}: PPT文件 \"{file_name}\" 第{slide_num}页"
             
-        context_text = "\n\n".join(contexts)
-        sources_text = "\n".join(sources)
+        sources.append(source_info)
+    
+    if not contexts:
+        return None
         
-        # 构造针对不同类型问题的提示词
-        if is_fill_blank:
-            prompt = f"""你是专业的问答助手，需要根据提供的文档内容，回答用户的填空题问题。
+    context_text = "\n\n".join(contexts)
+    sources_text = "\n".join(sources)
+    
+    # 构造针对不同类型问题的提示词
+    if is_fill_blank:
+        prompt = f"""你是专业的问答助手，需要根据提供的文档内容，回答用户的填空题问题。
 
 请严格遵循以下规则：
 1. 填空题必须使用文档中的原文作为答案，不能编造或推测
@@ -101,8 +247,8 @@ def generate_answer(question, retrieved_chunks, question_type=None):
 填空题问题：{question}
 
 请填写答案并标注来源："""
-        elif question_type == "strict":
-            prompt = f"""你是严格匹配型问答助手。你需要根据文档内容，准确找到与问题关键词完全匹配的内容。
+    elif question_type == "strict":
+        prompt = f"""你是严格匹配型问答助手。你需要根据文档内容，准确找到与问题关键词完全匹配的内容。
 
 严格遵循以下规则：
 1. 只使用与问题关键词严格匹配的文档段落回答
@@ -120,8 +266,8 @@ def generate_answer(question, retrieved_chunks, question_type=None):
 用户问题：{question}
 
 请提供严格匹配的回答："""
-        else:  # 默认语义匹配
-            prompt = f"""你是语义匹配型问答助手。你需要理解问题的实际含义，找出语义相关的文档内容回答。
+    else:  # 默认语义匹配
+        prompt = f"""你是语义匹配型问答助手。你需要理解问题的实际含义，找出语义相关的文档内容回答。
 
 请严格遵循以下规则：
 1. 理解问题的真正意图，寻找语义相关的内容，不仅限于关键词匹配
@@ -141,23 +287,49 @@ def generate_answer(question, retrieved_chunks, question_type=None):
 
 请提供语义匹配的回答："""
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}"
-        }
-        
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": "你是一个专业、准确的文档问答助手。你只基于给定的文档内容回答问题，并总是标注信息来源。"},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.1,  # 降低温度，增加确定性
-            "max_tokens": 800
-        }
+    return prompt
+
+def build_payload(prompt, stream=False):
+    """构造 DeepSeek 聊天补全请求体"""
+    payload = {
+        "model": "deepseek-chat",
+        "messages": [
+            {"role": "system", "content": "你是一个专业、准确的文档问答助手。你只基于给定的文档内容回答问题，并总是标注信息来源。"},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.1,  # 降低温度，增加确定性
+        "max_tokens": 800
+    }
+    if stream:
+        payload["stream"] = True
+    return payload
+
+async def generate_answer(question, retrieved_chunks, question_type=None, question_embedding=None):
+    """生成回答；传入问题的嵌入向量时先查语义回答缓存，成功生成的回答写入缓存"""
+    try:
+        # 检查API密钥是否已设置
+        if not DEEPSEEK_API_KEY:
+            return API_KEY_MISSING_MESSAGE
+            
+        # 检查检索结果
+        if not retrieved_chunks:
+            logger.warning("未检索到相关内容")
+            return NO_CONTEXT_MESSAGE
+            
+        # 相似的问题检索到相同内容时直接复用以往的回答
+        chunk_ids = answer_cache.chunk_key(retrieved_chunks)
+        cached = answer_cache.lookup(question_embedding, chunk_ids, question_type)
+        if cached is not None:
+            return cached
+        
+        logger.info(f"检索到{len(retrieved_chunks)}个文本块")
+        
+        prompt = build_prompt(question, retrieved_chunks, question_type)
+        if prompt is None:
+            return BAD_CONTEXT_MESSAGE
         
         logger.info("发送API请求到Deepseek")
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=30)
+        response = await deepseek_client.chat(build_payload(prompt))
         
         if response.status_code != 200:
             logger.error(f"API返回错误: {response.status_code}, {response.text[:200]}")
@@ -166,12 +338,14 @@ def generate_answer(question, retrieved_chunks, question_type=None):
         result = response.json()
         logger.info("成功获取API响应")
         
-        return result["choices"][0]["message"]["content"]
+        answer = result["choices"][0]["message"]["content"]
+        answer_cache.store(question_embedding, chunk_ids, question_type, answer)
+        return answer
         
-    except requests.exceptions.Timeout:
+    except httpx.TimeoutException:
         logger.error("API请求超时")
         return "抱歉，AI响应超时。请稍后再试。"
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         logger.error(f"请求错误: {str(e)}")
         return "抱歉，连接AI服务时出现网络问题。请检查您的网络连接。"
     except KeyError as e:
@@ -180,3 +354,46 @@ def generate_answer(question, retrieved_chunks, question_type=None):
     except Exception as e:
         logger.error(f"未预期的错误: {str(e)}", exc_info=True)
         return "抱歉，处理您的问题时出现错误。请稍后再试。"
+
+async def stream_answer(question, retrieved_chunks, question_type=None, question_embedding=None):
+    """流式生成回答，逐段产出文本；出错时产出错误提示而不是抛出异常。语义回答缓存的用法与 generate_answer 相同"""
+    if not DEEPSEEK_API_KEY:
+        yield API_KEY_MISSING_MESSAGE
+        return
+        
+    if not retrieved_chunks:
+        logger.warning("未检索到相关内容")
+        yield NO_CONTEXT_MESSAGE
+        return
+        
+    chunk_ids = answer_cache.chunk_key(retrieved_chunks)
+    cached = answer_cache.lookup(question_embedding, chunk_ids, question_type)
+    if cached is not None:
+        yield cached
+        return
+        
+    prompt = build_prompt(question, retrieved_chunks, question_type)
+    if prompt is None:
+        yield BAD_CONTEXT_MESSAGE
+        return
+        
+    try:
+        logger.info("发送流式API请求到Deepseek")
+        pieces = []
+        async for piece in deepseek_client.stream_chat(build_payload(prompt, stream=True)):
+            pieces.append(piece)
+            yield piece
+        # 只缓存完整生成的回答（客户端中途断开时不会执行到这里）
+        answer_cache.store(question_embedding, chunk_ids, question_type, "".join(pieces))
+    except DeepSeekStatusError as e:
+        logger.error(f"API返回错误: {str(e)}")
+        yield f"调用AI服务时出错，状态码: {e.status_code}"
+    except httpx.TimeoutException:
+        logger.error("API请求超时")
+        yield "抱歉，AI响应超时。请稍后再试。"
+    except httpx.HTTPError as e:
+        logger.error(f"请求错误: {str(e)}")
+        yield "抱歉，连接AI服务时出现网络问题。请检查您的网络连接。"
+    except (KeyError, ValueError) as e:
+        logger.error(f"解析API流式响应时出错: {str(e)}")
+        yield "抱歉，处理AI响应时出现错误。"
@@ -1,15 +1,25 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from app.pdf_loader import extract_text_with_chunking  # 新增PDF处理
-from app.embedder import embed_texts
-from app.vector_store import VectorStore
-from app.rag_engine import generate_answer
-from app.config import VECTOR_DIM, PDF_STORAGE_PATH, INDEX_PATH, META_PATH  # 添加索引和元数据路径
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+from app.pdf_loader import extract_text_from_pdf  # 新增PDF处理
+from app.embedder import model_info
+from app.query_cache import embed_questions, search_questions, cache_stats
+from app.vector_store import CollectionManager, SearchFilter
+from app.ingest import ingest_file, remove_file, rebuild_index as rebuild_pdf_index
+from app.jobs import JobManager
+from app.rag_engine import generate_answer, stream_answer
+from app.answer_cache import answer_cache
+from app.index_client import remote_index
+from app.config import VECTOR_DIM, PDF_STORAGE_PATH, INDEX_PATH, DEFAULT_COLLECTION  # 添加索引路径
+from app.config import ASK_BATCH_MAX_QUESTIONS, ASK_BATCH_CONCURRENCY, JOBS_DIR, JOBS_MAX_FINISHED, INGEST_THREADS, INGEST_PROCESSES
 import os
+import json
+import asyncio
 import logging
-import requests
 import numpy as np
-import shutil
-from typing import List, Dict, Any, Optional
+from datetime import datetime, timedelta
+from typing import List, Optional
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -18,23 +28,56 @@ logger = logging.getLogger(__name__)
 # 创建路由
 router = APIRouter()
 
-# 创建向量存储
-vs = VectorStore(dim=VECTOR_DIM)
+# 命名集合，每个集合是独立的常驻向量存储，首次访问时加载
+collection_manager = CollectionManager(dim=VECTOR_DIM)
+
+# 默认集合，由 main.py 中的 lifespan 在启动时加载
+store_manager = collection_manager.get(DEFAULT_COLLECTION)
+
+# 文档入库等耗时操作的后台任务
+job_manager = JobManager(JOBS_DIR, threads=INGEST_THREADS, processes=INGEST_PROCESSES, max_finished=JOBS_MAX_FINISHED)
 
 # 确保PDF存储路径存在
 os.makedirs(PDF_STORAGE_PATH, exist_ok=True)
 os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
 
+def _collection(name, create=False):
+    """
+    按名称取集合的常驻存储；名称不合法返回 400，集合不存在时返回 404
+
+    只有上传（create 为 True）会创建集合，只读的请求不会因为请求中的集合名而登记新的集合。
+    """
+    if not create and not collection_manager.exists(name):
+        raise HTTPException(status_code=404, detail=f"集合不存在: {name}")
+    try:
+        return collection_manager.get(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _collection_view(names):
+    """本次查询涉及的集合，未指定时使用默认集合；薄 worker 模式下为索引服务上的集合"""
+    if remote_index() is not None:
+        return remote_index().view(names)
+    return _resident_view(names)
+
+def _resident_view(names):
+    """本进程中常驻的集合（单进程模式和索引服务）"""
+    for name in names or []:
+        _collection(name)
+    return collection_manager.view(names)
+
 @router.post("/upload")
-async def upload_pdf(file: UploadFile = File(...)):
-    """上传并处理PDF文件"""
+async def upload_pdf(file: UploadFile = File(...), collection: str = Form(DEFAULT_COLLECTION)):
+    """上传并处理PDF文件，collection 指定存入的集合（不存在时自动创建）"""
     try:
         # 检查文件类型
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="只接受PDF文件格式")
             
         # 保存文件
-        file_path = os.path.join(PDF_STORAGE_PATH, file.filename)
+        store = _collection(collection, create=True)
+        store.paths.makedirs()
+        file_path = os.path.join(store.paths.pdf_dir, file.filename)
         file_exists = os.path.exists(file_path)
         
         with open(file_path, "wb") as f:
@@ -44,54 +87,18 @@ async def upload_pdf(file: UploadFile = File(...)):
         # 根据文件是否存在返回不同消息
         operation = "更新" if file_exists else "上传"
         logger.info(f"成功保存PDF文件: {file.filename}")
-            
-        # 处理文件内容
-        try:
-            # 提取文本
-            chunks = extract_text_with_chunking(file_path)
-            
-            if not chunks:
-                logger.warning(f"从PDF中没有提取到文本内容: {file.filename}")
-                return {
-                    "message": f"文件已{operation}，但未能提取到内容", 
-                    "file": file.filename
-                }
-                
-            logger.info(f"从PDF中提取了 {len(chunks)} 个文本块")
-                
-            # 生成嵌入向量
-            embeddings = embed_texts([chunk["content"] for chunk in chunks])
-            
-            # 如果文件已存在，需要更新索引
-            vs.load()
-            if file_exists:
-                # 过滤掉与当前文件相关的内容
-                if vs.text_chunks:
-                    vs.text_chunks = [chunk for chunk in vs.text_chunks 
-                                     if not (isinstance(chunk, dict) and 
-                                            chunk.get('metadata', {}).get('file_name') == file.filename)]
-                    
-                # 重建索引
-                vs.index = None
-                vs.load()  # 创建新索引
-            
-            # 添加新的索引
-            vs.add(embeddings, chunks)
-            vs.save()
-            
-            return {
-                "message": f"成功{operation}并索引PDF文件", 
-                "file": file.filename,
-                "chunks": len(chunks)
-            }
-            
-        except Exception as e:
-            logger.error(f"处理PDF内容时出错: {str(e)}", exc_info=True)
-            return {
-                "message": f"文件已{operation}，但处理内容失败", 
-                "file": file.filename,
-                "error": str(e)
-            }
+        
+        # 解析和嵌入在后台执行，不阻塞其他请求
+        job = job_manager.submit("upload", ingest_file, store, file_path, job_manager.process_pool,
+                                 detail={"file": file.filename, "operation": operation, "collection": collection})
+        
+        return JSONResponse(status_code=202, content={
+            "message": f"文件已{operation}，正在后台建立索引",
+            "file": file.filename,
+            "collection": collection,
+            "job_id": job["id"],
+            "status": job["status"]
+        })
             
     except HTTPException:
         raise
@@ -100,15 +107,16 @@ async def upload_pdf(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"上传文件失败: {str(e)}")
 
 @router.get("/list-files")
-async def list_files():
-    """获取所有已上传的PDF文件"""
+async def list_files(collection: str = DEFAULT_COLLECTION):
+    """获取集合中所有已上传的PDF文件"""
     try:
         files = []
+        pdf_dir = _collection(collection).paths.pdf_dir
         
-        if os.path.exists(PDF_STORAGE_PATH):
-            for filename in os.listdir(PDF_STORAGE_PATH):
+        if os.path.exists(pdf_dir):
+            for filename in os.listdir(pdf_dir):
                 if filename.endswith('.pdf'):
-                    file_path = os.path.join(PDF_STORAGE_PATH, filename)
+                    file_path = os.path.join(pdf_dir, filename)
                     file_stats = os.stat(file_path)
                     
                     files.append({
@@ -119,47 +127,37 @@ async def list_files():
                     })
                     
         return files
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"获取文件列表失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"获取文件列表失败: {str(e)}")
 
 @router.delete("/files/{filename}")
-async def delete_file(filename: str):
-    """删除指定的PDF文件"""
+async def delete_file(filename: str, collection: str = DEFAULT_COLLECTION):
+    """删除集合中指定的PDF文件"""
     try:
         if not filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="只能删除PDF文件")
             
-        file_path = os.path.join(PDF_STORAGE_PATH, filename)
+        resident = _collection(collection)
+        file_path = os.path.join(resident.paths.pdf_dir, filename)
         
         # 检查文件是否存在
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail=f"文件不存在: {filename}")
             
+        # 尚未开始的入库任务不再执行；正在进行的任务在下次写入时发现文件已删除，自行停止
+        for job in job_manager.unfinished("upload", file=filename, collection=collection):
+            job_manager.cancel(job["id"], f"文件 {filename} 已被删除")
+            
         # 删除文件
         os.remove(file_path)
         logger.info(f"已删除PDF文件: {filename}")
         
-        # 更新索引（移除相关内容）
-        vs.load()
-        if vs.text_chunks:
-            original_count = len(vs.text_chunks)
-            vs.text_chunks = [chunk for chunk in vs.text_chunks 
-                             if not (isinstance(chunk, dict) and 
-                                    chunk.get('metadata', {}).get('file_name') == filename)]
-                                    
-            if len(vs.text_chunks) < original_count:
-                # 有内容被移除，需要重建索引
-                vs.index = None
-                vs.load()  # 创建新索引
-                
-                # 重新添加其他文档的内容
-                if vs.text_chunks:
-                    embeddings = embed_texts([chunk["content"] for chunk in vs.text_chunks])
-                    vs.add(embeddings, vs.text_chunks)
-                
-                vs.save()
-                logger.info(f"已从索引中移除文件相关内容: {filename}")
+        # 更新索引（移除相关内容、文档清单条目和入库检查点）；等待写锁时不阻塞事件循环
+        if await run_in_threadpool(remove_file, resident, filename) > 0:
+            logger.info(f"已从集合 {collection} 的索引中移除文件相关内容: {filename}")
         
         return {"message": f"成功删除文件及其索引: {filename}"}
         
@@ -170,70 +168,92 @@ async def delete_file(filename: str):
         raise HTTPException(status_code=500, detail=f"删除文件失败: {str(e)}")
 
 @router.post("/rebuild-index")
-async def rebuild_index():
-    """重新构建所有PDF文件的索引"""
+async def rebuild_index(force: bool = False, collection: str = DEFAULT_COLLECTION):
+    """重新构建集合中所有PDF文件的索引（只处理新增或变化的文件，force=true 时全部重新入库），不影响其他集合"""
     try:
+        resident = _collection(collection)
+        pdf_dir = resident.paths.pdf_dir
+        
         # 检查文件夹是否存在
-        if not os.path.exists(PDF_STORAGE_PATH):
+        if not os.path.exists(pdf_dir):
             return {"message": "没有PDF文件夹，无需重建索引"}
         
         # 获取所有PDF文件
-        pdf_files = [f for f in os.listdir(PDF_STORAGE_PATH) if f.endswith('.pdf')]
+        pdf_files = [f for f in os.listdir(pdf_dir) if f.endswith('.pdf')]
         
         if not pdf_files:
             return {"message": "没有找到PDF文件，无需重建索引"}
         
-        # 清空现有索引
-        vs.index = None
-        vs.text_chunks = []
-        
-        # 创建新索引
-        vs.load()
-        
-        total_chunks = 0
-        processed_files = []
-        
-        # 处理每个PDF文件
-        for filename in pdf_files:
-            try:
-                file_path = os.path.join(PDF_STORAGE_PATH, filename)
-                
-                # 提取文本
-                chunks = extract_text_with_chunking(file_path)
-                if chunks:
-                    # 生成嵌入
-                    embeddings = embed_texts([chunk["content"] for chunk in chunks])
-                    
-                    # 添加到索引
-                    vs.add(embeddings, chunks)
-                    
-                    total_chunks += len(chunks)
-                    processed_files.append({
-                        "name": filename,
-                        "chunks": len(chunks)
-                    })
-                    
-                    logger.info(f"已处理文件 {filename}，提取了 {len(chunks)} 个文本块")
-            except Exception as e:
-                logger.error(f"处理文件 {filename} 时出错: {str(e)}", exc_info=True)
-        
-        # 保存索引
-        if total_chunks > 0:
-            vs.save()
+        job = job_manager.submit("rebuild", rebuild_pdf_index, resident, job_manager.process_pool, force,
+                                 detail={"files": len(pdf_files), "force": force, "collection": collection})
             
-        return {
-            "message": f"索引重建完成，处理了 {len(processed_files)} 个PDF文件，共 {total_chunks} 个文本块",
-            "processed_files": processed_files
-        }
+        return JSONResponse(status_code=202, content={
+            "message": f"正在后台重建索引，共 {len(pdf_files)} 个PDF文件",
+            "collection": collection,
+            "job_id": job["id"],
+            "status": job["status"]
+        })
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"重建索引失败: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"重建索引失败: {str(e)}")
 
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查询后台任务状态"""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"任务不存在: {job_id}")
+    return job
+
+def _parse_upload_time(value, end_of_day=False):
+    """解析 ISO 格式的日期或时间，返回时间戳；只有日期且 end_of_day 为 True 时取当天结束时刻"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"无法识别的日期格式: {value}，请使用 ISO 格式，例如 2024-05-01")
+    if end_of_day and len(value) == 10:
+        parsed += timedelta(days=1, microseconds=-1)
+    return parsed.timestamp()
+
+def _search_filter(file_names=None, page_min=None, page_max=None, uploaded_after=None, uploaded_before=None):
+    """根据请求参数生成检索范围，没有任何条件时返回 None"""
+    search_filter = SearchFilter(file_names=file_names or None, min_page=page_min, max_page=page_max,
+                                 uploaded_after=_parse_upload_time(uploaded_after),
+                                 uploaded_before=_parse_upload_time(uploaded_before, end_of_day=True))
+    return None if search_filter.is_empty() else search_filter
+
+def _retrieve(view, embeddings, question_type, nprobe, ef_search, texts, search_filter):
+    """
+    检索一组问题并清理语义回答缓存中失效的条目
+
+    跨集合检索和索引服务的请求都会阻塞，在线程池中调用。
+    """
+    results = search_questions(view, embeddings, 5, question_type, nprobe, ef_search, texts, search_filter)
+    answer_cache.evict_stale(view)
+    return results
+
 @router.post("/ask")
-async def ask_question(question: str = Form(...), question_type: Optional[str] = Form(None)):
-    """处理用户问题并生成回答"""
+async def ask_question(question: str = Form(...), question_type: Optional[str] = Form(None),
+                       nprobe: Optional[int] = Form(None), ef_search: Optional[int] = Form(None),
+                       stream: bool = Form(False), file_names: Optional[List[str]] = Form(None),
+                       page_min: Optional[int] = Form(None), page_max: Optional[int] = Form(None),
+                       uploaded_after: Optional[str] = Form(None), uploaded_before: Optional[str] = Form(None),
+                       collections: Optional[List[str]] = Form(None)):
+    """
+    处理用户问题并生成回答；stream 为 true 时以 Server-Sent Events 逐段返回
+
+    file_names（可重复）、page_min / page_max、uploaded_after / uploaded_before 限定检索范围；
+    collections（可重复）指定检索的集合，默认为默认集合，多个集合并行检索后合并结果。
+    """
     if not question.strip():
         raise HTTPException(status_code=400, detail="问题不能为空")
+    search_filter = _search_filter(file_names, page_min, page_max, uploaded_after, uploaded_before)
+    # 首次检索的集合需要从磁盘加载，在线程池中进行
+    view = await run_in_threadpool(_collection_view, collections)
         
     try:
         logger.info(f"收到问题: {question}, 类型: {question_type or '未指定'}")
@@ -247,22 +267,17 @@ async def ask_question(question: str = Form(...), question_type: Optional[str] =
             logger.info("检测到填空题格式")
         
         # 检查向量存储是否有数据
-        vs.load()
-        if vs.index is None or vs.index.ntotal == 0:
+        if view.is_empty():
             return {"answer": "请先上传PDF文件，然后再提问。"}
             
-        # 生成问题的嵌入向量
+        # 生成问题的嵌入向量（重复的问题直接使用缓存，其余与同时到达的问题合并编码）
         try:
-            q_embedding = embed_texts([question])
+            q_embedding = (await embed_questions([question]))[0]
             
             # 正确地检查嵌入向量
-            if q_embedding is None or not isinstance(q_embedding, (list, np.ndarray)) or (isinstance(q_embedding, (list, np.ndarray)) and len(q_embedding) == 0):
+            if q_embedding is None or not isinstance(q_embedding, np.ndarray) or len(q_embedding) == 0:
                 raise ValueError("无法生成问题的嵌入向量")
                 
-            # 确保我们得到第一个向量
-            if isinstance(q_embedding, list):
-                q_embedding = q_embedding[0]
-                
             logger.info(f"成功生成问题嵌入向量，形状: {q_embedding.shape if hasattr(q_embedding, 'shape') else '未知'}")
                 
         except Exception as e:
@@ -271,17 +286,25 @@ async def ask_question(question: str = Form(...), question_type: Optional[str] =
         
         # 检索相关内容
         try:
-            # 对于严格匹配，增加检索数量
-            top_k = 10 if question_type == "strict" else 5
-            relevant = vs.search(q_embedding, top_k=top_k)
+            # 严格匹配同时使用关键词检索，精确匹配的型号、术语不会被向量检索漏掉
+            texts = [question] if question_type == "strict" else None
+            relevant = (await run_in_threadpool(_retrieve, view, [q_embedding], question_type, nprobe, ef_search,
+                                                texts, search_filter))[0]
             logger.info(f"检索到 {len(relevant)} 个相关片段")
         except Exception as e:
             logger.error(f"检索失败: {str(e)}", exc_info=True)
             return {"answer": "检索PDF内容时出现错误。请稍后再试。"}
         
+        if stream:
+            return StreamingResponse(
+                _stream_answer_events(view, question, relevant, question_type, q_embedding),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        
         # 生成回答
         try:
-            answer = generate_answer(question, relevant, question_type)
+            answer = await generate_answer(question, relevant, question_type, q_embedding)
             return {"answer": answer}
         except Exception as e:
             logger.error(f"生成回答失败: {str(e)}", exc_info=True)
@@ -291,19 +314,93 @@ async def ask_question(question: str = Form(...), question_type: Optional[str] =
         logger.error(f"处理问题失败: {str(e)}", exc_info=True)
         return {"answer": "处理您的问题时出现错误。请稍后再试。"}
 
+def _sse_event(event, data):
+    """格式化一条 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def _stream_answer_events(store, question, relevant, question_type, q_embedding=None):
+    """先发送检索到的来源，再逐段转发回答，最后发送结束事件"""
+    yield _sse_event("sources", {"sources": store.get_sources_from_texts(relevant)})
+    try:
+        async for piece in stream_answer(question, relevant, question_type, q_embedding):
+            yield _sse_event("token", {"content": piece})
+    except Exception as e:
+        logger.error(f"流式生成回答失败: {str(e)}", exc_info=True)
+        yield _sse_event("error", {"message": "生成回答时出现错误。请稍后再试。"})
+    yield _sse_event("done", {})
+
+class BatchAskRequest(BaseModel):
+    questions: List[str]
+    question_type: Optional[str] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    # 检索范围，对所有问题生效
+    file_names: Optional[List[str]] = None
+    page_min: Optional[int] = None
+    page_max: Optional[int] = None
+    uploaded_after: Optional[str] = None
+    uploaded_before: Optional[str] = None
+    # 检索的集合，默认为默认集合
+    collections: Optional[List[str]] = None
+
+@router.post("/ask/batch")
+async def ask_batch(request: BatchAskRequest):
+    """批量回答问题：一次嵌入、一次矩阵检索，回答生成按有限并发执行"""
+    questions = [q.strip() for q in request.questions]
+    if not questions or not all(questions):
+        raise HTTPException(status_code=400, detail="问题列表不能为空，且不能包含空问题")
+    if len(questions) > ASK_BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"单次最多提交 {ASK_BATCH_MAX_QUESTIONS} 个问题")
+        
+    search_filter = _search_filter(request.file_names, request.page_min, request.page_max,
+                                   request.uploaded_after, request.uploaded_before)
+    view = await run_in_threadpool(_collection_view, request.collections)
+    question_type = request.question_type
+    if question_type not in (None, "strict", "semantic"):
+        question_type = None  # 默认为语义匹配
+        
+    logger.info(f"收到批量问题 {len(questions)} 个, 类型: {question_type or '未指定'}")
+    
+    if view.is_empty():
+        return {"results": [{"question": q, "answer": "请先上传PDF文件，然后再提问。"} for q in questions]}
+        
+    try:
+        # 所有问题一次编码、一次检索
+        q_embeddings = await embed_questions(questions)
+        texts = questions if question_type == "strict" else None
+        relevant_lists = await run_in_threadpool(_retrieve, view, q_embeddings, question_type,
+                                                 request.nprobe, request.ef_search, texts, search_filter)
+    except Exception as e:
+        logger.error(f"批量检索失败: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"批量检索失败: {str(e)}")
+        
+    semaphore = asyncio.Semaphore(ASK_BATCH_CONCURRENCY)
+    
+    async def answer_one(question, relevant, q_embedding):
+        async with semaphore:
+            try:
+                return await generate_answer(question, relevant, question_type, q_embedding)
+            except Exception as e:
+                logger.error(f"生成回答失败: {str(e)}", exc_info=True)
+                return "生成回答时出现错误。请稍后再试。"
+                
+    answers = await asyncio.gather(*(answer_one(q, relevant, q_embedding)
+                                     for q, relevant, q_embedding in zip(questions, relevant_lists, q_embeddings)))
+    return {"results": [{"question": q, "answer": a} for q, a in zip(questions, answers)]}
+
 @router.get("/preview/{filename}")
-async def preview_file(filename: str):
+async def preview_file(filename: str, collection: str = DEFAULT_COLLECTION):
     """获取PDF文件内容预览"""
     try:
         if not filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="只能预览PDF文件")
             
-        file_path = os.path.join(PDF_STORAGE_PATH, filename)
+        file_path = os.path.join(_collection(collection).paths.pdf_dir, filename)
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="文件不存在")
             
-        # 提取内容预览
-        chunks = extract_text_with_chunking(file_path)
+        # 提取内容预览（在线程池中解析，不阻塞事件循环）
+        chunks = await run_in_threadpool(extract_text_from_pdf, file_path)
         preview = [chunk["content"][:200] + "..." for chunk in chunks[:5]]
         
         return {
@@ -311,25 +408,70 @@ async def preview_file(filename: str):
             "total_pages": len(chunks),
             "preview": preview
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取预览失败: {str(e)}")
 
+@router.get("/collections")
+async def list_collections():
+    """列出全部集合及其是否已加载、文本块数（未加载的集合不会因此被加载）"""
+    result = []
+    for name in collection_manager.names():
+        resident = collection_manager.get(name)
+        info = {"name": name, "loaded": resident.loaded}
+        if resident.loaded:
+            store = resident.current()
+            info["chunks_count"] = len(store.text_chunks)
+            info["files_count"] = len(store.manifest)
+            info["load_error"] = store.load_error
+        result.append(info)
+    return result
+
+@router.post("/collections/{name}/load")
+async def load_collection(name: str):
+    """加载（或重新加载）集合到内存"""
+    resident = _collection(name)
+    await run_in_threadpool(resident.load)
+    store = resident.current()
+    if store.load_error is not None:
+        raise HTTPException(status_code=500, detail=f"集合 {name} 加载失败: {store.load_error}")
+    return {"message": f"集合 {name} 已加载", "chunks_count": len(store.text_chunks)}
+
+@router.post("/collections/{name}/evict")
+async def evict_collection(name: str):
+    """从内存中卸载集合，下次检索该集合时再加载"""
+    _collection(name)
+    if not collection_manager.evict(name):
+        return {"message": f"集合 {name} 未加载"}
+    return {"message": f"集合 {name} 已卸载"}
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """返回查询缓存和语义回答缓存的命中统计"""
+    return {**cache_stats(), "answers": answer_cache.stats()}
+
 @router.get("/debug/status")
 async def debug_status():
     """返回系统状态信息，用于调试"""
     try:
-        vs.load()
+        store = store_manager.current()
         return {
             "pdf_path": PDF_STORAGE_PATH,
             "pdf_exists": os.path.exists(PDF_STORAGE_PATH),
             "pdf_files": [f for f in os.listdir(PDF_STORAGE_PATH) if f.endswith('.pdf')] if os.path.exists(PDF_STORAGE_PATH) else [],
-            "index_path": INDEX_PATH,
-            "index_exists": os.path.exists(INDEX_PATH),
-            "meta_path": META_PATH,
-            "meta_exists": os.path.exists(META_PATH),
-            "has_index": vs.index is not None,
-            "index_size": vs.index.ntotal if vs.index is not None else 0,
-            "chunks_count": len(vs.text_chunks) if vs.text_chunks else 0
+            "index_path": store_manager.paths.snapshot_path,
+            "index_exists": os.path.exists(store_manager.paths.snapshot_path),
+            "snapshot_generation": store.snapshot_generation,
+            "wal_seq": store.wal_seq,
+            "wal_bytes": store_manager.wal.size(),
+            "load_error": store.load_error,
+            "has_index": store.index is not None,
+            "index_size": store.ntotal,
+            "index_type": store.describe_index(),
+            "chunks_count": len(store.text_chunks) if store.text_chunks else 0,
+            "collections": collection_manager.names(),
+            "embedding_model": model_info()
         }
     except Exception as e:
         return {"error": str(e)}
@@ -1,24 +1,364 @@
 import faiss
+import heapq
+import itertools
+import json
 import numpy as np
 import os
 import pickle
 import logging
-from app.config import INDEX_PATH, META_PATH
+import re
+import threading
+import uuid
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from app.config import (INDEX_PATH, META_PATH, CHUNK_STORE_PATH, MANIFEST_PATH, KEYWORD_INDEX_PATH, INDEX_FACTORY,
+                        INDEX_TRAIN_SIZE, INDEX_TRAIN_SAMPLE, INDEX_NPROBE, INDEX_EF_SEARCH, INDEX_DELTA_MAX,
+                        VECTOR_METRIC, SIMILARITY_THRESHOLD, HYBRID_RRF_K, HYBRID_KEYWORD_MIN_IDF,
+                        SEARCH_FILTER_EXACT_MAX, PDF_STORAGE_PATH, INGEST_CHECKPOINT_PATH, DEFAULT_COLLECTION,
+                        COLLECTIONS_DIR, COLLECTION_PDF_DIR, SEARCH_THREADS, SNAPSHOT_PATH, WAL_PATH, WAL_COMPACT_BYTES, WRITE_LOCK_PATH,
+                        EMBEDDING_CACHE_PATH)
+from app.chunk_store import ChunkStore
+from app.keyword_index import KeywordIndex
+from app.wal import FileLock, WriteAheadLog, fsync_path
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 存储内容的版本号，每次修改都取一个新值（进程内唯一），用作检索结果缓存键的一部分
+_generations = itertools.count(1)
+
+class SearchHit(Mapping):
+    """
+    检索命中的文本块
+
+    只保存 chunk_id、相似度和文本块内容，元数据以只读视图提供，不复制文本块。
+    支持 hit["content"]、hit.get("metadata") 等只读的字典式访问，与原有的结果格式兼容。
+    collection 为文本块所属的集合，不同集合的 chunk_id 可能相同。
+    """
+
+    __slots__ = ('chunk_id', 'score', 'content', 'metadata', 'collection')
+    _KEYS = ('content', 'metadata', 'score', 'chunk_id', 'collection')
+
+    def __init__(self, chunk_id, score, content, metadata, collection=DEFAULT_COLLECTION):
+        self.chunk_id = chunk_id
+        self.score = score
+        self.content = content
+        self.metadata = MappingProxyType(metadata)
+        self.collection = collection
+
+    def __getitem__(self, key):
+        if key in self._KEYS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    def __repr__(self):
+        return f"SearchHit(collection={self.collection!r}, chunk_id={self.chunk_id}, score={self.score:.4f})"
+
+_COLLECTION_NAME_RE = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+class CollectionPaths:
+    """
+    一个集合在磁盘上的文件路径；默认集合沿用原有的 index/ 和 data/pdf 路径
+
+    指定 directory 时集合的全部文件（包括 PDF）都放在该目录下，用于脚本和测试。
+    """
+
+    def __init__(self, name=DEFAULT_COLLECTION, directory=None):
+        if not _COLLECTION_NAME_RE.match(name):
+            raise ValueError(f"集合名称只能包含字母、数字、下划线和连字符（最多 64 个字符）: {name}")
+        self.name = name
+        if name == DEFAULT_COLLECTION and directory is None:
+            self.index_path = INDEX_PATH
+            self.meta_path = META_PATH
+            self.chunk_store_path = CHUNK_STORE_PATH
+            self.keyword_index_path = KEYWORD_INDEX_PATH
+            self.manifest_path = MANIFEST_PATH
+            self.snapshot_path = SNAPSHOT_PATH
+            self.wal_path = WAL_PATH
+            self.write_lock_path = WRITE_LOCK_PATH
+            self.checkpoint_path = INGEST_CHECKPOINT_PATH
+            self.embedding_cache_path = EMBEDDING_CACHE_PATH
+            self.pdf_dir = PDF_STORAGE_PATH
+        else:
+            pdf_dir = os.path.join(directory, "pdf") if directory else os.path.join(COLLECTION_PDF_DIR, name)
+            directory = directory or os.path.join(COLLECTIONS_DIR, name)
+            self.index_path = os.path.join(directory, "vector.faiss")
+            self.meta_path = os.path.join(directory, "meta.pkl")
+            self.chunk_store_path = os.path.join(directory, "chunks.json")
+            self.keyword_index_path = os.path.join(directory, "keywords.json")
+            self.manifest_path = os.path.join(directory, "manifest.json")
+            self.snapshot_path = os.path.join(directory, "snapshot.json")
+            self.wal_path = os.path.join(directory, "wal.log")
+            self.write_lock_path = os.path.join(directory, "write.lock")
+            self.checkpoint_path = os.path.join(directory, "ingest_checkpoints.json")
+            self.embedding_cache_path = os.path.join(directory, "embeddings.cache")
+            self.pdf_dir = pdf_dir
+
+    def makedirs(self):
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        os.makedirs(self.pdf_dir, exist_ok=True)
+
+class SearchFilter:
+    """
+    检索范围：文件名、页码范围（含两端）、上传时间范围（时间戳，含两端），为 None 的条件不限制
+
+    上传时间来自文档清单中的 uploaded_at，清单中没有上传时间的文件不满足上传时间条件。
+    """
+
+    def __init__(self, file_names=None, min_page=None, max_page=None, uploaded_after=None, uploaded_before=None):
+        self.file_names = frozenset(file_names) if file_names is not None else None
+        self.min_page = min_page
+        self.max_page = max_page
+        self.uploaded_after = uploaded_after
+        self.uploaded_before = uploaded_before
+
+    def key(self):
+        """用作检索结果缓存键的一部分"""
+        return (self.file_names, self.min_page, self.max_page, self.uploaded_after, self.uploaded_before)
+
+    def is_empty(self):
+        return all(value is None for value in self.key())
+
+    def to_dict(self):
+        """可 JSON 序列化的形式，SearchFilter(**data) 还原"""
+        return {"file_names": sorted(self.file_names) if self.file_names is not None else None,
+                "min_page": self.min_page, "max_page": self.max_page,
+                "uploaded_after": self.uploaded_after, "uploaded_before": self.uploaded_before}
+
+def _min_train_size(index):
+    """估算训练所需的最少向量数（FAISS 建议每个聚类中心至少 39 个样本）"""
+    if INDEX_TRAIN_SIZE > 0:
+        return INDEX_TRAIN_SIZE
+    # PQ 的每个子量化器有 256 个中心，IVF 有 nlist 个中心
+    min_size = 39 * 256 if _has_pq(index) else 1000
+    try:
+        min_size = max(min_size, 39 * faiss.extract_index_ivf(index).nlist)
+    except RuntimeError:
+        pass
+    return min_size
+
+def _has_pq(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ))
+
+def _with_ids(index):
+    """
+    为索引加上稳定的ID
+
+    IVF 索引自身按ID存储向量，直接使用；其余索引用 IndexIDMap2 维护ID映射。
+    （IVF 删除向量后不会重新编号，套上 IndexIDMap2 会导致ID错位）
+    """
+    try:
+        faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return faiss.IndexIDMap2(index)
+    _ensure_direct_map(index)
+    return index
+
+def _ensure_direct_map(index):
+    """
+    为 IVF 索引建立ID到向量位置的哈希映射，使其可以按ID取回向量（reconstruct_batch）
+
+    过滤范围较小的检索需要按ID取回向量精确计算；没有映射时只能在 nprobe 个聚类中按ID过滤，
+    小文档的文本块大多落在其他聚类中而被漏掉。旧快照中的索引没有映射，加载时补建。
+    """
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+def _faiss_metric(metric):
+    return faiss.METRIC_INNER_PRODUCT if metric == "ip" else faiss.METRIC_L2
+
 class VectorStore:
-    def __init__(self, dim):
+    def __init__(self, dim, index_factory=INDEX_FACTORY, metric=VECTOR_METRIC, paths=None):
         self.dim = dim
+        self.index_factory = index_factory
+        self.metric = metric
+        # 所属集合的磁盘路径
+        self.paths = paths or CollectionPaths()
+        # 基础索引：创建或合并后不再修改，copy() 得到的副本直接共享
         self.index = None
-        self.text_chunks = []
+        # 之后新增的向量（IndexIDMap2 包装的 Flat 索引，每个副本各自复制）和基础索引中已删除的向量ID
+        self._delta = None
+        self._removed = set()
+        # chunk_id -> 文本块；chunk_id 即 FAISS 中的向量ID，删除其他文档时保持不变
+        self.text_chunks = ChunkStore()
+        # 文本块的 BM25 倒排索引，与 text_chunks 使用相同的 chunk_id
+        self.keywords = KeywordIndex()
+        # 文件名 -> 文档清单条目（大小、sha256、页数、chunk_id 范围、嵌入模型），只包含完整入库的文件
+        self.manifest = {}
+        self.generation = next(_generations)
+        # 磁盘快照的代号、已包含的最后一条操作日志序号，以及尚未写入操作日志的修改
+        self.snapshot_generation = 0
+        self.wal_seq = 0
+        self._wal_ops = []
+        # 已发布的实例被多个读取方共享，不能再修改
+        self._frozen = False
+        # 从磁盘加载失败的原因；此时内存中是空存储，不能写入，以免覆盖磁盘上仍然完好的数据
+        self.load_error = None
+
+    def freeze(self):
+        """标记为只读（发布时调用），之后的修改需要在 copy() 得到的副本上进行"""
+        self._frozen = True
+
+    def _check_writable(self):
+        if self._frozen:
+            raise RuntimeError("已发布的向量存储是只读的，请在 copy() 得到的副本上修改")
+        self._check_loaded()
+
+    def _check_loaded(self):
+        if self.load_error is not None:
+            raise RuntimeError(f"向量存储加载失败（{self.load_error}），为避免覆盖磁盘上的数据暂不能写入，"
+                               f"请修复后重新加载集合，或全部重新入库")
+
+    def _new_index(self):
+        """创建带稳定ID映射的空索引；需要训练的索引类型先用精确的 Flat 索引暂存向量"""
+        inner = self._factory_index()
+        if not inner.is_trained:
+            inner = faiss.IndexFlat(self.dim, _faiss_metric(self.metric))
+        return _with_ids(inner)
+
+    def _factory_index(self):
+        return faiss.index_factory(self.dim, self.index_factory, _faiss_metric(self.metric))
+
+    def _inner_index(self):
+        """返回去掉ID映射后的实际索引"""
+        if isinstance(self.index, faiss.IndexIDMap2):
+            return faiss.downcast_index(self.index.index)
+        return self.index
+
+    def _all_vectors(self, index=None):
+        """返回索引（默认为基础索引）中的全部向量及其ID（仅适用于 IndexIDMap2 包装的索引）"""
+        index = index if index is not None else self.index
+        inner = faiss.downcast_index(index.index)
+        vectors = inner.reconstruct_n(0, inner.ntotal)
+        ids = faiss.vector_to_array(index.id_map).astype('int64')
+        return vectors, ids
+
+    @property
+    def ntotal(self):
+        """索引中的有效向量数（基础索引扣除删除标记，加上增量索引）"""
+        if self.index is None:
+            return 0
+        return self.index.ntotal - len(self._removed) + (self._delta.ntotal if self._delta is not None else 0)
+
+    def _needs_merge(self):
+        base = self.index.ntotal
+        delta = self._delta.ntotal if self._delta is not None else 0
+        return delta > max(INDEX_DELTA_MAX, base // 32) or len(self._removed) > base // 10
+
+    def _merge_delta(self):
+        """
+        把增量索引和删除标记合并到新的基础索引
+
+        在基础索引的副本上修改，正在读取旧版本的实例不受影响；合并的开销分摊到之后的多次发布。
+        """
+        if self._delta is None and not self._removed:
+            return
+        delta = self._delta
+        self.index = faiss.clone_index(self.index)
+        _ensure_direct_map(self.index)
+        if self._removed:
+            self._remove_ids(np.fromiter(self._removed, dtype='int64', count=len(self._removed)))
+        if delta is not None and delta.ntotal > 0:
+            self.index.add_with_ids(*self._all_vectors(delta))
+        self._delta = None
+        self._removed = set()
+        self._maybe_train()
+
+    def _maybe_train(self):
+        """向量足够多时，把暂存的 Flat 索引替换为训练好的目标索引"""
+        target = self._factory_index()
+        if target.is_trained or not isinstance(self._inner_index(), faiss.IndexFlat):
+            return False
+            
+        min_size = _min_train_size(target)
+        if self.index.ntotal < min_size:
+            return False
+            
+        vectors, ids = self._all_vectors()
+        sample = vectors
+        if len(vectors) > INDEX_TRAIN_SAMPLE:
+            rows = np.random.default_rng(0).choice(len(vectors), INDEX_TRAIN_SAMPLE, replace=False)
+            sample = vectors[rows]
+            
+        logger.info(f"向量数达到 {self.index.ntotal}，开始训练索引 {self.index_factory}（样本数 {len(sample)}）")
+        target.train(sample)
+        index = _with_ids(target)
+        index.add_with_ids(vectors, ids)
+        self.index = index
+        logger.info(f"索引 {self.index_factory} 训练完成")
+        return True
+
+    def _remove_ids(self, ids):
+        try:
+            self.index.remove_ids(ids)
+        except RuntimeError:
+            # HNSW 等索引不支持删除，用剩余向量重建（不需要重新计算嵌入）
+            logger.info("当前索引类型不支持删除，使用剩余向量重建索引")
+            vectors, all_ids = self._all_vectors()
+            keep = ~np.isin(all_ids, ids)
+            self.index = self._new_index()
+            self.index.add_with_ids(vectors[keep], all_ids[keep])
+            self._maybe_train()
+
+    def _search_params(self, nprobe=None, ef_search=None, ids=None):
+        """
+        根据基础索引的类型生成单次查询的检索参数
+
+        指定 ids 时加入ID过滤器，FAISS 检索时直接跳过其余向量；否则跳过带删除标记的向量
+        （ids 来自文本块存储，不包含已删除的文本块）。
+        """
+        # 过滤器需在构造时传入，参数对象才会持有它的引用
+        if ids is not None:
+            selector = {"sel": faiss.IDSelectorBatch(ids)}
+        elif self._removed:
+            removed = np.fromiter(self._removed, dtype='int64', count=len(self._removed))
+            selector = {"sel": faiss.IDSelectorNot(faiss.IDSelectorBatch(removed))}
+        else:
+            selector = {}
+        inner = self._inner_index()
+        try:
+            faiss.extract_index_ivf(inner)
+            return faiss.SearchParametersIVF(nprobe=nprobe or INDEX_NPROBE, **selector)
+        except RuntimeError:
+            pass
+        if isinstance(inner, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(efSearch=ef_search or INDEX_EF_SEARCH, **selector)
+        return faiss.SearchParameters(**selector) if selector else None
+
+    def describe_index(self):
+        """返回当前索引类型的简要描述"""
+        if self.index is None:
+            return None
+        inner = self._inner_index()
+        return {
+            "configured": self.index_factory,
+            "type": type(inner).__name__,
+            "is_trained": bool(inner.is_trained),
+            "metric": "ip" if inner.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+            "training_pending": not self._factory_index().is_trained
+                                and isinstance(inner, faiss.IndexFlat),
+        }
         
     def add(self, embeddings, texts, file_name=None):
-        """添加文本和对应的嵌入到存储"""
+        """添加文本和对应的嵌入到存储，返回分配的 chunk_id 列表"""
+        self._check_writable()
         try:
             if self.index is None:
-                self.index = faiss.IndexFlatL2(self.dim)
+                self.index = self._new_index()
                 
             if isinstance(embeddings, list):
                 embeddings_np = np.array(embeddings).astype('float32')
@@ -27,6 +367,7 @@ class VectorStore:
         
             # 确保文本块包含必要的元数据
             normalized_texts = []
+            kept_rows = []
             for i, text_item in enumerate(texts):
                 if isinstance(text_item, dict) and 'content' in text_item:
                     # 确保元数据包含文件名等信息
@@ -50,114 +391,508 @@ class VectorStore:
                 else:
                     logger.warning(f"跳过不支持的文本格式: {type(text_item)}")
                     continue
+                kept_rows.append(i)
+            
+            if not normalized_texts:
+                return []
+                
+            ids = np.array([self.text_chunks.add(chunk) for chunk in normalized_texts], dtype='int64')
+            vectors = embeddings_np[kept_rows]
+            self._insert(ids, vectors, normalized_texts)
+            self._wal_ops.append(("add", ids, vectors, normalized_texts))
                 
-            self.index.add(embeddings_np)
-            self.text_chunks.extend(normalized_texts)
             logger.info(f"添加了 {len(normalized_texts)} 条文本到向量存储")
+            return ids.tolist()
         except Exception as e:
             logger.error(f"添加向量失败: {str(e)}", exc_info=True)
             raise
+
+    def _insert(self, ids, vectors, chunks):
+        """把已分配 chunk_id 的文本块加入增量索引和关键词索引"""
+        if self.index is None:
+            self.index = self._new_index()
+        for chunk_id, chunk in zip(ids.tolist(), chunks):
+            self.keywords.add(chunk_id, chunk['content'])
+        if self._delta is None:
+            self._delta = faiss.IndexIDMap2(faiss.IndexFlat(self.dim, self.index.metric_type))
+        self._delta.add_with_ids(vectors, ids)
+        if self._needs_merge():
+            self._merge_delta()
+        self.generation = next(_generations)
+
+    def _delete(self, chunk_ids):
+        if self.index is not None:
+            ids = np.array([chunk_id for chunk_id in chunk_ids if chunk_id in self.text_chunks], dtype='int64')
+            if self._delta is not None:
+                in_delta = np.isin(ids, faiss.vector_to_array(self._delta.id_map))
+                self._delta.remove_ids(ids[in_delta])
+                ids = ids[~in_delta]
+            # 基础索引是共享的，只记录删除标记，检索时跳过
+            self._removed.update(ids.tolist())
+            if self._needs_merge():
+                self._merge_delta()
+        self.text_chunks.remove(chunk_ids)
+        self.keywords.remove(chunk_ids)
+        self.generation = next(_generations)
+
+    def remove_document(self, file_name, min_page=None):
+        """从存储中移除指定文件的全部文本块（或页码不小于 min_page 的部分），只涉及该文件的向量，返回移除的数量"""
+        self.set_manifest_entry(file_name, None)
+        removed = self.remove_chunks(self.text_chunks.ids_for_document(file_name, min_page))
+        if removed:
+            logger.info(f"从向量存储中移除了文件 {file_name} 的 {removed} 条文本")
+        return removed
+
+    def remove_chunks(self, chunk_ids):
+        """移除指定的文本块（不修改文档清单），返回移除的数量"""
+        self._check_writable()
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return 0
+        self._delete(chunk_ids)
+        self._wal_ops.append(("remove", chunk_ids))
+        return len(chunk_ids)
+
+    def set_manifest_entry(self, file_name, entry):
+        """登记文件的文档清单条目，entry 为 None 时移除"""
+        self._check_writable()
+        if entry is None:
+            if self.manifest.pop(file_name, None) is None:
+                return
+        else:
+            self.manifest[file_name] = entry
+        self._wal_ops.append(("manifest", file_name, entry))
+
+    def take_wal_ops(self):
+        """取出自上次发布以来的修改（add/remove/manifest 操作），由 ResidentVectorStore 追加到操作日志"""
+        ops, self._wal_ops = self._wal_ops, []
+        return ops
+
+    def replay(self, ops):
+        """重放操作日志中的一条记录（chunk_id 与原操作相同，不需要重新计算嵌入）"""
+        self._check_writable()
+        for op in ops:
+            if op[0] == "add":
+                _, ids, vectors, chunks = op
+                for chunk_id, chunk in zip(ids.tolist(), chunks):
+                    self.text_chunks.put(chunk_id, chunk)
+                self._insert(ids, vectors, chunks)
+            elif op[0] == "remove":
+                self._delete(op[1])
+            elif op[2] is None:
+                self.manifest.pop(op[1], None)
+            else:
+                self.manifest[op[1]] = op[2]
             
     def save(self):
-        """保存索引和文本块到文件"""
+        """
+        把完整的存储保存为新的快照
+
+        索引、文本块和关键词索引先写入新版本的数据文件并同步到磁盘，最后原子替换快照文件，
+        快照文件记录代号、各数据文件的版本、文档清单以及已包含的操作日志序号。
+        任何时刻崩溃，磁盘上都有一份完整一致的快照（新的或旧的），不会出现索引与文本块不一致。
+        """
         try:
-            if self.index is not None:
-                faiss.write_index(self.index, INDEX_PATH)
-                with open(META_PATH, 'wb') as f:
-                    pickle.dump(self.text_chunks, f)
-                logger.info(f"向量存储已保存，包含 {len(self.text_chunks)} 条文本")
-            else:
+            self._check_loaded()
+            if self.index is None:
                 logger.warning("尝试保存空索引")
+                return
+            # 快照只保存一个索引文件
+            self._merge_delta()
+            paths = self.paths
+            paths.makedirs()
+            previous = _read_snapshot(paths)
+            directory = os.path.dirname(paths.index_path)
+            index_file = f"{os.path.splitext(os.path.basename(paths.index_path))[0]}-{uuid.uuid4().hex[:12]}.faiss"
+            faiss.write_index(self.index, os.path.join(directory, index_file))
+            fsync_path(os.path.join(directory, index_file))
+            snapshot = {
+                "generation": previous["generation"] + 1 if previous else 1,
+                "wal_seq": self.wal_seq,
+                "index": index_file,
+                "chunks": self.text_chunks.write_version(paths.chunk_store_path),
+                "keywords": self.keywords.write_version(paths.keyword_index_path),
+                "manifest": self.manifest,
+            }
+            tmp_path = paths.snapshot_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, paths.snapshot_path)
+            fsync_path(directory)
+
+            # 改为映射新版本的数据文件，再删除上一个快照（或旧版本格式）的文件
+            self.text_chunks = ChunkStore.load(paths.chunk_store_path, snapshot["chunks"])
+            self.keywords = KeywordIndex.load(paths.keyword_index_path, snapshot["keywords"])
+            self.snapshot_generation = snapshot["generation"]
+            if previous is not None:
+                _remove_snapshot_files(paths, previous)
+            else:
+                _remove_legacy_files(paths)
+            logger.info(f"向量存储快照 {snapshot['generation']} 已保存，包含 {len(self.text_chunks)} 条文本")
         except Exception as e:
             logger.error(f"保存向量存储失败: {str(e)}", exc_info=True)
             raise
+
+    def _reset(self):
+        self.index = self._new_index()
+        self._delta = None
+        self._removed = set()
+        self.text_chunks = ChunkStore()
+        self.keywords = KeywordIndex()
+        self.manifest = {}
+        self.generation = next(_generations)
             
     def load(self):
-        """从文件加载索引和文本块"""
+        """
+        从快照（或旧版本格式的文件）加载索引和文本块，再重放快照之后的操作日志
+
+        加载失败时磁盘上的文件保持不变，内存中为空存储并记录 load_error：可以检索（没有结果），
+        但写入和保存都会报错，不会用空存储覆盖原有数据。
+        """
+        self.load_error = None
         try:
-            if os.path.exists(INDEX_PATH) and os.path.exists(META_PATH):
-                self.index = faiss.read_index(INDEX_PATH)
-                with open(META_PATH, 'rb') as f:
-                    self.text_chunks = pickle.load(f)
-                logger.info(f"向量存储已加载，包含 {len(self.text_chunks)} 条文本")
+            for attempt in range(3):
+                try:
+                    index = self._load_files()
+                    break
+                except FileNotFoundError:
+                    # 读取期间其他进程保存了新快照并删除了旧的数据文件，重新读取快照
+                    if attempt == 2:
+                        raise
+                
+            if index is not None:
+                if isinstance(index, faiss.IndexFlat):
+                    # 旧版本索引没有ID映射，按顺序ID迁移到 IndexIDMap2（保留原有度量）
+                    id_map = faiss.IndexIDMap2(faiss.IndexFlat(self.dim, index.metric_type))
+                    if index.ntotal > 0:
+                        id_map.add_with_ids(index.reconstruct_n(0, index.ntotal),
+                                            np.arange(index.ntotal, dtype='int64'))
+                    index = id_map
+                _ensure_direct_map(index)
+                self.index = index
+                if index.metric_type != _faiss_metric(self.metric):
+                    logger.warning(f"磁盘上的索引度量与配置 VECTOR_METRIC={self.metric} 不一致，"
+                                   f"如需切换请重建索引")
             else:
-                self.index = faiss.IndexFlatL2(self.dim)
-                self.text_chunks = []
+                self._reset()
+                
+            replayed = 0
+            for seq, ops in WriteAheadLog(self.paths.wal_path).records(self.wal_seq):
+                self.replay(ops)
+                self.wal_seq = seq
+                replayed += 1
+            self.generation = next(_generations)
+            
+            if index is None and not replayed:
                 logger.info("创建了新的向量存储")
+            elif replayed:
+                logger.info(f"向量存储已加载，重放了 {replayed} 条操作日志，包含 {len(self.text_chunks)} 条文本")
+            else:
+                logger.info(f"向量存储已加载，包含 {len(self.text_chunks)} 条文本")
         except Exception as e:
-            logger.error(f"加载向量存储失败: {str(e)}", exc_info=True)
-            self.index = faiss.IndexFlatL2(self.dim)
-            self.text_chunks = []
+            logger.error(f"加载向量存储失败，磁盘上的文件保持不变，修复前不能写入: {str(e)}", exc_info=True)
+            self._reset()
+            self.load_error = str(e) or type(e).__name__
+
+    def _load_files(self):
+        """读取快照（没有快照时读取旧版本格式的文件），返回 FAISS 索引，磁盘上没有数据时返回 None"""
+        paths = self.paths
+        snapshot = _read_snapshot(paths)
+        if snapshot is not None:
+            index_path = os.path.join(os.path.dirname(paths.index_path), snapshot["index"])
+            if not os.path.exists(index_path):
+                raise FileNotFoundError(index_path)
+            index = faiss.read_index(index_path)
+            self.text_chunks = ChunkStore.load(paths.chunk_store_path, snapshot["chunks"])
+            self.keywords = KeywordIndex.load(paths.keyword_index_path, snapshot["keywords"])
+            self.manifest = snapshot["manifest"]
+            self.snapshot_generation = snapshot["generation"]
+            self.wal_seq = snapshot["wal_seq"]
+            return index
+            
+        self.snapshot_generation = self.wal_seq = 0
+        if os.path.exists(paths.index_path) and os.path.exists(paths.chunk_store_path):
+            index = faiss.read_index(paths.index_path)
+            self.text_chunks = ChunkStore.load(paths.chunk_store_path)
+        elif os.path.exists(paths.index_path) and os.path.exists(paths.meta_path):
+            # 旧版本的 meta.pkl，下次保存时转换为列式存储
+            index = faiss.read_index(paths.index_path)
+            with open(paths.meta_path, 'rb') as f:
+                meta = pickle.load(f)
+                
+            if isinstance(meta, list):
+                # 按顺序排列的列表，向量ID即列表下标
+                self.text_chunks = ChunkStore.from_chunks(dict(enumerate(meta)), len(meta))
+            else:
+                self.text_chunks = ChunkStore.from_chunks(meta['text_chunks'], meta['next_id'])
+            logger.info("已从旧版本的 meta.pkl 加载文本块")
+        else:
+            return None
+            
+        self.keywords = self._load_keywords()
+        self.manifest = {}
+        if os.path.exists(paths.manifest_path):
+            with open(paths.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        return index
+
+    def _load_keywords(self):
+        """加载关键词索引；旧版本的存储没有关键词索引时从文本块补建，下次保存时写入磁盘"""
+        if os.path.exists(self.paths.keyword_index_path):
+            keywords = KeywordIndex.load(self.paths.keyword_index_path)
+            if len(keywords) == len(self.text_chunks):
+                return keywords
+            logger.warning("关键词索引与文本块数量不一致，重新构建")
+        else:
+            logger.info("未找到关键词索引，从已有文本块构建")
+        return KeywordIndex.build(self.text_chunks.items())
+
+    def copy(self, clone_index=True):
+        """
+        复制出一个独立的存储，用于在不影响正在读取的实例的情况下写入
+
+        基础索引不会被修改，直接共享；只复制增量索引和删除标记，耗时与上次合并以来的修改量成正比。
+        clone_index 为 False 时连增量索引也共享，只用于保存快照等不修改索引的场合。
+        """
+        new_store = VectorStore(self.dim, self.index_factory, self.metric, self.paths)
+        new_store.index = self.index
+        if self._delta is not None:
+            new_store._delta = faiss.clone_index(self._delta) if clone_index else self._delta
+        new_store._removed = set(self._removed)
+        new_store.text_chunks = self.text_chunks.copy()
+        new_store.keywords = self.keywords.copy()
+        new_store.manifest = {name: dict(entry) for name, entry in self.manifest.items()}
+        new_store.generation = self.generation
+        new_store.snapshot_generation = self.snapshot_generation
+        new_store.wal_seq = self.wal_seq
+        new_store.load_error = self.load_error
+        return new_store
+            
+    def _scores(self, distances):
+        """把 FAISS 返回的距离转换为余弦相似度（嵌入向量已归一化）"""
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return distances
+        # 单位向量之间：||a - b||^2 = 2 - 2cos
+        return 1.0 - distances / 2.0
+
+    def select_ids(self, search_filter):
+        """返回满足过滤条件的 chunk_id（升序数组）"""
+        file_names = search_filter.file_names
+        if search_filter.uploaded_after is not None or search_filter.uploaded_before is not None:
+            uploaded = {
+                name for name, entry in self.manifest.items()
+                if entry.get('uploaded_at') is not None
+                and (search_filter.uploaded_after is None or entry['uploaded_at'] >= search_filter.uploaded_after)
+                and (search_filter.uploaded_before is None or entry['uploaded_at'] <= search_filter.uploaded_before)
+            }
+            file_names = uploaded if file_names is None else file_names & uploaded
+        return self.text_chunks.select_ids(file_names, search_filter.min_page, search_filter.max_page)
+
+    def _index_search(self, query_embeddings, top_k, nprobe=None, ef_search=None, ids=None):
+        """在基础索引（跳过带删除标记的向量）和增量索引中分别检索，合并出 top_k，返回 (D, I)"""
+        D, I = self.index.search(query_embeddings, top_k, params=self._search_params(nprobe, ef_search, ids))
+        if self._delta is None or self._delta.ntotal == 0:
+            return D, I
+        params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids)) if ids is not None else None
+        delta_D, delta_I = self._delta.search(query_embeddings, top_k, params=params)
+        D = np.concatenate([D, delta_D], axis=1)
+        I = np.concatenate([I, delta_I], axis=1)
+        # 没有结果的位置距离为最差值，排在最后
+        order = -D if self.index.metric_type == faiss.METRIC_INNER_PRODUCT else D
+        top = np.argsort(order, axis=1, kind='stable')[:, :top_k]
+        return np.take_along_axis(D, top, axis=1), np.take_along_axis(I, top, axis=1)
+
+    def _reconstruct(self, ids):
+        """按ID从基础索引或增量索引中取回向量；索引不支持时抛出 RuntimeError"""
+        if self._delta is None or self._delta.ntotal == 0:
+            return self.index.reconstruct_batch(ids)
+        in_delta = np.isin(ids, faiss.vector_to_array(self._delta.id_map))
+        vectors = np.empty((len(ids), self.dim), dtype='float32')
+        if in_delta.any():
+            vectors[in_delta] = self._delta.reconstruct_batch(ids[in_delta])
+        if not in_delta.all():
+            vectors[~in_delta] = self.index.reconstruct_batch(ids[~in_delta])
+        return vectors
+
+    def _exact_search(self, query_embeddings, top_k, ids):
+        """
+        只在 ids 对应的向量中精确检索，耗时与 ids 的数量成正比
+
+        Returns:
+            与 index.search 格式相同的 (D, I)；索引不支持按ID取回向量时返回 None
+        """
+        try:
+            vectors = self._reconstruct(ids)
+        except RuntimeError:
+            return None
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            scores = query_embeddings @ vectors.T
+            order = -scores
+        else:
+            scores = (np.square(query_embeddings).sum(axis=1, keepdims=True) - 2 * query_embeddings @ vectors.T
+                      + np.square(vectors).sum(axis=1))
+            order = scores
+        top_k = min(top_k, len(ids))
+        top = np.argpartition(order, top_k - 1, axis=1)[:, :top_k]
+        top = np.take_along_axis(top, np.argsort(np.take_along_axis(order, top, axis=1), axis=1), axis=1)
+        return np.take_along_axis(scores, top, axis=1), ids[top]
+
+    def search(self, query_embedding, top_k=5, threshold=None, nprobe=None, ef_search=None, search_filter=None):
+        """
+        搜索最相似的文本块
+        
+        Args:
+            query_embedding: 查询向量
+            top_k: 返回的结果数量
+            threshold: 最低余弦相似度，默认使用 SIMILARITY_THRESHOLD
+            nprobe: IVF 索引本次查询访问的聚类数，默认使用 INDEX_NPROBE
+            ef_search: HNSW 索引本次查询的候选列表大小，默认使用 INDEX_EF_SEARCH
+            search_filter: 只在满足条件的文本块中检索（SearchFilter），默认检索全部
+        """
+        # 确保查询向量格式正确（已是 float32 数组时不会复制）
+        query_embedding = np.asarray(query_embedding, dtype='float32')
+        if query_embedding.ndim == 1:
+            # 如果是一维数组，转换为二维
+            query_embedding = query_embedding.reshape(1, -1)
+            
+        results = self.search_batch(query_embedding[:1], top_k, threshold, nprobe, ef_search, search_filter)
+        return results[0] if results else []
+
+    def search_batch(self, query_embeddings, top_k=5, threshold=None, nprobe=None, ef_search=None, search_filter=None):
+        """
+        批量搜索：所有查询向量作为一个矩阵交给 FAISS 一次检索
+        
+        Args:
+            query_embeddings: 形状为 (n, dim) 的查询向量矩阵
+            其余参数同 search()
             
-    def search(self, query_embedding, top_k=5, threshold=0.0):  # 将默认阈值降低到0
-        """搜索最相似的文本块"""
+        Returns:
+            与查询向量一一对应的结果列表
+        """
         try:
-            if self.index is None or self.index.ntotal == 0:
+            if self.ntotal == 0:
                 logger.warning("向量存储为空，无法搜索")
-                return []
+                return [[] for _ in range(len(query_embeddings))]
                 
             if len(self.text_chunks) == 0:
                 logger.warning("文本块列表为空，无法搜索")
-                return []
-            
-            # 确保查询向量格式正确
-            if not isinstance(query_embedding, np.ndarray):
-                logger.info(f"转换查询向量类型: {type(query_embedding)} -> numpy.ndarray")
-                query_embedding = np.array([query_embedding]).astype('float32')
-            elif len(query_embedding.shape) == 1:
-                # 如果是一维数组，转换为二维
-                query_embedding = query_embedding.reshape(1, -1).astype('float32')
-            else:
-                query_embedding = query_embedding.astype('float32')
+                return [[] for _ in range(len(query_embeddings))]
             
-            logger.info(f"查询向量形状: {query_embedding.shape}")
+            # 已是连续的 float32 矩阵时不会复制
+            query_embeddings = np.ascontiguousarray(query_embeddings, dtype='float32')
             
             # 执行搜索
             top_k = min(top_k, len(self.text_chunks))
-            D, I = self.index.search(query_embedding, top_k)
-            
-            logger.info(f"检索结果距离分数: {D[0]}")
-            
-            # 改进相似度计算公式，确保能够得到有效值
-            similarities = []
-            for d in D[0]:
-                if d > 0:
-                    sim = 1.0 / (1.0 + d/2.0)  # 使用倒数关系确保距离越小相似度越高
+            if search_filter is None or search_filter.is_empty():
+                D, I = self._index_search(query_embeddings, top_k, nprobe, ef_search)
+            else:
+                ids = self.select_ids(search_filter)
+                if len(ids) == 0:
+                    return [[] for _ in range(len(query_embeddings))]
+                # 范围较小时直接计算精确相似度，否则让 FAISS 在检索时按ID过滤
+                exact = None
+                if len(ids) <= SEARCH_FILTER_EXACT_MAX:
+                    exact = self._exact_search(query_embeddings, top_k, ids)
+                if exact is not None:
+                    D, I = exact
                 else:
-                    sim = 1.0
-                similarities.append(sim)
-                
-            logger.info(f"改进的相似度分数: {similarities}")
-            
-            # 添加相似度分数到结果中
-            results = []
-            for idx, sim in zip(I[0], similarities):
-                if idx >= 0 and idx < len(self.text_chunks):
-                    chunk = self.text_chunks[idx]
-                    
-                    # 深拷贝避免修改原始数据
-                    import copy
-                    chunk_copy = copy.deepcopy(chunk)
-                    
-                    # 添加相似度分数
-                    if isinstance(chunk_copy, dict):
-                        chunk_copy["score"] = float(sim)
-                        results.append(chunk_copy)
-                    else:
-                        results.append({
-                            "content": chunk_copy,
-                            "score": float(sim),
-                            "metadata": {}
-                        })
-            
-            # 按相似度排序
-            results.sort(key=lambda x: x.get("score", 0), reverse=True)
-            
-            return results
+                    if len(ids) <= SEARCH_FILTER_EXACT_MAX:
+                        # 索引不能按ID取回向量时，IVF 访问全部聚类，范围内的文本块不会因不在 nprobe 个聚类中而漏掉
+                        try:
+                            nprobe = faiss.extract_index_ivf(self.index).nlist
+                        except RuntimeError:
+                            pass
+                    D, I = self._index_search(query_embeddings, top_k, nprobe, ef_search, ids)
+            
+            if threshold is None:
+                threshold = SIMILARITY_THRESHOLD
+            return self._build_results(D, I, threshold)
             
         except Exception as e:
             logger.error(f"搜索失败: {str(e)}", exc_info=True)
-            return []
+            return [[] for _ in range(len(query_embeddings))]
+
+    def hybrid_search_batch(self, query_embeddings, query_texts, top_k=5, threshold=None, nprobe=None,
+                            ef_search=None, search_filter=None, rrf_k=HYBRID_RRF_K,
+                            min_idf=HYBRID_KEYWORD_MIN_IDF):
+        """
+        混合检索：向量检索与关键词（BM25）检索各取 top_k 条，按倒数排名融合（RRF）后返回前 top_k 条
+
+        关键词检索能找到向量检索容易漏掉的精确匹配（型号、编号、术语），这类结果不受相似度阈值限制，
+        但必须匹配到至少一个较少见的检索词（IDF 不低于 min_idf），只匹配到常见词的文本块不参与融合。
+        融合后结果的 score 为 RRF 分数。
+
+        Args:
+            query_texts: 与 query_embeddings 一一对应的问题文本
+            rrf_k: RRF 常数，越大则排名靠后的结果权重越接近靠前的结果
+            min_idf: 关键词命中至少要匹配一个 IDF 不低于此值的检索词，None 表示不限
+            其余参数同 search()
+        """
+        dense_results = self.search_batch(query_embeddings, top_k, threshold, nprobe, ef_search, search_filter)
+        ids = None if search_filter is None or search_filter.is_empty() else self.select_ids(search_filter)
+        results = []
+        for dense_hits, query_text in zip(dense_results, query_texts):
+            fused = {}
+            dense_by_id = {}
+            for rank, hit in enumerate(dense_hits):
+                fused[hit.chunk_id] = 1.0 / (rrf_k + rank + 1)
+                dense_by_id[hit.chunk_id] = hit
+            for rank, (chunk_id, _) in enumerate(self.keywords.search(query_text, top_k, ids, min_idf)):
+                fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+                
+            chunk_ids = sorted(fused, key=fused.get, reverse=True)[:top_k]
+            missing = [chunk_id for chunk_id in chunk_ids if chunk_id not in dense_by_id]
+            chunks = dict(zip(missing, self.text_chunks.get_many(missing)))
+            hits = []
+            for chunk_id in chunk_ids:
+                hit = dense_by_id.get(chunk_id)
+                if hit is not None:
+                    hits.append(SearchHit(chunk_id, fused[chunk_id], hit.content, hit.metadata, self.paths.name))
+                elif isinstance(chunks[chunk_id], dict):
+                    chunk = chunks[chunk_id]
+                    hits.append(SearchHit(chunk_id, fused[chunk_id], chunk.get('content', ''),
+                                          chunk.get('metadata') or {}, self.paths.name))
+            results.append(hits)
+        return results
+
+    def _build_results(self, distances, ids, threshold):
+        """
+        把一批查询的 FAISS 结果 (D, I) 转换为各查询的 SearchHit 列表（FAISS 已按相似度排序）
+
+        相似度换算和阈值过滤对整个矩阵进行，命中的文本块对整批查询只查找一次（多个查询命中同一文本块时只解码一次）。
+        """
+        similarities = self._scores(distances)
+            
+        # 先按阈值过滤，低相关度的文本块不再取出内容
+        keep = (ids >= 0) & (similarities >= threshold)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"余弦相似度: {similarities}，阈值 {threshold} 过滤后保留 {int(keep.sum())} 条")
+        
+        # 每个文本块的 (内容, 元数据) 只取一次，逐条命中只剩构建 SearchHit
+        unique_ids = np.unique(ids[keep]).tolist()
+        entries = {}
+        for chunk_id, chunk in zip(unique_ids, self.text_chunks.get_many(unique_ids)):
+            if isinstance(chunk, dict):
+                entries[chunk_id] = (chunk.get('content', ''), chunk.get('metadata') or {})
+            elif chunk is not None:
+                entries[chunk_id] = (str(chunk), {})
+        
+        name = self.paths.name
+        kept_ids = ids[keep].tolist()
+        kept_scores = similarities[keep].tolist()
+        results = []
+        start = 0
+        for count in keep.sum(axis=1).tolist():
+            hits = []
+            for chunk_id, score in zip(kept_ids[start:start + count], kept_scores[start:start + count]):
+                entry = entries.get(chunk_id)
+                if entry is not None:
+                    hits.append(SearchHit(chunk_id, score, entry[0], entry[1], name))
+            results.append(hits)
+            start += count
+        return results
         
     def clear(self):
         """完全清除向量存储中的所有数据"""
@@ -166,15 +901,16 @@ class VectorStore:
         )
         logger.info("向量存储已完全清除")
         
-    def get_sources_from_texts(self, texts):
+    @staticmethod
+    def get_sources_from_texts(texts):
         """从检索到的文本中提取来源信息"""
         sources = []
         for text in texts:
             content = text.page_content if hasattr(text, 'page_content') else text.get('content', '')
             metadata = text.metadata if hasattr(text, 'metadata') else text.get('metadata', {})
             
-            # 确保元数据是字典类型
-            if not isinstance(metadata, dict):
+            # 确保元数据是字典类型（SearchHit 的元数据是只读视图）
+            if not isinstance(metadata, Mapping):
                 metadata = {}
             
             # 获取文件名，明确定义默认值
@@ -197,7 +933,338 @@ class VectorStore:
             sources.append({
                 'file_name': file_name,
                 'page_num': page_num,
-                'summary': summary
+                'summary': summary,
+                'score': text.get('score') if isinstance(text, Mapping) else None
             })
         
         return sources
+
+
+def _read_snapshot(paths):
+    """读取快照文件，不存在时返回 None"""
+    try:
+        with open(paths.snapshot_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _remove_snapshot_files(paths, snapshot):
+    """删除快照引用的数据文件；文件仍被其他进程映射而无法删除时忽略"""
+    try:
+        os.remove(os.path.join(os.path.dirname(paths.index_path), snapshot["index"]))
+    except OSError:
+        pass
+    ChunkStore.remove_version(paths.chunk_store_path, snapshot["chunks"]["version"])
+    KeywordIndex.remove_version(paths.keyword_index_path, snapshot["keywords"]["version"])
+
+def _remove_legacy_files(paths):
+    """第一次保存快照后，删除旧版本格式的索引、文本块头文件、关键词索引头文件和文档清单（meta.pkl 保留）"""
+    for path, store_class in ((paths.chunk_store_path, ChunkStore), (paths.keyword_index_path, KeywordIndex)):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                store_class.remove_version(path, json.load(f)['version'])
+        except (OSError, ValueError, KeyError):
+            pass
+    for path in (paths.index_path, paths.chunk_store_path, paths.keyword_index_path, paths.manifest_path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def _disk_signature(paths):
+    """返回快照文件、操作日志以及旧版本格式的索引和文本块文件的 (mtime_ns, size)，用于判断磁盘上的数据是否被其他进程更新"""
+    signature = []
+    for path in (paths.snapshot_path, paths.wal_path, paths.index_path, paths.chunk_store_path):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class WriterLock:
+    """
+    集合的写锁：进程内的线程锁加上跨进程的文件锁，同一集合同一时间只有一个写入方
+
+    与 threading.Lock 一样用作上下文管理器，不可重入。
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path)
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self._file_lock.__enter__()
+        except BaseException:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self._file_lock.__exit__(*exc)
+        finally:
+            self._lock.release()
+
+
+class ResidentVectorStore:
+    """
+    进程内常驻的向量存储（一个集合）
+
+    启动时只加载一次；写入方基于 copy() 得到的副本修改，再通过 publish() 把修改追加到操作日志并原子替换当前实例。
+    操作日志超过 WAL_COMPACT_BYTES 时在后台线程中（持有写锁）保存新快照并删除快照已包含的记录，
+    加载时读取快照后只需重放其后的少量记录。
+    读取时只比较磁盘文件签名，只有其他 worker 写入了新数据才会重新加载。
+
+    读写规则（读取方不加锁，写入方串行）：
+        - current() 返回的实例发布后即为只读（freeze()），检索期间不会被修改，
+          读取方在一次查询中始终使用同一个实例，看到的是某个完整的版本；
+        - 写入方必须持有 write_lock，在其中调用 current().copy()、修改副本并 publish()。
+          write_lock 同时是跨进程的文件锁，取得锁后 current() 会先加载其他 worker 已写入的数据，
+          因此不会基于旧版本修改而覆盖别人的写入或分配到重复的 chunk_id。
+    """
+
+    def __init__(self, dim, paths=None):
+        self.dim = dim
+        self.paths = paths or CollectionPaths()
+        self.wal = WriteAheadLog(self.paths.wal_path)
+        self._store = None
+        self._signature = None
+        self._lock = threading.Lock()
+        # 同一时间只有一个后台压缩线程
+        self._compacting = threading.Lock()
+        self.write_lock = WriterLock(self.paths.write_lock_path)
+
+    @property
+    def name(self):
+        return self.paths.name
+
+    @property
+    def loaded(self):
+        return self._store is not None
+
+    def load(self):
+        """从磁盘加载向量存储（应用启动时调用）"""
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        # 先取签名再加载：若期间有其他进程写入，下次读取时会再加载一次
+        signature = _disk_signature(self.paths)
+        store = VectorStore(self.dim, paths=self.paths)
+        store.load()
+        store.freeze()
+        self._store = store
+        self._signature = signature
+
+    def current(self):
+        """返回当前的向量存储实例，尚未加载或磁盘数据变化时自动（重新）加载"""
+        store = self._store
+        if store is not None and _disk_signature(self.paths) == self._signature:
+            return store
+
+        with self._lock:
+            if self._store is None or _disk_signature(self.paths) != self._signature:
+                if self._store is not None:
+                    logger.info(f"检测到集合 {self.name} 的索引文件已被其他进程更新，重新加载向量存储")
+                self._reload()
+            return self._store
+
+    def publish(self, store, snapshot=False):
+        """
+        发布新的向量存储并替换当前实例
+
+        默认把 store 相对于当前实例的修改作为一条记录追加到操作日志（已同步到磁盘）；
+        snapshot 为 True 时（store 不是基于当前实例修改的，例如全部重建）直接保存完整快照并清空操作日志。
+        调用方需持有 write_lock。
+        """
+        ops = store.take_wal_ops()
+        if snapshot:
+            with self._lock:
+                # 操作日志中已有的记录都被 store 取代
+                previous = _read_snapshot(self.paths)
+                store.wal_seq = max(self.wal.last_seq(), previous["wal_seq"] if previous else 0)
+                store.save()
+                self.wal.truncate(store.wal_seq)
+                store.freeze()
+                self._store = store
+                self._signature = _disk_signature(self.paths)
+            return
+            
+        with self._lock:
+            if ops:
+                store.wal_seq = self.wal.append(ops, store.wal_seq)
+            store.freeze()
+            self._store = store
+            self._signature = _disk_signature(self.paths)
+        self._maybe_compact()
+
+    def _needs_compaction(self):
+        """操作日志过大，或集合还没有快照（新集合或旧版本格式）"""
+        return not os.path.exists(self.paths.snapshot_path) or self.wal.size() >= WAL_COMPACT_BYTES
+
+    def _maybe_compact(self):
+        if not self._needs_compaction() or not self._compacting.acquire(blocking=False):
+            return
+        threading.Thread(target=self._compact_in_background, name=f"compact-{self.name}", daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            # 发布方释放写锁后才开始；其他进程可能已经压缩过
+            with self.write_lock:
+                if self._needs_compaction():
+                    self._compact()
+        except Exception as e:
+            logger.error(f"压缩集合 {self.name} 的操作日志失败: {str(e)}", exc_info=True)
+        finally:
+            self._compacting.release()
+
+    def compact(self):
+        """把当前存储保存为新的快照，并删除快照已包含的操作日志（调用方不能持有 write_lock）"""
+        with self.write_lock:
+            self._compact()
+
+    def _compact(self):
+        # 持有写锁：各进程的快照依次保存，压缩期间没有新的操作日志，写入方等待压缩完成
+        store = self.current()
+        if store.index is None:
+            return
+        # 在共享索引的副本上保存，正在读取的实例不受影响
+        snapshot = store.copy(clone_index=False)
+        with self._lock:
+            snapshot.save()
+            self.wal.truncate(snapshot.wal_seq)
+            snapshot.freeze()
+            # 改用快照副本，已写入磁盘的文本块不再占用内存
+            self._store = snapshot
+            self._signature = _disk_signature(self.paths)
+
+    def evict(self):
+        """释放内存中的向量存储，下次访问时再从磁盘加载（正在进行的查询仍使用各自持有的实例）"""
+        with self._lock:
+            self._store = None
+            self._signature = None
+
+
+class CollectionView:
+    """
+    一次查询涉及的一组集合（各集合的当前存储实例）
+
+    检索时在线程池中并行查询各个集合（FAISS 检索期间释放 GIL），再按分数合并出 top_k。
+    只有一个集合时直接在当前线程中检索。提供与 VectorStore 相同的检索接口。
+    """
+
+    def __init__(self, stores, executor=None):
+        # 集合名 -> VectorStore
+        self.stores = stores
+        self._executor = executor
+
+    @property
+    def generation(self):
+        """各集合版本号的组合，任一集合变化时都会改变"""
+        return tuple(sorted((name, store.generation) for name, store in self.stores.items()))
+
+    def is_empty(self):
+        return all(store.ntotal == 0 for store in self.stores.values())
+
+    def contains(self, collection, chunk_id):
+        """集合中是否仍有该文本块；集合不在本次查询范围内时返回 None（无法判断）"""
+        store = self.stores.get(collection)
+        if store is None:
+            return None
+        return chunk_id in store.text_chunks
+
+    def contains_many(self, pairs):
+        """批量的 contains()，pairs 为 (集合, 文本块ID) 列表"""
+        return [self.contains(collection, chunk_id) for collection, chunk_id in pairs]
+
+    def _fan_out(self, method, top_k, *args, **kwargs):
+        stores = list(self.stores.values())
+        if len(stores) == 1:
+            return getattr(stores[0], method)(*args, top_k=top_k, **kwargs)
+            
+        if self._executor is None:
+            shard_results = [getattr(store, method)(*args, top_k=top_k, **kwargs) for store in stores]
+        else:
+            futures = [self._executor.submit(getattr(store, method), *args, top_k=top_k, **kwargs)
+                       for store in stores]
+            shard_results = [future.result() for future in futures]
+            
+        # 每个集合各取 top_k，合并后按分数取全局 top_k
+        return [heapq.nlargest(top_k, itertools.chain(*per_query), key=lambda hit: hit.score)
+                for per_query in zip(*shard_results)]
+
+    def search_batch(self, query_embeddings, top_k=5, **kwargs):
+        """参数同 VectorStore.search_batch()"""
+        return self._fan_out('search_batch', top_k, query_embeddings, **kwargs)
+
+    def hybrid_search_batch(self, query_embeddings, query_texts, top_k=5, **kwargs):
+        """参数同 VectorStore.hybrid_search_batch()，各集合分别融合后按 RRF 分数合并"""
+        return self._fan_out('hybrid_search_batch', top_k, query_embeddings, query_texts, **kwargs)
+
+    def get_sources_from_texts(self, texts):
+        sources = next(iter(self.stores.values())).get_sources_from_texts(texts)
+        if len(self.stores) > 1:
+            for source, text in zip(sources, texts):
+                source['collection'] = text.get('collection')
+        return sources
+
+
+class CollectionManager:
+    """
+    命名集合（分片）管理
+
+    每个集合是独立的 ResidentVectorStore，数据保存在各自的目录中，可以单独加载、重建和卸载；
+    一个集合的入库或重建不影响其他集合的检索。
+    """
+
+    def __init__(self, dim, threads=SEARCH_THREADS):
+        self.dim = dim
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="search") if threads > 1 else None
+
+    def get(self, name=DEFAULT_COLLECTION):
+        """
+        返回集合的常驻存储（首次访问时才从磁盘加载）；名称不合法时抛出 ValueError
+
+        每个访问过的名称都会常驻一个实例，调用方应先用 exists() 确认集合存在，只有创建集合时例外。
+        """
+        collection = self._collections.get(name)
+        if collection is None:
+            paths = CollectionPaths(name)
+            with self._lock:
+                collection = self._collections.setdefault(name, ResidentVectorStore(self.dim, paths))
+        return collection
+
+    def names(self):
+        """默认集合以及磁盘上已有的集合（上传时创建集合目录）"""
+        names = {DEFAULT_COLLECTION}
+        if os.path.isdir(COLLECTIONS_DIR):
+            names.update(name for name in os.listdir(COLLECTIONS_DIR)
+                         if _COLLECTION_NAME_RE.match(name) and os.path.isdir(os.path.join(COLLECTIONS_DIR, name)))
+        return sorted(names)
+
+    def exists(self, name):
+        return name in self.names()
+
+    def view(self, names=None):
+        """返回一组集合当前存储实例的视图，用于一次查询；names 为空时使用默认集合"""
+        names = list(dict.fromkeys(names or [DEFAULT_COLLECTION]))
+        return CollectionView({name: self.get(name).current() for name in names}, self._executor)
+
+    def evict(self, name):
+        """卸载集合，返回是否卸载了已加载的集合"""
+        collection = self._collections.get(name)
+        if collection is None or not collection.loaded:
+            return False
+        collection.evict()
+        logger.info(f"已卸载集合 {name}")
+        return True
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
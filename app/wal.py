@@ -0,0 +1,174 @@
+import logging
+import os
+import pickle
+import struct
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只在进程内加锁
+    fcntl = None
+
+# 配置日志
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 记录头：序号、数据长度、CRC32
+_HEADER = struct.Struct('<QII')
+
+def fsync_path(path):
+    """把文件（或目录项）同步到磁盘；平台不支持打开目录时忽略"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class WriteAheadLog:
+    """
+    追加写的操作日志
+
+    每条记录是一次发布（publish）的全部操作，格式为 记录头 + pickle 数据，序号单调递增。
+    写入时先同步到磁盘再返回；进程在写入中途崩溃留下的不完整记录（长度不足或校验失败）
+    在读取时被忽略，下次追加前截掉。
+    快照保存了它包含的最后一个序号，truncate() 删除快照已包含的记录。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # 已确认有效的文件末尾、最后一条记录的序号，以及对应文件的 inode
+        self._end = 0
+        self._last_seq = 0
+        self._inode = None
+
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except FileNotFoundError:
+            return 0
+
+    def records(self, after_seq=0):
+        """按顺序生成序号大于 after_seq 的 (序号, 操作列表)，遇到不完整的记录时停止"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            for seq, payload, _ in _read_records(f, 0):
+                if seq > after_seq:
+                    yield seq, pickle.loads(payload)
+
+    def last_seq(self):
+        """日志中最后一条记录的序号（日志被压缩为空后，为本进程最后写入或压缩的序号）"""
+        with self._lock, self._file_lock():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a+b') as f:
+                self._sync_tail(f)
+            return self._last_seq
+
+    def append(self, ops, after_seq=0):
+        """
+        追加一条记录并同步到磁盘
+
+        Args:
+            ops: 本次发布的操作列表
+            after_seq: 调用方已包含的最后一个序号，新记录的序号大于它和日志中已有的序号
+
+        Returns:
+            新记录的序号
+        """
+        payload = pickle.dumps(ops, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock, self._file_lock():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a+b') as f:
+                self._sync_tail(f)
+                seq = max(self._last_seq, after_seq) + 1
+                f.seek(self._end)
+                f.write(_HEADER.pack(seq, len(payload), zlib.crc32(payload)))
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+                self._end = f.tell()
+                self._last_seq = seq
+            return seq
+
+    def truncate(self, through_seq):
+        """删除序号不大于 through_seq 的记录（快照已包含这些操作），其余记录原样保留"""
+        with self._lock, self._file_lock():
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                return
+            with f:
+                kept = [record for seq, _, record in _read_records(f, 0) if seq > through_seq]
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for record in kept:
+                    f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            fsync_path(os.path.dirname(self.path))
+            # 下次追加时重新扫描（文件已替换），序号在内存中继续递增
+            self._inode = None
+            self._last_seq = max(self._last_seq, through_seq)
+            logger.info(f"操作日志已压缩，保留 {len(kept)} 条记录")
+
+    def _sync_tail(self, f):
+        """确认有效的文件末尾和最后的序号；其他进程追加过记录时只扫描新增部分，截掉不完整的记录"""
+        stat = os.fstat(f.fileno())
+        if stat.st_ino != self._inode or stat.st_size < self._end:
+            self._inode, self._end = stat.st_ino, 0
+        if stat.st_size == self._end:
+            return
+        for seq, _, record in _read_records(f, self._end):
+            self._end += len(record)
+            self._last_seq = max(self._last_seq, seq)
+        if stat.st_size > self._end:
+            logger.warning(f"操作日志末尾有 {stat.st_size - self._end} 字节的不完整记录，已截掉")
+            f.truncate(self._end)
+
+    def _file_lock(self):
+        return FileLock(self.path + '.lock')
+
+
+class FileLock:
+    """跨进程的排他锁（fcntl.flock），不支持的平台上不加锁；同一实例不能在多个线程中同时使用"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def _read_records(f, offset):
+    """从 offset 开始逐条生成 (序号, 数据, 完整的记录字节)，遇到不完整或校验失败的记录时停止"""
+    f.seek(offset)
+    while True:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            return
+        seq, length, crc = _HEADER.unpack(header)
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        yield seq, payload, header + payload
@@ -0,0 +1,74 @@
+"""
+比较逐条编码与合并批处理编码在并发请求下的吞吐和延迟
+
+模拟 --clients 个并发客户端，每个客户端依次发送 --requests 个问题：
+    direct   每个问题单独调用 embed_texts（在线程池中执行，相当于每个请求各自编码）
+    batched  通过 EmbeddingBatcher 合并同时到达的问题
+报告 QPS 以及单次编码延迟的 p50 / p95。
+
+用法:
+    python scripts/benchmark_embedding.py
+    python scripts/benchmark_embedding.py --clients 64 --max-batch 64 --max-wait-ms 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.embedder import embed_texts, warm_up
+from app.embedding_batcher import EmbeddingBatcher
+
+
+def make_question(client, i):
+    return f"第 {client} 位用户的第 {i} 个问题：文档中关于性能优化的建议有哪些？"
+
+
+async def run_clients(args, encode):
+    latencies = []
+
+    async def client(client_id):
+        for i in range(args.requests):
+            start = time.perf_counter()
+            await encode(make_question(client_id, i))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(c) for c in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    return len(latencies) / elapsed, np.percentile(latencies, 50) * 1000, np.percentile(latencies, 95) * 1000
+
+
+async def benchmark(args):
+    loop = asyncio.get_running_loop()
+
+    async def direct(text):
+        return (await loop.run_in_executor(None, embed_texts, [text]))[0]
+
+    batcher = EmbeddingBatcher(max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+
+    print(f"\n{'方式':<10}{'QPS':>10}{'p50(ms)':>12}{'p95(ms)':>12}")
+    for name, encode in (("direct", direct), ("batched", batcher.embed)):
+        qps, p50, p95 = await run_clients(args, encode)
+        print(f"{name:<10}{qps:>10.1f}{p50:>12.1f}{p95:>12.1f}")
+    await batcher.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发问题嵌入：逐条编码与合并批处理对比")
+    parser.add_argument("--clients", type=int, default=32, help="并发客户端数")
+    parser.add_argument("--requests", type=int, default=20, help="每个客户端发送的问题数")
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    warm_up()
+    asyncio.run(benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+比较不同 FAISS 索引类型的召回率与查询延迟
+
+以精确的 Flat 索引结果为基准，对每种索引类型和每组检索参数（nprobe / efSearch）
+报告 recall@k 和单次查询平均耗时。
+
+用法:
+    python scripts/benchmark_index.py                       # 使用 index/vector.faiss 中的向量
+    python scripts/benchmark_index.py --synthetic 200000    # 使用随机生成的向量
+    python scripts/benchmark_index.py --factory HNSW32 --factory IVF1024,PQ48 --nprobe 8 --nprobe 32
+"""
+import argparse
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import INDEX_PATH, VECTOR_DIM
+from app.vector_store import VectorStore
+
+
+def load_vectors(args):
+    """读取现有索引中的向量，或生成随机向量"""
+    if args.synthetic or not os.path.exists(INDEX_PATH):
+        count = args.synthetic or 50000
+        print(f"使用 {count} 条随机向量")
+        rng = np.random.default_rng(0)
+        # 在若干个中心附近生成向量，比均匀分布更接近真实嵌入
+        centers = rng.standard_normal((256, VECTOR_DIM)).astype('float32')
+        vectors = centers[rng.integers(0, len(centers), count)] + 0.3 * rng.standard_normal((count, VECTOR_DIM)).astype('float32')
+        # 与 embed_texts 一致，使用 L2 归一化后的向量
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype('float32')
+
+    store = VectorStore(VECTOR_DIM)
+    store.load()
+    if not isinstance(store.index, faiss.IndexIDMap2):
+        sys.exit("现有索引不是 IndexIDMap2 包装的索引，无法读出原始向量，请使用 --synthetic")
+    # 操作日志中的增删先合并到基础索引
+    store._merge_delta()
+    vectors, _ = store._all_vectors()
+    print(f"使用 {INDEX_PATH} 中的 {len(vectors)} 条向量")
+    return vectors
+
+
+def build_store(factory, vectors):
+    store = VectorStore(VECTOR_DIM, index_factory=factory)
+    start = time.perf_counter()
+    store.index = store._new_index()
+    store.index.add_with_ids(vectors, np.arange(len(vectors), dtype='int64'))
+    store._maybe_train()
+    return store, time.perf_counter() - start
+
+
+def timed_search(store, queries, top_k, nprobe=None, ef_search=None):
+    params = store._search_params(nprobe, ef_search)
+    start = time.perf_counter()
+    _, ids = store.index.search(queries, top_k, params=params)
+    return ids, (time.perf_counter() - start) * 1000 / len(queries)
+
+
+def recall_at_k(ids, ground_truth):
+    hits = sum(len(set(row) & set(truth)) for row, truth in zip(ids.tolist(), ground_truth.tolist()))
+    return hits / ground_truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS 索引召回率/延迟对比")
+    parser.add_argument("--factory", action="append", help="索引类型，可多次指定")
+    parser.add_argument("--nprobe", action="append", type=int, help="IVF 的 nprobe，可多次指定")
+    parser.add_argument("--ef-search", action="append", type=int, help="HNSW 的 efSearch，可多次指定")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--synthetic", type=int, default=0, help="使用指定数量的随机向量")
+    args = parser.parse_args()
+
+    factories = args.factory or ["HNSW32", "IVF1024,Flat", "IVF1024,PQ48"]
+    nprobes = args.nprobe or [1, 8, 32, 128]
+    ef_searches = args.ef_search or [16, 64, 256]
+
+    vectors = load_vectors(args)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = (queries + 0.05 * rng.standard_normal(queries.shape)).astype('float32')
+
+    baseline, build_time = build_store("Flat", vectors)
+    ground_truth, flat_latency = timed_search(baseline, queries, args.top_k)
+
+    print(f"\n{'索引类型':<20}{'参数':<16}{'recall@' + str(args.top_k):>12}{'延迟(ms/查询)':>16}{'构建(s)':>10}")
+    print(f"{'Flat':<20}{'-':<16}{1.0:>12.3f}{flat_latency:>16.3f}{build_time:>10.1f}")
+
+    for factory in factories:
+        store, build_time = build_store(factory, vectors)
+        inner = store._inner_index()
+        if isinstance(inner, faiss.IndexFlat) and factory != "Flat":
+            print(f"{factory:<20}向量数不足以训练该索引，跳过")
+            continue
+
+        if isinstance(inner, faiss.IndexHNSW):
+            settings = [("efSearch", {"ef_search": ef}) for ef in ef_searches]
+        else:
+            try:
+                faiss.extract_index_ivf(inner)
+                settings = [("nprobe", {"nprobe": n}) for n in nprobes]
+            except RuntimeError:
+                settings = [("-", {})]
+
+        for name, kwargs in settings:
+            ids, latency = timed_search(store, queries, args.top_k, **kwargs)
+            label = f"{name}={list(kwargs.values())[0]}" if kwargs else "-"
+            print(f"{factory:<20}{label:<16}{recall_at_k(ids, ground_truth):>12.3f}{latency:>16.3f}{build_time:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
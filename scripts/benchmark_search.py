@@ -0,0 +1,97 @@
+"""
+测量 VectorStore.search / search_batch 在 FAISS 检索之外的额外开销
+
+使用随机向量和内存映射的文本块存储构建 Flat 索引，对每个 top_k 分别测量：
+    faiss     直接调用 index.search 的耗时
+    search    VectorStore.search_batch 的耗时（含阈值过滤和构建 SearchHit），逐条为每个查询单独调用，整批为一次调用
+    构建结果   只把已有的 FAISS 结果转换为 SearchHit 的耗时，不受 FAISS 耗时波动影响
+均折算为每次查询的耗时，报告额外开销（search - faiss）及其占 FAISS 检索耗时的比例。
+阈值设为 -1，确保每个命中都会构建结果。
+
+用法:
+    python scripts/benchmark_search.py
+    python scripts/benchmark_search.py --vectors 200000 --top-k 10 --top-k 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.chunk_store import ChunkStore
+from app.config import VECTOR_DIM
+from app.vector_store import VectorStore
+
+
+def build_store(count, directory):
+    """构建包含 count 条随机向量的 Flat 索引，文本块存储写入 directory 后以内存映射方式打开"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((count, VECTOR_DIM)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    store = VectorStore(VECTOR_DIM, index_factory="Flat")
+    store.index = store._new_index()
+    store.index.add_with_ids(vectors, np.arange(count, dtype='int64'))
+
+    chunks = {
+        i: {
+            "content": f"第 {i} 段测试文本。" * 20,
+            "metadata": {"file_name": f"doc{i // 500}.pdf", "page_num": i % 500 + 1, "chunk_num": 1},
+        }
+        for i in range(count)
+    }
+    path = os.path.join(directory, "chunks.json")
+    ChunkStore.from_chunks(chunks, count).save(path)
+    store.text_chunks = ChunkStore.load(path)
+    return store, rng
+
+
+def per_query_us(fn, queries):
+    start = time.perf_counter()
+    for query in queries:
+        fn(query)
+    return (time.perf_counter() - start) * 1e6 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="VectorStore.search / search_batch 额外开销测量")
+    parser.add_argument("--vectors", type=int, default=50000, help="索引中的向量数")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", action="append", type=int, help="返回结果数，可多次指定")
+    parser.add_argument("--repeat", type=int, default=3, help="每项测量重复次数，取最快一次")
+    args = parser.parse_args()
+
+    top_ks = args.top_k or [10, 20, 50, 100]
+
+    with tempfile.TemporaryDirectory() as directory:
+        store, rng = build_store(args.vectors, directory)
+        queries = rng.standard_normal((args.queries, VECTOR_DIM)).astype('float32')
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries[:, None, :]
+
+        print(f"\n{args.vectors} 条向量，{args.queries} 次查询")
+        print(f"{'方式':<6}{'top_k':<8}{'faiss(us)':>12}{'search(us)':>12}{'额外开销(us)':>14}{'占比':>10}"
+              f"{'构建结果(us)':>14}")
+        for mode in ("逐条", "整批"):
+            # 逐条：每个查询单独检索（与 search() 相同）；整批：所有查询一次检索
+            batches = queries if mode == "逐条" else [queries[:, 0, :]]
+            for top_k in top_ks:
+                raw = min(per_query_us(lambda q: store.index.search(q, top_k), batches) for _ in range(args.repeat))
+                full = min(per_query_us(lambda q: store.search_batch(q, top_k=top_k, threshold=-1), batches)
+                           for _ in range(args.repeat))
+                results = [store.index.search(q, top_k) for q in batches]
+                build = min(per_query_us(lambda r: store._build_results(*r, -1), results)
+                            for _ in range(args.repeat))
+                scale = len(batches) / args.queries
+                raw, full, build = raw * scale, full * scale, build * scale
+                overhead = full - raw
+                print(f"{mode:<6}{top_k:<8}{raw:>12.1f}{full:>12.1f}{overhead:>14.1f}{overhead / raw:>10.1%}"
+                      f"{build:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
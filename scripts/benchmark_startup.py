@@ -0,0 +1,82 @@
+"""
+测量应用启动耗时和不同推理后端的嵌入性能
+
+每项测量都在新的子进程中进行（冷启动），报告：
+    导入应用      import app.main 的耗时，即服务开始监听前需要等待的时间（模型延迟加载）
+    加载模型      get_model() 的耗时
+    首次编码      加载后第一次 encode 的耗时
+    吞吐          预热后批量编码的速度（条/秒）
+"导入时加载"一列是导入应用与加载模型之和，相当于此前在导入时就加载模型的启动耗时。
+
+用法:
+    python scripts/benchmark_startup.py
+    python scripts/benchmark_startup.py --backend torch --backend onnx-int8 --texts 512
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD_CODE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+result = {{}}
+try:
+    start = time.perf_counter()
+    import app.main
+    result["import_app"] = time.perf_counter() - start
+
+    from app.embedder import get_model, model_info
+    start = time.perf_counter()
+    model = get_model()
+    result["load_model"] = time.perf_counter() - start
+    result["backend"] = model_info()["backend"]
+
+    start = time.perf_counter()
+    model.encode(["预热"], show_progress_bar=False)
+    result["first_encode"] = time.perf_counter() - start
+
+    texts = ["第 %d 段测试文本，用于测量嵌入模型在 CPU 上的编码速度。" % i for i in range({texts})]
+    start = time.perf_counter()
+    model.encode(texts, show_progress_bar=False)
+    result["throughput"] = len(texts) / (time.perf_counter() - start)
+except Exception as e:
+    result["error"] = str(e)
+print(json.dumps(result))
+"""
+
+
+def measure(backend, texts):
+    env = dict(os.environ, EMBEDDING_BACKEND=backend, EMBEDDING_WARMUP="0")
+    output = subprocess.run([sys.executable, "-c", CHILD_CODE.format(root=ROOT, texts=texts)],
+                            env=env, capture_output=True, text=True, cwd=ROOT).stdout
+    lines = [line for line in output.splitlines() if line.startswith("{")]
+    return json.loads(lines[-1]) if lines else {"error": "子进程没有输出结果"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="应用启动与嵌入后端性能对比")
+    parser.add_argument("--backend", action="append", help="推理后端（torch / onnx / onnx-int8），可多次指定")
+    parser.add_argument("--texts", type=int, default=256, help="测量吞吐时编码的文本数")
+    args = parser.parse_args()
+
+    backends = args.backend or ["torch", "onnx", "onnx-int8"]
+
+    print(f"\n{'后端':<12}{'导入应用(s)':>12}{'加载模型(s)':>12}{'导入时加载(s)':>14}{'首次编码(s)':>12}{'吞吐(条/s)':>12}")
+    for backend in backends:
+        result = measure(backend, args.texts)
+        if "error" in result:
+            imported = f"{result['import_app']:>12.2f}" if "import_app" in result else ""
+            print(f"{backend:<12}{imported}  失败: {result['error']}")
+            continue
+        label = backend if result["backend"] == backend else f"{backend}->{result['backend']}"
+        eager = result["import_app"] + result["load_model"]
+        print(f"{label:<12}{result['import_app']:>12.2f}{result['load_model']:>12.2f}{eager:>14.2f}"
+              f"{result['first_encode']:>12.3f}{result['throughput']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
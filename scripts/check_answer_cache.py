@@ -0,0 +1,114 @@
+"""
+检查文档内容变化并重建索引后，语义回答缓存不会返回旧内容的回答
+
+流程：入库一个 PDF，检索并把回答存入语义回答缓存，确认同一问题命中；
+然后修改 PDF 的文字（页数不变）并重建索引（--force 时全部重新入库），与 /ask 相同地调用 evict_stale()
+后重新检索，检查新检索结果的文本块 ID 没有沿用旧的 ID，且缓存未命中。
+嵌入使用由文本生成的随机向量，不加载嵌入模型。
+
+用法:
+    python scripts/check_answer_cache.py
+    python scripts/check_answer_cache.py --pages 10
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+
+import fitz
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app.ingest as ingest
+from app.answer_cache import SemanticAnswerCache
+from app.config import VECTOR_DIM
+from app.ingest import ingest_file, rebuild_index
+from app.vector_store import CollectionPaths, CollectionView, ResidentVectorStore
+
+COLLECTION = "check"
+FILE_NAME = "doc.pdf"
+
+
+def make_pdf(path, pages, version):
+    doc = fitz.open()
+    for page in range(pages):
+        doc.new_page().insert_text((50, 72), f"Version {version} page {page + 1} warranty period {version * 12} months")
+    doc.save(path)
+
+
+def fake_embed(texts, use_cache=True, cache_path=None):
+    vectors = np.array([np.random.default_rng(int(hashlib.md5(text.encode()).hexdigest()[:8], 16))
+                        .standard_normal(VECTOR_DIM) for text in texts], dtype='float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def ask(resident, cache, question_embedding):
+    """与 /ask 相同：检索、清理失效条目、按检索结果查找缓存，返回 (文本块键, 缓存的回答)"""
+    view = CollectionView({COLLECTION: resident.current()})
+    hits = view.search_batch(question_embedding.reshape(1, -1), top_k=5, threshold=-1)[0]
+    cache.evict_stale(view)
+    chunk_ids = cache.chunk_key(hits)
+    return chunk_ids, cache.lookup(question_embedding, chunk_ids, None)
+
+
+def run_case(directory, args, force):
+    errors = []
+    paths = CollectionPaths(COLLECTION, directory)
+    paths.makedirs()
+    resident = ResidentVectorStore(VECTOR_DIM, paths)
+    resident.load()
+    file_path = os.path.join(paths.pdf_dir, FILE_NAME)
+    make_pdf(file_path, args.pages, 1)
+    ingest_file(resident, file_path)
+
+    cache = SemanticAnswerCache(threshold=0.95)
+    question = fake_embed(["保修期多长？"])[0]
+    old_ids, answer = ask(resident, cache, question)
+    cache.store(question, old_ids, None, "保修期 12 个月")
+    _, answer = ask(resident, cache, question)
+    if answer is None:
+        errors.append("修改前同一问题没有命中缓存")
+
+    # 修改文档内容后重建索引
+    make_pdf(file_path, args.pages, 2)
+    rebuild_index(resident, force=force)
+    new_ids, answer = ask(resident, cache, question)
+    reused = {chunk_id for _, chunk_id in new_ids} & {chunk_id for _, chunk_id in old_ids}
+    if reused:
+        errors.append(f"新文本块沿用了旧的 ID：{sorted(reused)}")
+    if answer is not None:
+        errors.append(f"文档内容已变化，仍然返回了旧的回答：{answer}")
+
+    # 重新加载后继续编号
+    reloaded = ResidentVectorStore(VECTOR_DIM, paths)
+    reloaded.load()
+    if reloaded.current().text_chunks.next_id != resident.current().text_chunks.next_id:
+        errors.append("重新加载后 chunk_id 的编号与重建后不一致")
+    print(f"{'全部' if force else '增量'}重建：{'通过' if not errors else '失败'}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查重建索引后语义回答缓存的失效")
+    parser.add_argument("--pages", type=int, default=4, help="测试 PDF 的页数（每页一个文本块）")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    ingest.embed_texts = fake_embed
+    errors = []
+    for force in (True, False):
+        with tempfile.TemporaryDirectory() as directory:
+            errors += run_case(directory, args, force)
+    if errors:
+        print(f"\n发现 {len(errors)} 个问题：")
+        for error in errors:
+            print(f"  {error}")
+        sys.exit(1)
+    print("未发现问题")
+
+
+if __name__ == "__main__":
+    main()
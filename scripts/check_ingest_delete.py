@@ -0,0 +1,150 @@
+"""
+检查流式入库过程中删除文件后索引中不会残留该文件的内容
+
+与 /upload 相同地通过 JobManager 提交 ingest_file，在嵌入第 N 批文本块时按 DELETE /files 的方式删除 PDF
+（取消未开始的任务、删除文件、remove_file() 移除索引内容），等待任务结束后检查：
+    - 任务状态为 cancelled
+    - 内存中的当前版本和从磁盘重新加载的版本都没有该文件的文本块和文档清单条目
+    - 没有残留的入库检查点
+    - 删除后重新上传同一文件可以正常入库
+嵌入使用由文本生成的随机向量，不加载嵌入模型。
+
+用法:
+    python scripts/check_ingest_delete.py
+    python scripts/check_ingest_delete.py --pages 40 --checkpoint-chunks 4
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import fitz
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app.ingest as ingest
+from app.config import VECTOR_DIM
+from app.ingest import ingest_file, remove_file, _load_checkpoints
+from app.jobs import JobManager, CANCELLED, SUCCEEDED, FAILED
+from app.vector_store import CollectionPaths, ResidentVectorStore
+
+COLLECTION = "check"
+FILE_NAME = "doc.pdf"
+
+
+def make_pdf(path, pages):
+    doc = fitz.open()
+    for page in range(pages):
+        doc.new_page().insert_text((50, 72), f"Page {page + 1} part number PN-{page:05d} battery capacity {page * 10} mAh")
+    doc.save(path)
+
+
+def fake_embed(texts, use_cache=True, cache_path=None):
+    vectors = np.array([np.random.default_rng(int(hashlib.md5(text.encode()).hexdigest()[:8], 16))
+                        .standard_normal(VECTOR_DIM) for text in texts], dtype='float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def wait(job_manager, job_id):
+    while True:
+        job = job_manager.get(job_id)
+        if job["status"] in (SUCCEEDED, FAILED, CANCELLED):
+            return job
+        time.sleep(0.05)
+
+
+def check_absent(store, label):
+    errors = []
+    if store.text_chunks.ids_for_document(FILE_NAME):
+        errors.append(f"{label}：残留 {len(store.text_chunks.ids_for_document(FILE_NAME))} 个文本块")
+    if FILE_NAME in store.manifest:
+        errors.append(f"{label}：残留文档清单条目")
+    ntotal = store.ntotal
+    if ntotal != len(store.text_chunks):
+        errors.append(f"{label}：向量数 {ntotal} 与文本块数 {len(store.text_chunks)} 不一致")
+    return errors
+
+
+def run_case(directory, args, delete_at):
+    """在第 delete_at 次嵌入时删除文件，返回发现的问题列表"""
+    paths = CollectionPaths(COLLECTION, directory)
+    resident = ResidentVectorStore(VECTOR_DIM, paths)
+    resident.load()
+    paths.makedirs()
+    file_path = os.path.join(paths.pdf_dir, FILE_NAME)
+    make_pdf(file_path, args.pages)
+    job_manager = JobManager(os.path.join(directory, "jobs"), threads=1, processes=1)
+    job_manager.start()
+
+    calls = []
+
+    def embed_and_delete(texts, use_cache=True, cache_path=None):
+        calls.append(len(texts))
+        if len(calls) == delete_at:
+            # 与 DELETE /files 相同的步骤
+            for job in job_manager.unfinished("upload", file=FILE_NAME, collection=COLLECTION):
+                job_manager.cancel(job["id"], "文件已被删除")
+            os.remove(file_path)
+            remove_file(resident, FILE_NAME)
+        return fake_embed(texts)
+
+    ingest.embed_texts = embed_and_delete
+    try:
+        job = job_manager.submit("upload", ingest_file, resident, file_path,
+                                 detail={"file": FILE_NAME, "collection": COLLECTION})
+        job = wait(job_manager, job["id"])
+    finally:
+        ingest.embed_texts = fake_embed
+
+    errors = []
+    if job["status"] != CANCELLED:
+        errors.append(f"任务状态为 {job['status']}（{job['error']}），应为 cancelled")
+    errors += check_absent(resident.current(), "内存中的版本")
+    reloaded = ResidentVectorStore(VECTOR_DIM, paths)
+    reloaded.load()
+    errors += check_absent(reloaded.current(), "重新加载的版本")
+    if FILE_NAME in _load_checkpoints(paths):
+        errors.append("残留入库检查点")
+
+    # 删除后重新上传同一文件
+    make_pdf(file_path, args.pages)
+    job = wait(job_manager, job_manager.submit("upload", ingest_file, resident, file_path,
+                                               detail={"file": FILE_NAME, "collection": COLLECTION})["id"])
+    chunks = len(resident.current().text_chunks.ids_for_document(FILE_NAME))
+    if job["status"] != SUCCEEDED or chunks == 0 or FILE_NAME not in resident.current().manifest:
+        errors.append(f"重新上传后入库异常：状态 {job['status']}，{chunks} 个文本块")
+    job_manager.shutdown()
+    print(f"第 {delete_at} 批（共 {len(calls)} 批）时删除：{'通过' if not errors else '失败'}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查入库过程中删除文件的一致性")
+    parser.add_argument("--pages", type=int, default=30, help="测试 PDF 的页数（每页一个文本块）")
+    parser.add_argument("--batch-size", type=int, default=2, help="每批嵌入的文本块数")
+    parser.add_argument("--checkpoint-chunks", type=int, default=6, help="每入库多少个文本块写入一次索引")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    ingest.EMBED_BATCH_SIZE = args.batch_size
+    ingest.INGEST_CHECKPOINT_CHUNKS = args.checkpoint_chunks
+    batches = -(-args.pages // args.batch_size)
+    errors = []
+    # 第一次写入索引之前、之后，以及最后一批时删除
+    for delete_at in sorted({1, args.checkpoint_chunks // args.batch_size + 1, batches // 2, batches}):
+        with tempfile.TemporaryDirectory() as directory:
+            errors += run_case(directory, args, delete_at)
+    if errors:
+        print(f"\n发现 {len(errors)} 个问题：")
+        for error in errors:
+            print(f"  {error}")
+        sys.exit(1)
+    print("未发现残留")
+
+
+if __name__ == "__main__":
+    main()
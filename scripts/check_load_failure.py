@@ -0,0 +1,133 @@
+"""
+检查向量存储加载失败时不会用空存储覆盖磁盘上的数据
+
+入库若干文本块并保存快照后，把快照中的索引文件改为损坏的内容，再重新加载集合，检查：
+    - 加载后 load_error 不为空，检索返回空结果而不是报错
+    - 添加、删除文本块以及保存快照、压缩操作日志都会报错
+    - 上述操作之后磁盘上的快照、索引和操作日志文件都没有变化
+    - 恢复索引文件后重新加载，原有的文本块都在，并且可以正常写入
+嵌入使用随机向量，不加载嵌入模型。
+
+用法:
+    python scripts/check_load_failure.py
+    python scripts/check_load_failure.py --chunks 500
+"""
+import argparse
+import hashlib
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import VECTOR_DIM
+from app.vector_store import CollectionPaths, ResidentVectorStore, _read_snapshot
+
+COLLECTION = "check"
+
+
+def random_vectors(rng, count):
+    vectors = rng.standard_normal((count, VECTOR_DIM)).astype('float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def texts(count, file_name):
+    return [{"content": f"{file_name} 第 {i} 段", "metadata": {"file_name": file_name, "page_num": i + 1}}
+            for i in range(count)]
+
+
+def disk_state(directory):
+    """集合目录中各文件的内容摘要"""
+    state = {}
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            if name.endswith('.lock'):
+                continue
+            with open(path, 'rb') as f:
+                state[os.path.relpath(path, directory)] = hashlib.md5(f.read()).hexdigest()
+    return state
+
+
+def expect_error(errors, label, fn):
+    try:
+        fn()
+        errors.append(f"{label}：没有报错")
+    except RuntimeError:
+        pass
+
+
+def write(resident, rng, file_name, count):
+    with resident.write_lock:
+        store = resident.current().copy()
+        store.add(random_vectors(rng, count), texts(count, file_name), file_name=file_name)
+        resident.publish(store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查向量存储加载失败时磁盘上的数据保持不变")
+    parser.add_argument("--chunks", type=int, default=200, help="入库的文本块数")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    rng = np.random.default_rng(0)
+    errors = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = CollectionPaths(COLLECTION, directory)
+        paths.makedirs()
+        resident = ResidentVectorStore(VECTOR_DIM, paths)
+        resident.load()
+        write(resident, rng, "a.pdf", args.chunks)
+        resident.compact()
+        # 快照之后再写入一条操作日志
+        write(resident, rng, "b.pdf", 10)
+
+        index_path = os.path.join(os.path.dirname(paths.index_path), _read_snapshot(paths)["index"])
+        backup = index_path + ".bak"
+        shutil.copyfile(index_path, backup)
+        with open(index_path, 'r+b') as f:
+            f.truncate(os.path.getsize(index_path) // 2)
+        before = disk_state(directory)
+
+        broken = ResidentVectorStore(VECTOR_DIM, paths)
+        broken.load()
+        store = broken.current()
+        if store.load_error is None:
+            errors.append("索引文件损坏时 load_error 为空")
+        if any(store.search_batch(random_vectors(rng, 1), top_k=5, threshold=-1)):
+            errors.append("加载失败时检索返回了结果")
+
+        expect_error(errors, "加载失败后添加文本块",
+                     lambda: store.copy().add(random_vectors(rng, 1), texts(1, "c.pdf"), file_name="c.pdf"))
+        expect_error(errors, "加载失败后删除文档", lambda: store.copy().remove_document("a.pdf"))
+        expect_error(errors, "加载失败后保存快照", lambda: store.copy().save())
+        expect_error(errors, "加载失败后压缩操作日志", broken.compact)
+        if disk_state(directory) != before:
+            errors.append("加载失败后磁盘上的文件被修改")
+
+        os.replace(backup, index_path)
+        broken.load()
+        store = broken.current()
+        if store.load_error is not None:
+            errors.append(f"恢复索引文件后仍然加载失败：{store.load_error}")
+        counts = {name: len(store.text_chunks.ids_for_document(name)) for name in ("a.pdf", "b.pdf")}
+        if counts != {"a.pdf": args.chunks, "b.pdf": 10} or store.ntotal != args.chunks + 10:
+            errors.append(f"恢复后文本块数不正确：{counts}，向量数 {store.ntotal}")
+        try:
+            write(broken, rng, "c.pdf", 1)
+        except RuntimeError as e:
+            errors.append(f"恢复后不能写入：{e}")
+    if errors:
+        print(f"发现 {len(errors)} 个问题：")
+        for error in errors:
+            print(f"  {error}")
+        sys.exit(1)
+    print("未发现问题")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+检查重建索引时部分文件处理失败不会丢失内容，也不会被记为已完整入库
+
+流程：入库 a.pdf、b.pdf 两个文件后修改两者的内容，重建索引时让 b.pdf 新内容的嵌入失败，检查：
+    - a.pdf 已更新为新内容，b.pdf 仍是旧内容（旧文本块没有被删除，也没有残留部分新文本块）
+    - b.pdf 的文档清单条目仍是旧的，结果的 failed_files 列出 b.pdf
+    - 嵌入恢复后再次增量重建，b.pdf 会被重新入库（没有因清单而被跳过）
+    - 全部重新入库（--force）时有文件失败，任务失败且现有索引保持不变
+    - b.pdf 再次修改后某一页的解析失败，同样保留旧内容，不会只入库解析成功的页面
+嵌入使用由文本生成的随机向量，不加载嵌入模型。
+
+用法:
+    python scripts/check_rebuild_failure.py
+    python scripts/check_rebuild_failure.py --pages 20 --batch-size 3
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import tempfile
+
+import fitz
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app.ingest as ingest
+import app.pdf_loader as pdf_loader
+from app.config import VECTOR_DIM
+from app.ingest import ingest_file, rebuild_index
+from app.vector_store import CollectionPaths, ResidentVectorStore
+
+COLLECTION = "check"
+extract_pdf_shard = pdf_loader.extract_pdf_shard
+
+
+def make_pdf(path, pages, version):
+    doc = fitz.open()
+    for page in range(pages):
+        doc.new_page().insert_text((50, 72), f"{os.path.basename(path)} version {version} page {page + 1}")
+    doc.save(path)
+
+
+def fake_embed(texts, use_cache=True, cache_path=None):
+    vectors = np.array([np.random.default_rng(int(hashlib.md5(text.encode()).hexdigest()[:8], 16))
+                        .standard_normal(VECTOR_DIM) for text in texts], dtype='float32')
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def failing_embed(texts, use_cache=True, cache_path=None):
+    """b.pdf 新内容所在的批次嵌入失败"""
+    if any(text.startswith("b.pdf version 2") for text in texts):
+        raise RuntimeError("模拟嵌入失败")
+    return fake_embed(texts)
+
+
+def failing_shard(pages):
+    """返回替代 extract_pdf_shard 的函数：b.pdf 第 3 版最后一页所在的分片解析失败"""
+    def extract(file_path, start, end):
+        if os.path.basename(file_path) == "b.pdf" and start < pages <= end:
+            with fitz.open(file_path) as doc:
+                if "version 3" in doc[pages - 1].get_text():
+                    raise RuntimeError("模拟解析失败")
+        return extract_pdf_shard(file_path, start, end)
+    return extract
+
+
+def versions(store, file_name):
+    """文件在存储中各文本块的内容版本"""
+    chunk_ids = store.text_chunks.ids_for_document(file_name)
+    return sorted({chunk["content"].split()[2] for chunk in store.text_chunks.get_many(chunk_ids)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查重建索引时文件处理失败的一致性")
+    parser.add_argument("--pages", type=int, default=10, help="每个测试 PDF 的页数（每页一个文本块）")
+    parser.add_argument("--batch-size", type=int, default=4, help="每批嵌入的文本块数")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    ingest.EMBED_BATCH_SIZE = args.batch_size
+    ingest.embed_texts = fake_embed
+    errors = []
+    with tempfile.TemporaryDirectory() as directory:
+        paths = CollectionPaths(COLLECTION, directory)
+        paths.makedirs()
+        resident = ResidentVectorStore(VECTOR_DIM, paths)
+        resident.load()
+        for name in ("a.pdf", "b.pdf"):
+            make_pdf(os.path.join(paths.pdf_dir, name), args.pages, 1)
+            ingest_file(resident, os.path.join(paths.pdf_dir, name))
+        old_entry = dict(resident.current().manifest["b.pdf"])
+
+        for name in ("a.pdf", "b.pdf"):
+            make_pdf(os.path.join(paths.pdf_dir, name), args.pages, 2)
+
+        # 全部重新入库：有文件失败时不替换现有索引
+        ingest.embed_texts = failing_embed
+        generation = resident.current().generation
+        try:
+            rebuild_index(resident, force=True)
+            errors.append("全部重新入库：有文件失败时没有报错")
+        except RuntimeError:
+            pass
+        if resident.current().generation != generation:
+            errors.append("全部重新入库：有文件失败时仍然替换了现有索引")
+
+        # 增量重建：b.pdf 失败
+        result = rebuild_index(resident)
+        store = resident.current()
+        if versions(store, "a.pdf") != ["2"]:
+            errors.append(f"a.pdf 应已更新为新内容，实际版本 {versions(store, 'a.pdf')}")
+        if versions(store, "b.pdf") != ["1"] or len(store.text_chunks.ids_for_document("b.pdf")) != args.pages:
+            errors.append(f"b.pdf 应保留完整的旧内容，实际版本 {versions(store, 'b.pdf')}，"
+                          f"{len(store.text_chunks.ids_for_document('b.pdf'))} 个文本块")
+        if store.manifest.get("b.pdf", {}).get("sha256") != old_entry["sha256"]:
+            errors.append("b.pdf 的文档清单条目被更新为新内容，之后的重建会跳过它")
+        if [item["name"] for item in result.get("failed_files", [])] != ["b.pdf"]:
+            errors.append(f"结果没有列出失败的文件：{result}")
+        if len(store.text_chunks) != store.ntotal:
+            errors.append("文本块数与向量数不一致")
+
+        # 恢复后再次增量重建
+        ingest.embed_texts = fake_embed
+        result = rebuild_index(resident)
+        store = resident.current()
+        if versions(store, "b.pdf") != ["2"] or result.get("failed_files"):
+            errors.append(f"恢复后再次重建，b.pdf 没有更新：版本 {versions(store, 'b.pdf')}，{result}")
+
+        # 某一页解析失败
+        make_pdf(os.path.join(paths.pdf_dir, "b.pdf"), args.pages, 3)
+        pdf_loader.extract_pdf_shard = failing_shard(args.pages)
+        try:
+            result = rebuild_index(resident)
+        finally:
+            pdf_loader.extract_pdf_shard = extract_pdf_shard
+        store = resident.current()
+        if versions(store, "b.pdf") != ["2"] or len(store.text_chunks.ids_for_document("b.pdf")) != args.pages:
+            errors.append(f"解析失败后 b.pdf 应保留完整的旧内容，实际版本 {versions(store, 'b.pdf')}，"
+                          f"{len(store.text_chunks.ids_for_document('b.pdf'))} 个文本块")
+        if [item["name"] for item in result.get("failed_files", [])] != ["b.pdf"]:
+            errors.append(f"解析失败后结果没有列出失败的文件：{result}")
+        make_pdf(os.path.join(paths.pdf_dir, "b.pdf"), args.pages, 2)
+        rebuild_index(resident)
+
+        # 重新加载后与内存中一致
+        reloaded = ResidentVectorStore(VECTOR_DIM, paths)
+        reloaded.load()
+        for name in ("a.pdf", "b.pdf"):
+            if versions(reloaded.current(), name) != ["2"]:
+                errors.append(f"重新加载后 {name} 的内容不正确：{versions(reloaded.current(), name)}")
+    if errors:
+        print(f"发现 {len(errors)} 个问题：")
+        for error in errors:
+            print(f"  {error}")
+        sys.exit(1)
+    print("未发现问题")
+
+
+if __name__ == "__main__":
+    main()
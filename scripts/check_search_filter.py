@@ -0,0 +1,112 @@
+"""
+检查按文件过滤的检索在各种索引类型上都返回过滤范围内真正最相似的文本块
+
+用随机向量构建索引（每个文件 --chunks-per-file 个文本块），对若干文件分别做过滤检索，
+与在该文件的向量中暴力计算的结果比较：返回的数量应为 min(top_k, 文件的文本块数)，且 chunk_id 相同。
+IVF 索引只访问 nprobe 个聚类，过滤范围小的查询必须走精确计算，否则小文档的结果会缺失。
+最后 --delta 个向量在合并后另行添加，部分已合并的文本块删除后重新添加，检索需同时覆盖增量索引并跳过删除标记；
+Flat 索引另外检查不过滤的检索与暴力计算一致。
+分别检查新建的索引、copy() 得到的副本以及保存后重新加载的索引。
+
+用法:
+    python scripts/check_search_filter.py
+    python scripts/check_search_filter.py --vectors 50000 --index IVF256,Flat --nprobe 8
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.config import VECTOR_DIM
+from app.vector_store import CollectionPaths, SearchFilter, VectorStore
+
+
+def build_store(index_factory, count, chunks_per_file, delta, directory):
+    """返回存储、全部向量、每个向量对应的 chunk_id 和随机数生成器"""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((count, VECTOR_DIM)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    texts = [{"content": f"文本 {i}", "metadata": {"file_name": f"doc{i // chunks_per_file}.pdf", "page_num": 1}}
+             for i in range(count)]
+    store = VectorStore(VECTOR_DIM, index_factory=index_factory, metric="ip",
+                        paths=CollectionPaths("check", directory))
+    base = count - delta
+    store.add(vectors[:base], texts[:base])
+    store._merge_delta()
+    chunk_ids = np.arange(count)
+    if delta:
+        store = store.copy()
+        store.add(vectors[base:], texts[base:])
+        moved = rng.choice(base, size=min(delta // 10, base // 20), replace=False)
+        store.remove_chunks(moved.tolist())
+        chunk_ids[moved] = store.add(vectors[moved], [texts[i] for i in moved.tolist()])
+    return store, vectors, chunk_ids, rng
+
+
+def check(store, label, vectors, chunk_ids, queries, args):
+    """返回发现的问题列表"""
+    errors = []
+    if store.ntotal != args.vectors:
+        errors.append(f"{label}：向量数 {store.ntotal}，应为 {args.vectors}")
+    if store.describe_index()["type"] == "IndexFlat":
+        hits = store.search_batch(queries, top_k=args.top_k, threshold=-1)
+        expected = chunk_ids[np.argsort(-(queries @ vectors.T), axis=1)[:, :args.top_k]]
+        if [[hit.chunk_id for hit in query_hits] for query_hits in hits] != expected.tolist():
+            errors.append(f"{label} 不过滤：结果与暴力计算不一致")
+    files = range(0, args.vectors // args.chunks_per_file, max(args.vectors // args.chunks_per_file // 10, 1))
+    for doc in files:
+        file_name = f"doc{doc}.pdf"
+        scope = np.arange(doc * args.chunks_per_file, min((doc + 1) * args.chunks_per_file, args.vectors))
+        hits = store.search_batch(queries, top_k=args.top_k, threshold=-1, nprobe=args.nprobe,
+                                  search_filter=SearchFilter(file_names=[file_name]))
+        expected = np.argsort(-(queries @ vectors[scope].T), axis=1)[:, :args.top_k]
+        for query_hits, rows in zip(hits, expected):
+            got = [hit.chunk_id for hit in query_hits]
+            if got != chunk_ids[scope[rows]].tolist():
+                errors.append(f"{label} {file_name}：返回 {len(got)} 条，应为 {len(rows)} 条，"
+                              f"缺少 {len(set(chunk_ids[scope[rows]].tolist()) - set(got))} 条最相似的文本块")
+                break
+    print(f"{label}：{'通过' if not errors else '失败'}")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查过滤检索的结果是否完整")
+    parser.add_argument("--vectors", type=int, default=20000, help="索引中的向量数")
+    parser.add_argument("--chunks-per-file", type=int, default=40, help="每个文件的文本块数")
+    parser.add_argument("--delta", type=int, default=2000, help="合并后另行添加的向量数（留在增量索引中）")
+    parser.add_argument("--index", action="append", help="索引类型（index_factory 字符串），可多次指定")
+    parser.add_argument("--nprobe", type=int, default=4)
+    parser.add_argument("--top-k", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    errors = []
+    for index_factory in args.index or ["Flat", "IVF128,Flat", "HNSW32"]:
+        with tempfile.TemporaryDirectory() as directory:
+            store, vectors, chunk_ids, rng = build_store(index_factory, args.vectors, args.chunks_per_file,
+                                                         args.delta, directory)
+            queries = rng.standard_normal((args.queries, VECTOR_DIM)).astype('float32')
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+            errors += check(store, f"{index_factory} 新建", vectors, chunk_ids, queries, args)
+            errors += check(store.copy(), f"{index_factory} 副本", vectors, chunk_ids, queries, args)
+            store.save()
+            reloaded = VectorStore(VECTOR_DIM, index_factory=index_factory, metric="ip", paths=store.paths)
+            reloaded.load()
+            errors += check(reloaded, f"{index_factory} 重新加载", vectors, chunk_ids, queries, args)
+    if errors:
+        print(f"\n发现 {len(errors)} 个问题：")
+        for error in errors:
+            print(f"  {error}")
+        sys.exit(1)
+    print("未发现问题")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+本地模拟的 DeepSeek 聊天补全服务，用于在没有 API 密钥或网络的环境下测试问答流程
+
+用法:
+    uvicorn scripts.mock_deepseek:app --port 9000
+    export DEEPSEEK_API_URL=http://127.0.0.1:9000/v1/chat/completions
+    export DEEPSEEK_API_KEY=mock
+
+可通过环境变量模拟慢响应和故障:
+    MOCK_LATENCY    每次响应前的等待秒数（默认 0）
+    MOCK_FAIL_RATE  以该概率返回 503 或 429（默认 0）
+    MOCK_TOKEN_DELAY 流式响应中每个片段之间的等待秒数（默认 0.05）
+"""
+import asyncio
+import json
+import os
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MOCK_LATENCY = float(os.environ.get("MOCK_LATENCY", "0"))
+MOCK_FAIL_RATE = float(os.environ.get("MOCK_FAIL_RATE", "0"))
+MOCK_TOKEN_DELAY = float(os.environ.get("MOCK_TOKEN_DELAY", "0.05"))
+
+app = FastAPI(title="Mock DeepSeek")
+
+
+def mock_answer(payload):
+    """回显问题，便于在测试中核对"""
+    prompt = payload["messages"][-1]["content"]
+    question = prompt.rsplit("问题：", 1)[-1].split("\n", 1)[0].strip()
+    return f"模拟回答：{question}"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    payload = await request.json()
+    if MOCK_LATENCY:
+        await asyncio.sleep(MOCK_LATENCY)
+    if random.random() < MOCK_FAIL_RATE:
+        status = random.choice([429, 503])
+        return JSONResponse({"error": {"message": "mock failure"}}, status_code=status,
+                            headers={"Retry-After": "0"} if status == 429 else None)
+
+    if payload.get("stream"):
+        return StreamingResponse(stream_chunks(payload), media_type="text/event-stream")
+
+    return {
+        "id": "mock-" + str(int(time.time() * 1000)),
+        "object": "chat.completion",
+        "model": payload.get("model", "deepseek-chat"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": mock_answer(payload)},
+            "finish_reason": "stop",
+        }],
+    }
+
+
+async def stream_chunks(payload):
+    """按 DeepSeek 流式格式逐字输出回答"""
+    for char in mock_answer(payload):
+        chunk = {"choices": [{"index": 0, "delta": {"content": char}, "finish_reason": None}]}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(MOCK_TOKEN_DELAY)
+    yield "data: [DONE]\n\n"
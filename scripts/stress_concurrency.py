@@ -0,0 +1,190 @@
+"""
+并发读写压力测试：多个写入方反复上传（替换）和删除文档，同时多个读取方持续检索
+
+写入方与 /upload、DELETE /files 使用相同的写入方式（持有 write_lock，在 current().copy() 上修改后 publish()），
+读取方与 /ask 相同，不加锁地使用 current() 返回的实例检索。每个文档固定有 --chunks 个文本块，读取方检查：
+    - 向量数、文本块数、关键词索引中的文本块数相等
+    - 每个文档在同一版本中要么完整存在、要么完全不存在，且与文档清单一致（不会看到写了一半的版本）
+    - 向量检索和混合检索的结果都属于该版本
+结束后从磁盘重新加载（快照 + 操作日志），检查与内存中的最终版本一致。
+--processes 大于 1 时另外启动写入进程（模拟多个 worker）写入同一目录。
+--compact-bytes 设置得较小时，压测期间会频繁触发后台压缩。
+
+用法:
+    python scripts/stress_concurrency.py
+    python scripts/stress_concurrency.py --writers 4 --readers 8 --seconds 30 --processes 2 --compact-bytes 200000
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app.vector_store as vector_store
+from app.config import VECTOR_DIM
+from app.vector_store import CollectionPaths, ResidentVectorStore
+
+COLLECTION = "stress"
+
+
+def make_document(doc, version, chunks):
+    """生成一个文档的文本块和随机单位向量"""
+    rng = np.random.default_rng(doc * 100003 + version)
+    vectors = rng.standard_normal((chunks, VECTOR_DIM)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    file_name = f"doc{doc}.pdf"
+    texts = [{"content": f"文档 {doc} 第 {version} 版 第 {i} 段 KEY-{doc:04d}",
+              "metadata": {"file_name": file_name, "page_num": i + 1}}
+             for i in range(chunks)]
+    return file_name, vectors, texts
+
+
+def writer_loop(resident, args, deadline, stats, seed):
+    rng = random.Random(seed)
+    version = 0
+    while time.monotonic() < deadline:
+        doc = rng.randrange(args.documents)
+        start = time.perf_counter()
+        with resident.write_lock:
+            store = resident.current().copy()
+            if rng.random() < args.upload_ratio:
+                version += 1
+                file_name, vectors, texts = make_document(doc, seed * 1000000 + version, args.chunks)
+                store.remove_document(file_name)
+                store.add(vectors, texts, file_name=file_name)
+                store.set_manifest_entry(file_name, {"chunks": args.chunks, "writer": seed})
+                kind = "upload"
+            else:
+                if store.remove_document(f"doc{doc}.pdf") == 0:
+                    continue
+                kind = "delete"
+            resident.publish(store)
+        stats[kind] = stats.get(kind, 0) + 1
+        stats.setdefault("latency", []).append(time.perf_counter() - start)
+
+
+def check_store(store, chunks):
+    """检查一个版本的一致性，返回发现的问题列表"""
+    errors = []
+    ntotal = store.ntotal
+    if not ntotal == len(store.text_chunks) == len(store.keywords):
+        errors.append(f"数量不一致：向量 {ntotal}，文本块 {len(store.text_chunks)}，关键词索引 {len(store.keywords)}")
+    names = store.text_chunks.document_names()
+    for name in names | set(store.manifest):
+        count = len(store.text_chunks.ids_for_document(name))
+        if count != chunks:
+            errors.append(f"{name} 只有 {count} 个文本块")
+        if (count > 0) != (name in store.manifest):
+            errors.append(f"{name} 的文本块与文档清单不一致")
+    return errors
+
+
+def reader_loop(resident, args, deadline, stats, errors, seed):
+    rng = np.random.default_rng(seed)
+    while time.monotonic() < deadline:
+        store = resident.current()
+        query = rng.standard_normal((1, VECTOR_DIM)).astype('float32')
+        query /= np.linalg.norm(query)
+        doc = int(rng.integers(args.documents))
+        results = store.search_batch(query, top_k=10, threshold=-1)[0]
+        results += store.hybrid_search_batch(query, [f"KEY-{doc:04d}"], top_k=10, threshold=-1)[0]
+        problems = [f"检索结果 {hit.chunk_id} 不在该版本中" for hit in results if hit.chunk_id not in store.text_chunks]
+        if rng.random() < 0.1:
+            problems += check_store(store, args.chunks)
+        if problems:
+            errors.extend(problems)
+        stats["reads"] = stats.get("reads", 0) + 1
+
+
+def writer_process(directory, args, seconds, seed):
+    logging.disable(logging.WARNING)
+    vector_store.WAL_COMPACT_BYTES = args.compact_bytes
+    resident = ResidentVectorStore(VECTOR_DIM, CollectionPaths(COLLECTION, directory))
+    resident.load()
+    stats = {}
+    writer_loop(resident, args, time.monotonic() + seconds, stats, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="向量存储并发读写压力测试")
+    parser.add_argument("--writers", type=int, default=2, help="写入线程数")
+    parser.add_argument("--readers", type=int, default=4, help="检索线程数")
+    parser.add_argument("--processes", type=int, default=1, help="写入进程数（含当前进程）")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--documents", type=int, default=20, help="文档名的取值范围")
+    parser.add_argument("--chunks", type=int, default=20, help="每个文档的文本块数")
+    parser.add_argument("--upload-ratio", type=float, default=0.7, help="写入中上传（替换）所占的比例，其余为删除")
+    parser.add_argument("--compact-bytes", type=int, default=vector_store.WAL_COMPACT_BYTES,
+                        help="操作日志压缩阈值（字节）")
+    args = parser.parse_args()
+
+    # 每次写入和空索引上的检索都会记录日志，压测期间只保留错误
+    logging.disable(logging.WARNING)
+    vector_store.WAL_COMPACT_BYTES = args.compact_bytes
+    with tempfile.TemporaryDirectory() as directory:
+        resident = ResidentVectorStore(VECTOR_DIM, CollectionPaths(COLLECTION, directory))
+        resident.load()
+
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=writer_process, args=(directory, args, args.seconds, seed))
+                     for seed in range(args.writers + 1, args.writers + args.processes)]
+        for process in processes:
+            process.start()
+
+        deadline = time.monotonic() + args.seconds
+        writer_stats = [{} for _ in range(args.writers)]
+        reader_stats = [{} for _ in range(args.readers)]
+        errors = []
+        threads = [threading.Thread(target=writer_loop, args=(resident, args, deadline, stats, seed))
+                   for seed, stats in enumerate(writer_stats, start=1)]
+        threads += [threading.Thread(target=reader_loop, args=(resident, args, deadline, stats, errors, seed))
+                     for seed, stats in enumerate(reader_stats)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for process in processes:
+            process.join()
+            if process.exitcode != 0:
+                errors.append(f"写入进程退出码 {process.exitcode}")
+
+        # 等待后台压缩结束后，与从磁盘重新加载的版本比较
+        resident.compact()
+        final = resident.current()
+        errors += check_store(final, args.chunks)
+        reloaded = ResidentVectorStore(VECTOR_DIM, CollectionPaths(COLLECTION, directory))
+        reloaded.load()
+        disk = reloaded.current()
+        errors += check_store(disk, args.chunks)
+        if disk.manifest != final.manifest or sorted(id for id, _ in disk.text_chunks.items()) != \
+                sorted(id for id, _ in final.text_chunks.items()):
+            errors.append("重新加载的版本与内存中的最终版本不一致")
+
+        uploads = sum(stats.get("upload", 0) for stats in writer_stats)
+        deletes = sum(stats.get("delete", 0) for stats in writer_stats)
+        latency = [value for stats in writer_stats for value in stats.get("latency", [])]
+        reads = sum(stats.get("reads", 0) for stats in reader_stats)
+        print(f"\n{args.seconds:.0f} 秒，{args.writers} 个写入线程，{args.readers} 个检索线程，{args.processes} 个写入进程")
+        print(f"本进程：上传 {uploads} 次，删除 {deletes} 次，检索 {reads} 次（{reads / args.seconds:.0f}/s）")
+        if latency:
+            print(f"写入耗时 p50 {np.percentile(latency, 50) * 1000:.1f} ms，p95 {np.percentile(latency, 95) * 1000:.1f} ms")
+        print(f"最终版本：{len(final.manifest)} 个文档，{len(final.text_chunks)} 个文本块，"
+              f"快照代号 {final.snapshot_generation}，操作日志序号 {final.wal_seq}")
+        if errors:
+            print(f"\n发现 {len(errors)} 个问题，例如：")
+            for error in list(dict.fromkeys(errors))[:10]:
+                print(f"  {error}")
+            sys.exit(1)
+        print("未发现不一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -136,9 +136,21 @@ document.addEventListener('DOMContentLoaded', function() {
                     body: formData
                 });
                 
-                const result = await response.json();
+                let result = await response.json();
                 
-                if (response.ok) {
+                // 文件在后台建立索引，等待任务完成
+                if (response.ok && result.job_id) {
+                    uploadStatus.textContent = `建立索引中: ${file.name} (${i+1}/${totalFiles})`;
+                    const job = await waitForJob(result.job_id);
+                    if (job.status === 'cancelled') {
+                        // 入库期间文件被删除或重新上传
+                        result = { detail: `已取消: ${job.error || '文件已被删除或替换'}` };
+                    } else if (job.status !== 'succeeded') {
+                        result = { detail: job.error || '建立索引失败' };
+                    }
+                }
+                
+                if (response.ok && !result.detail) {
                     successCount++;
                     const fileInfo = { name: file.name, success: true };
                     uploadedFilesList.push(fileInfo);
@@ -189,6 +201,21 @@ document.addEventListener('DOMContentLoaded', function() {
         }, 1500);
     }
     
+    // 轮询后台任务直到结束（成功、失败或已取消）
+    async function waitForJob(jobId, interval = 1000) {
+        while (true) {
+            const response = await fetch(`/jobs/${jobId}`);
+            if (!response.ok) {
+                throw new Error(`查询任务状态失败: ${response.status}`);
+            }
+            const job = await response.json();
+            if (job.status === 'succeeded' || job.status === 'failed' || job.status === 'cancelled') {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    }
+    
     // 显示进度模态框
     function showProgressModal() {
         uploadProgressModal.classList.add('show');
@@ -335,11 +362,22 @@ document.addEventListener('DOMContentLoaded', function() {
                 throw new Error(error.detail || `重建失败: ${response.status}`);
             }
             
+            // 获取结果；重建在后台执行时等待任务完成
+            let result = await response.json();
+            if (result.job_id) {
+                uploadStatus.textContent = result.message;
+                const job = await waitForJob(result.job_id);
+                if (job.status === 'cancelled') {
+                    throw new Error(`已取消: ${job.error || '任务已取消'}`);
+                }
+                if (job.status !== 'succeeded') {
+                    throw new Error(job.error || '重建失败');
+                }
+                result = job.result;
+            }
+            
             // 更新进度
             uploadProgressBar.style.width = '100%';
-            
-            // 获取结果
-            const result = await response.json();
             console.log(result.message);
             uploadStatus.textContent = result.message;
             
@@ -351,7 +389,13 @@ document.addEventListener('DOMContentLoaded', function() {
                 fetchFileList();
                 
                 // 添加系统消息
-                addSystemMessage(`索引已重建，共处理了${result.processed_files.length}个PDF文件`);
+                addSystemMessage(`索引已重建，共处理了${(result.processed_files || []).length}个PDF文件`);
+                
+                // 处理失败的文件保留原有内容，下次重建时再次处理
+                const failedFiles = result.failed_files || [];
+                if (failedFiles.length > 0) {
+                    addSystemMessage(`以下文件入库失败，已保留原有内容：${failedFiles.map(f => `${f.name}（${f.error}）`).join('；')}`);
+                }
             }, 1500);
             
         } catch (error) {
@@ -394,23 +438,32 @@ document.addEventListener('DOMContentLoaded', function() {
             const formData = new FormData();
             formData.append('question', question);
             formData.append('question_type', questionType);
+            formData.append('stream', 'true');
             
             const response = await fetch('/ask', {
                 method: 'POST',
                 body: formData
             });
             
-            const data = await response.json();
-            
-            // 移除思考指示器
-            removeThinkingIndicator(thinkingId);
-            
-            // 添加机器人回复
-            addBotMessage(data.answer || "抱歉，未能获取回答");
+            let answer;
+            const contentType = response.headers.get('Content-Type') || '';
+            if (contentType.includes('text/event-stream') && response.body) {
+                // 流式回答：收到第一段文字时就开始显示
+                answer = await readAnswerStream(response, thinkingId);
+            } else {
+                const data = await response.json();
+                
+                // 移除思考指示器
+                removeThinkingIndicator(thinkingId);
+                
+                // 添加机器人回复
+                answer = data.answer;
+                addBotMessage(answer || "抱歉，未能获取回答");
+            }
             
             // 保存到对话历史
             if (typeof saveMessageToHistory === 'function' && typeof currentChatId !== 'undefined') {
-                saveMessageToHistory('bot', data.answer);
+                saveMessageToHistory('bot', answer);
                 
                 // 如果是第一条消息，更新对话标题
                 if (conversations[currentChatId].messages.length <= 2) {
@@ -436,6 +489,59 @@ document.addEventListener('DOMContentLoaded', function() {
         scrollToBottom();
     }
     
+    // 读取 /ask 的 Server-Sent Events 流，逐段更新回答
+    async function readAnswerStream(response, thinkingId) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let answer = '';
+        let message = null;
+        
+        const appendText = (text) => {
+            answer += text;
+            if (!message) {
+                removeThinkingIndicator(thinkingId);
+                message = addBotMessage(answer);
+            } else {
+                renderBotMessage(message, answer);
+                scrollToBottom();
+            }
+        };
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // 事件之间以空行分隔
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let eventName = 'message';
+                let data = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                
+                const payload = data ? JSON.parse(data) : {};
+                if (eventName === 'token') {
+                    appendText(payload.content || '');
+                } else if (eventName === 'error') {
+                    appendText(payload.message || '');
+                }
+            }
+        }
+        
+        if (!message) {
+            removeThinkingIndicator(thinkingId);
+            addBotMessage(answer || "抱歉，未能获取回答");
+        }
+        return answer;
+    }
+    
     // 添加用户消息
     function addUserMessage(content) {
         const message = document.createElement('div');
@@ -461,6 +567,14 @@ document.addEventListener('DOMContentLoaded', function() {
         const message = document.createElement('div');
         message.className = 'message bot-message';
         
+        renderBotMessage(message, content);
+        chatContainer.appendChild(message);
+        scrollToBottom();
+        return message;
+    }
+    
+    // 渲染机器人消息内容（流式回答时会被重复调用）
+    function renderBotMessage(message, content) {
         // 处理填空题答案格式
         let processedContent = content;
         const fillBlankMatch = content.match(/答案是"([^"]+)"，来自\[(.*?)第(\d+)页\]/i);
@@ -515,8 +629,6 @@ document.addEventListener('DOMContentLoaded', function() {
             </div>
         `;
         
-        chatContainer.appendChild(message);
-        
         // 添加语法高亮
         const codeBlocks = message.querySelectorAll('pre code');
         if (window.hljs && codeBlocks.length > 0) {
@@ -524,8 +636,6 @@ document.addEventListener('DOMContentLoaded', function() {
                 hljs.highlightElement(block);
             });
         }
-        
-        scrollToBottom();
     }
     
     // 添加系统消息